@@ -3,19 +3,378 @@ import json
 import logging
 import re
 
+from concurrent import futures
 from datetime import datetime
 from requests.utils import dict_from_cookiejar
-from threading import Thread, Timer
+from threading import Event, Lock, Thread, Timer
 from websocket import create_connection
 
-from streamlink.exceptions import PluginError
+from streamlink.exceptions import PluginError, StreamError
 from streamlink.plugin import Plugin, PluginArgument, PluginArguments
 from streamlink.plugin.api import useragents, validate
 from streamlink.stream import RTMPStream
+from streamlink.stream.wrappers import StreamIOWrapper
 
 log = logging.getLogger(__name__)
 
 
+class FC2Heartbeat(Thread):
+    '''Sends the heartbeat of all FC2 control connections'''
+
+    interval = 30.0
+    _lock = Lock()
+    _thread = None
+
+    def __init__(self):
+        Thread.__init__(self, name='Thread-FC2Heartbeat')
+        self.daemon = True
+        self.controls = set()
+        self._wait = Event()
+
+    @classmethod
+    def add(cls, control):
+        with cls._lock:
+            if cls._thread is None:
+                cls._thread = cls()
+                cls._thread.start()
+            cls._thread.controls.add(control)
+
+    @classmethod
+    def remove(cls, control):
+        with cls._lock:
+            if cls._thread is not None:
+                cls._thread.controls.discard(control)
+
+    def run(self):
+        while not self._wait.wait(self.interval):
+            with self._lock:
+                controls = list(self.controls)
+            for control in controls:
+                control.heartbeat()
+
+
+class FC2Control(object):
+    '''Control WebSocket of a FC2 channel'''
+
+    # seconds to wait for the media server information
+    timeout = 30.0
+    # seconds a control is kept for a reconnect after the stream dropped
+    grace_timeout = 60.0
+
+    def __init__(self, ws_url):
+        self.ws_url = ws_url
+        self.ws = None
+        self.grace_timer = None
+        self.lock = Lock()
+        self.count = 0
+        self.count_ping = 0
+        self.host_data = None
+        self.host_event = Event()
+
+    def payload_msg(self, name):
+        ''' Format the WebSocket message '''
+        self.count_ping += 1
+        payload = json.dumps(
+            {
+                'name': str(name),
+                'arguments': {},
+                'id': int(self.count_ping)
+            }
+        )
+        return payload
+
+    def send(self, name):
+        try:
+            self.ws.send(self.payload_msg(name))
+        except Exception as err:
+            log.debug('Failed to send {0}: {1}'.format(name, err))
+            self.close()
+            return False
+        return True
+
+    def heartbeat(self):
+        ''' ping the WebSocket '''
+        if self.ws.connected is True:
+            self.send('heartbeat')
+        else:
+            FC2Heartbeat.remove(self)
+
+    def connect(self):
+        log.debug('_get_ws_data ...')
+        self.ws = create_connection(self.ws_url)
+        self.send('heartbeat')
+        FC2Heartbeat.add(self)
+
+        # WebSocket background process
+        t2 = Thread(target=self.recv, name='Thread-FC2Control')
+        t2.daemon = True
+        t2.start()
+
+    def acquire(self):
+        '''Keeps a released control open'''
+        with self.lock:
+            if self.grace_timer is not None:
+                self.grace_timer.cancel()
+                self.grace_timer = None
+
+    def release(self):
+        '''Closes the control after grace_timeout, unless it is acquired again'''
+        with self.lock:
+            if self.grace_timer is not None:
+                return
+            log.debug('Control WebSocket is closed in {0} seconds'.format(self.grace_timeout))
+            self.grace_timer = Timer(self.grace_timeout, self.close)
+            self.grace_timer.daemon = True
+            self.grace_timer.start()
+
+    def close(self):
+        self.acquire()
+        FC2Heartbeat.remove(self)
+        self.host_event.set()
+        if self.ws is not None:
+            self.ws.close()
+
+    def media_server_information(self):
+        ''' request and wait for the media server information '''
+        self.host_event.clear()
+        self.host_data = None
+        if not self.send('get_media_server_information'):
+            return None
+        if not self.host_event.wait(self.timeout):
+            log.debug('host_timeout is True')
+            return None
+        return self.host_data
+
+    def recv(self):
+        ''' print WebSocket messages '''
+        try:
+            while True:
+                self.count += 1
+                data = json.loads(self.ws.recv())
+                if not self.on_message(data):
+                    break
+        except Exception as err:
+            if self.ws.connected:
+                log.debug('WebSocket error: {0}'.format(err))
+        finally:
+            self.close()
+
+    def on_message(self, data):
+        time_utc = datetime.utcnow().strftime('%H:%M:%S UTC')
+        if data['name'] not in ['comment', 'ng_commentq',
+                                'user_count', 'ng_comment']:
+            log.debug('{0} - {1} - {2}'.format(
+                time_utc, self.count, data['name']))
+
+        if (data['name'] == '_response_'
+                and data['arguments'].get('host')):
+            log.debug('Found host data')
+            self.host_data = data['arguments']
+            self.host_event.set()
+        elif data['name'] == 'media_connection':
+            log.debug('successfully opened stream')
+        elif data['name'] == 'control_disconnection':
+            # User with points restricted program being broadcasted
+            if data.get('arguments').get('code') == 4512:
+                log.debug('Disconnected from Server')
+            return False
+        elif data['name'] == 'publish_stop':
+            log.debug('Stream ended')
+        elif data['name'] == 'channel_information':
+            if data['arguments'].get('fee') != 0:
+                log.error('Stream requires a fee now.')
+                return False
+        elif data['name'] == 'media_disconnection':
+            # the media token can't be used again
+            self.host_data = None
+            if data.get('arguments').get('code') == 104:
+                log.warning('Disconnected. '
+                            'Multiple connections has been detected.')
+            elif data.get('arguments').get('code'):
+                log.debug('error code {0}'.format(
+                    data['arguments']['code']))
+        return True
+
+
+class FC2RTMPStreamIO(StreamIOWrapper):
+    '''Closes the control WebSocket with the stream
+
+    The control of a dropped stream, when rtmpdump exits,
+    is released and kept for a reconnect until the grace timeout.
+    '''
+
+    def __init__(self, fd, control):
+        StreamIOWrapper.__init__(self, fd)
+        self.control = control
+        self.stopped = False
+        t = Thread(target=self._wait_process, name='Thread-FC2RTMPStreamIO')
+        t.daemon = True
+        t.start()
+
+    def _wait_process(self):
+        self.fd.process.wait()
+        if not self.stopped:
+            self.control.release()
+
+    def close(self):
+        dropped = self.fd.process.poll() is not None
+        self.stopped = True
+        StreamIOWrapper.close(self)
+        if dropped:
+            self.control.release()
+        else:
+            self.control.close()
+
+
+class FC2RTMPStream(RTMPStream):
+    '''RTMPStream with a new media token for a reconnect
+
+    The control WebSocket is used again after a failed open()
+    and after a dropped stream until the grace timeout, it is closed
+    with a running stream. A reconnect after the grace timeout
+    connects a new control WebSocket.
+    '''
+
+    def __init__(self, session, params, plugin, control, **kwargs):
+        RTMPStream.__init__(self, session, params, **kwargs)
+        self.plugin = plugin
+        self.control = control
+        self.token_used = False
+
+    def open(self):
+        if self.token_used or not self.control.host_data:
+            log.debug('Requesting a new media token')
+            self.control = self.plugin._get_ws_data(self.control)
+            if not self.control:
+                raise StreamError('No media server information found')
+            self.parameters.update(self.plugin._rtmp_params(self.control.host_data))
+        self.token_used = True
+        return FC2RTMPStreamIO(RTMPStream.open(self), self.control)
+
+
+class FC2MonitorControl(FC2Control):
+    '''Control WebSocket of a live channel of FC2Monitor'''
+
+    def __init__(self, ws_url, monitor, user_id):
+        FC2Control.__init__(self, ws_url)
+        self.monitor = monitor
+        self.user_id = user_id
+        # on_online was called
+        self.announced = False
+
+    def close(self):
+        FC2Control.close(self)
+        self.monitor.offline(self.user_id)
+
+    def on_message(self, data):
+        if data['name'] == 'publish_stop':
+            log.debug('Stream ended')
+            return False
+        return FC2Control.on_message(self, data)
+
+
+class FC2Monitor(Thread):
+    '''Live status of multiple FC2 channels
+
+    Offline channels are checked together every interval with one
+    request each, live channels keep their control WebSocket open
+    and are offline as soon as it is closed or the stream ended.
+    '''
+
+    interval = 60.0
+    workers = 4
+
+    def __init__(self, plugin, channels, on_online=None, on_offline=None):
+        Thread.__init__(self, name='Thread-FC2Monitor')
+        self.daemon = True
+        self.plugin = plugin
+        self.channels = list(channels)
+        self.on_online = on_online
+        self.on_offline = on_offline
+        self.controls = {}
+        self.lock = Lock()
+        self._wait = Event()
+
+    def check(self, user_id):
+        ''' returns the WebSocket URL of a live channel '''
+        try:
+            version = self.plugin._get_version(user_id)
+            return self.plugin._get_ws_url(user_id, version)
+        except PluginError as err:
+            log.debug('{0}: {1}'.format(user_id, err))
+        except Exception as err:
+            # a single channel does not stop the monitor
+            log.error('Failed to check {0}: {1!r}'.format(user_id, err))
+
+    def poll(self):
+        with self.lock:
+            user_ids = [u for u in self.channels if u not in self.controls]
+        if not user_ids:
+            return
+        with futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            ws_urls = list(executor.map(self.check, user_ids))
+        for user_id, ws_url in zip(user_ids, ws_urls):
+            if ws_url and not self._wait.is_set():
+                self.online(user_id, ws_url)
+
+    def online(self, user_id, ws_url):
+        '''A channel is online after its control WebSocket is connected'''
+        control = FC2MonitorControl(ws_url, self, user_id)
+        with self.lock:
+            self.controls[user_id] = control
+        try:
+            control.connect()
+        except Exception as err:
+            log.debug('Failed to connect {0}: {1}'.format(user_id, err))
+            control.close()
+            return
+        with self.lock:
+            # the control can be closed by the server already
+            if self.controls.get(user_id) is not control:
+                return
+            control.announced = True
+        log.info('{0} is online'.format(user_id))
+        if self.on_online:
+            self.on_online(user_id)
+
+    def offline(self, user_id):
+        with self.lock:
+            control = self.controls.pop(user_id, None)
+            if control is None or not control.announced:
+                return
+        log.info('{0} is offline'.format(user_id))
+        if self.on_offline:
+            self.on_offline(user_id)
+
+    def add(self, user_id):
+        with self.lock:
+            if user_id not in self.channels:
+                self.channels.append(user_id)
+
+    def remove(self, user_id):
+        with self.lock:
+            if user_id in self.channels:
+                self.channels.remove(user_id)
+            control = self.controls.pop(user_id, None)
+        if control:
+            control.close()
+
+    def run(self):
+        while not self._wait.is_set():
+            try:
+                self.poll()
+            except Exception as err:
+                log.error('Failed to poll the channels: {0!r}'.format(err))
+            self._wait.wait(self.interval)
+
+    def close(self):
+        self._wait.set()
+        with self.lock:
+            controls = list(self.controls.values())
+        for control in controls:
+            control.close()
+
+
 class FC2(Plugin):
 
     url_login = 'https://secure.id.fc2.com/?mode=login&switch_language=en'
@@ -34,6 +393,7 @@ class FC2(Plugin):
                 'login_only': int,
                 'version': validate.text,
                 'fee': int,
+                validate.optional('is_publish'): int,
             },
             'user_data': {
                 'is_login': int,
@@ -47,12 +407,6 @@ class FC2(Plugin):
         }
     })
 
-    count = 0
-    count_ping = 0
-
-    host_data = ''
-    host_found = False
-
     arguments = PluginArguments(
         PluginArgument(
             'username',
@@ -115,24 +469,16 @@ class FC2(Plugin):
         if channel_data['fee'] != 0:
             raise PluginError('Only streams without a fee are supported.')
 
+        # an offline channel needs no control server request
+        if channel_data.get('is_publish') == 0:
+            raise PluginError('The broadcaster is currently not available')
+
         version = channel_data['version']
         if user_data['is_login']:
             log.info('Logged in as {0}'.format(user_data['name']))
         log.debug('Found version: {0}'.format(version))
         return version
 
-    def payload_msg(self, name):
-        ''' Format the WebSocket message '''
-        self.count_ping += 1
-        payload = json.dumps(
-            {
-                'name': str(name),
-                'arguments': {},
-                'id': int(self.count_ping)
-            }
-        )
-        return payload
-
     def _get_ws_url(self, user_id, version):
         log.debug('_get_ws_url ...')
         data = {
@@ -152,83 +498,38 @@ class FC2(Plugin):
         log.debug('WS URL: {0}'.format(ws_url))
         return ws_url
 
-    def _get_ws_data(self, ws_url):
-        log.debug('_get_ws_data ...')
-        ws = create_connection(ws_url)
-        ws.send(self.payload_msg('get_media_server_information'))
-
-        def ws_ping():
-            ''' ping the WebSocket '''
-            if ws.connected is True:
-                t1 = Timer(30.0, ws_ping)
-                t1.daemon = True
-                t1.start()
-                ws.send(self.payload_msg('heartbeat'))
-
-        def ws_recv():
-            ''' print WebSocket messages '''
-            while True:
-                self.count += 1
-                data = json.loads(ws.recv())
-                time_utc = datetime.utcnow().strftime('%H:%M:%S UTC')
-                if data['name'] not in ['comment', 'ng_commentq',
-                                        'user_count', 'ng_comment']:
-                    log.debug('{0} - {1} - {2}'.format(
-                        time_utc, self.count, data['name']))
-
-                if (data['name'] == '_response_'
-                        and data['arguments'].get('host')):
-                    log.debug('Found host data')
-                    self.host_data = data
-                    self.host_found = True
-                elif data['name'] == 'media_connection':
-                    log.debug('successfully opened stream')
-                elif data['name'] == 'control_disconnection':
-                    if self.count <= 30:
-                        # User with points restricted program being broadcasted
-                        self.count = 30
-                    if data.get('arguments').get('code') == 4512:
-                        log.debug('Disconnected from Server')
-                    break
-                elif data['name'] == 'publish_stop':
-                    log.debug('Stream ended')
-                elif data['name'] == 'channel_information':
-                    if data['arguments'].get('fee') != 0:
-                        log.error('Stream requires a fee now.'.format(
-                            data['arguments'].get('fee')))
-                        break
-                elif data['name'] == 'media_disconnection':
-                    if data.get('arguments').get('code') == 104:
-                        log.warning('Disconnected. '
-                                    'Multiple connections has been detected.')
-                    elif data.get('arguments').get('code'):
-                        log.debug('error code {0}'.format(
-                            data['arguments']['code']))
-
-            ws.close()
+    def _get_ws_data(self, control=None):
+        ''' returns a control WebSocket with new media server information,
+            an open control WebSocket is used again
+        '''
+        if control is not None:
+            control.acquire()
+            if control.ws.connected and control.media_server_information():
+                return control
+            log.debug('Control WebSocket closed, reconnecting')
+            control.close()
+
+        user_id = self._url_re.match(self.url).group('user_id')
+        version = self._get_version(user_id)
+        ws_url = self._get_ws_url(user_id, version)
 
-        # WebSocket background process
-        ws_ping()
-        t2 = Thread(target=ws_recv)
-        t2.daemon = True
-        t2.start()
+        control = FC2Control(ws_url)
+        control.connect()
+        if not control.media_server_information():
+            control.close()
+            return None
+        return control
 
-        # wait for the WebSocket
-        host_timeout = False
-        while self.host_found is False:
-            if self.host_found is True:
-                break
-            if self.count >= 30:
-                host_timeout = True
-                break
-
-        log.debug('host_timeout is {0}'.format(host_timeout))
-        if host_timeout:
-            return False
-        return True
+    def monitor(self, channels, on_online=None, on_offline=None):
+        '''Starts a FC2Monitor for a list of channel ids
 
-    def _get_rtmp(self, data):
-        log.debug('_get_rtmp ...')
+        on_online and on_offline are called with the channel id.
+        '''
+        monitor = FC2Monitor(self, channels, on_online, on_offline)
+        monitor.start()
+        return monitor
+
+    def _rtmp_params(self, data):
 
         app = '{0}?media_token={1}'.format(
             data['application'], data['media_token'])
@@ -244,7 +545,12 @@ class FC2(Plugin):
             'playpath': data['play_rtmp_stream'],
             'host': host,
         }
-        yield 'live', RTMPStream(self.session, params)
+        return params
+
+    def _get_rtmp(self, control):
+        log.debug('_get_rtmp ...')
+        params = self._rtmp_params(control.host_data)
+        yield 'live', FC2RTMPStream(self.session, params, self, control)
 
     def cmp_cookies_list(self, cookies_list):
         required_cookies = [
@@ -259,7 +565,7 @@ class FC2(Plugin):
         return (count == len(required_cookies))
 
     def _get_streams(self):
-        log.debug('Version 2018-08-19')
+        log.debug('Version 2026-10-19')
         log.info('This is a custom plugin.')
 
         if self.options.get('purge_credentials'):
@@ -289,12 +595,9 @@ class FC2(Plugin):
         if not match:
             return
 
-        user_id = match.group('user_id')
-
-        version = self._get_version(user_id)
-        ws_url = self._get_ws_url(user_id, version)
-        if self._get_ws_data(ws_url):
-            return self._get_rtmp(self.host_data['arguments'])
+        control = self._get_ws_data()
+        if control:
+            return self._get_rtmp(control)
 
 
 __plugin__ = FC2
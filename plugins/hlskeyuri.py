@@ -1,21 +1,211 @@
 import logging
 import re
 
+from collections import OrderedDict
+from concurrent import futures
+from threading import Lock
+from time import time
+
 from Crypto.Cipher import AES
 
 from streamlink import StreamError
-from streamlink.compat import urlparse
+from streamlink.compat import queue, urlparse
 from streamlink.plugin import Plugin, PluginArgument, PluginArguments
 from streamlink.plugin.api import useragents
+from streamlink.utils.args import num
 from streamlink.plugin.plugin import parse_url_params
 from streamlink.stream import HLSStream
-from streamlink.stream.hls import HLSStreamWriter, HLSStreamReader, num_to_iv
+from streamlink.stream.hls import HLSStreamWorker, HLSStreamWriter, HLSStreamReader, num_to_iv, pkcs7_decode
 from streamlink.utils import update_scheme
 
 log = logging.getLogger(__name__)
 
 
+class KeyUriCache(object):
+    '''LRU cache of the key requests with a max. age
+
+    The futures of the requests are stored,
+    a key that is already requested is not requested again.
+    '''
+
+    def __init__(self, maxsize=32, ttl=3600):
+        self.lock = Lock()
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.keys = OrderedDict()
+
+    def get(self, uri, fetch):
+        '''Returns the future of a key, fetch(uri) is used for a new key'''
+        with self.lock:
+            item = self.keys.pop(uri, None)
+            if item is not None:
+                timestamp, future = item
+                if (time() - timestamp > self.ttl
+                        or (future.done() and future.exception() is not None)):
+                    item = None
+            if item is None:
+                item = (time(), fetch(uri))
+            # the last used key is at the end
+            self.keys[uri] = item
+            while len(self.keys) > self.maxsize:
+                self.keys.popitem(last=False)
+            return item[1]
+
+
+class KeyUriDecryptPool(object):
+    '''Thread pool of all streams for the decryption of segments,
+    the AES functions release the GIL.
+
+    The pool is created with the threads of the first stream,
+    the same pool is used for every later stream.
+    '''
+
+    _lock = Lock()
+    _executor = None
+    _threads = None
+
+    @classmethod
+    def get(cls, threads):
+        with cls._lock:
+            if cls._executor is None:
+                log.debug('Decrypt threads: {0}'.format(threads))
+                cls._executor = futures.ThreadPoolExecutor(max_workers=threads)
+                cls._threads = threads
+            elif threads != cls._threads:
+                log.warning('Decrypt threads: {0} is ignored, the shared pool '
+                            'has {1} threads'.format(threads, cls._threads))
+            return cls._executor
+
+
+class KeyUriPoolDecryptor(object):
+    '''AES-128 CBC decryption of the chunks of a segment in the shared pool
+
+    Every chunk gets its own cipher with the last encrypted block
+    of the previous chunk as IV, the chunks do not wait for each other.
+    '''
+
+    def __init__(self, pool, key_data, iv):
+        self.pool = pool
+        self.key_data = key_data
+        self.iv = iv
+
+    def cipher(self, data):
+        cipher = AES.new(self.key_data, AES.MODE_CBC, self.iv)
+        self.iv = bytes(data[-16:])
+        return cipher
+
+    def submit(self, data):
+        '''Returns the future of a decrypted chunk'''
+        data = bytes(data)
+        return self.pool.submit(self.cipher(data).decrypt, data)
+
+    def decrypt(self, data):
+        return self.cipher(data).decrypt(data)
+
+
+class KeyUriSegment(object):
+    '''Chunks of a segment from the fetch thread to the writer
+
+    The queue is bounded, the fetch thread waits until the writer
+    has written the previous chunks. None is the end of the segment.
+    A chunk of the decrypt pool is a future, the writer waits for it.
+    '''
+
+    def __init__(self, writer, size):
+        self.writer = writer
+        self.queue = queue.Queue(size)
+        # bytes passed to the writer
+        self.size = 0
+        # bytes of a new download that were already passed
+        self.skip = 0
+        self.complete = False
+
+    def write(self, data, size=None):
+        '''data is a chunk, or the future of a chunk of size bytes'''
+        if size is None:
+            size = len(data)
+        if self.skip:
+            if isinstance(data, futures.Future):
+                data = data.result()
+            skip = min(self.skip, size)
+            self.skip -= skip
+            size -= skip
+            data = data[skip:]
+        if size:
+            self.size += size
+            self.writer.queue(self.queue, data)
+
+    def retry(self):
+        '''The chunks of a new download start at the beginning of the segment'''
+        self.skip = self.size
+
+    def close(self, complete):
+        self.complete = complete
+        self.writer.queue(self.queue, None)
+
+
 class KeyUriHLSStreamWriter(HLSStreamWriter):
+    _key_uri_re = re.compile(r'\$\{(scheme|netloc|path|query)\}')
+    # bytes of a segment that are downloaded and decrypted at once
+    chunk_size = 64 * 1024
+    # chunks of a segment that wait for the writer
+    segment_queue_size = 16
+
+    def __init__(self, reader, *args, **kwargs):
+        HLSStreamWriter.__init__(self, reader, *args, **kwargs)
+        self.key_cache = KeyUriCache()
+        self.key_executor = futures.ThreadPoolExecutor(max_workers=2)
+        # literal parts and item names of the Key-URI template
+        template = HLSKeyUriPlugin.get_option('key_uri')
+        self.key_uri_parts = self._key_uri_re.split(template) if template else None
+        self.key_uris = {}
+        threads = HLSKeyUriPlugin.get_option('decrypt_threads')
+        self.decrypt_pool = KeyUriDecryptPool.get(threads) if threads else None
+
+    def close(self):
+        HLSStreamWriter.close(self)
+        self.key_executor.shutdown(wait=False)
+
+    def repair_key_uri(self, uri):
+        if not self.key_uri_parts:
+            return uri
+
+        new_key_uri = self.key_uris.get(uri)
+        if new_key_uri is None:
+            # Repair a broken key-uri
+            log.debug('Old Key-URI: {0}'.format(uri))
+            parsed_uri = urlparse(uri)
+            items = {
+                'scheme': '{0}://'.format(parsed_uri.scheme),
+                'netloc': parsed_uri.netloc,
+                'path': parsed_uri.path,
+                'query': '?{0}'.format(parsed_uri.query),
+            }
+            new_key_uri = ''.join(items[part] if index % 2 else part
+                                  for index, part in enumerate(self.key_uri_parts))
+            log.debug('New Key-URI: {0}'.format(new_key_uri))
+            if len(self.key_uris) >= 1000:
+                self.key_uris.clear()
+            self.key_uris[uri] = new_key_uri
+        return new_key_uri
+
+    def fetch_key(self, uri):
+        res = self.session.http.get(uri, exception=StreamError,
+                                    retries=self.retries,
+                                    **self.reader.request_params)
+        return res.content
+
+    def get_key(self, uri):
+        '''Returns the future of a key request'''
+        return self.key_cache.get(self.repair_key_uri(uri),
+                                  lambda uri: self.key_executor.submit(self.fetch_key, uri))
+
+    def prefetch_keys(self, keys):
+        '''Requests the keys of the next segments'''
+        for uri in set(key.uri for key in keys
+                       if key and key.method == 'AES-128' and key.uri):
+            self.get_key(uri)
+
     def create_decryptor(self, key, sequence):
 
         if key.method != 'AES-128':
@@ -26,40 +216,176 @@ class KeyUriHLSStreamWriter(HLSStreamWriter):
 
         if self.key_uri != key.uri:
             log.debug('Diff Key-URI')
-            new_key_uri = key.uri
-            if HLSKeyUriPlugin.get_option('key_uri'):
-                # Repair a broken key-uri
-                log.debug('Old Key-URI: {0}'.format(new_key_uri))
-                parsed_uri = urlparse(new_key_uri)
-                new_key_uri = HLSKeyUriPlugin.get_option('key_uri')
-                new_data_list = [
-                    (r'\$\{scheme\}', '{0}://'.format(parsed_uri.scheme)),
-                    (r'\$\{netloc\}', parsed_uri.netloc),
-                    (r'\$\{path\}', parsed_uri.path),
-                    (r'\$\{query\}', '?{0}'.format(parsed_uri.query)),
-                ]
-                for _at_re, _old_data in new_data_list:
-                    new_key_uri = re.sub(_at_re, _old_data, new_key_uri)
-                log.debug('New Key-URI: {0}'.format(new_key_uri))
-            res = self.session.http.get(new_key_uri, exception=StreamError,
-                                        retries=self.retries,
-                                        **self.reader.request_params)
-            self.key_data = res.content
-            self.key_uri = key.uri
+        # decryptors can be created by multiple threads
+        key_data = self.key_data = self.get_key(key.uri).result()
+        self.key_uri = key.uri
 
         iv = key.iv or num_to_iv(sequence)
 
         # Pad IV if needed
         iv = b'\x00' * (16 - len(iv)) + iv
 
-        return AES.new(self.key_data, AES.MODE_CBC, iv)
+        if self.decrypt_pool:
+            return KeyUriPoolDecryptor(self.decrypt_pool, key_data, iv)
+        return AES.new(key_data, AES.MODE_CBC, iv)
+
+    def put(self, sequence):
+        '''Adds a segment to the download pool and write queue,
+        the writer gets the chunks of a segment while it is downloaded'''
+        if self.closed:
+            return
+
+        future = None
+        if sequence is not None:
+            segment = KeyUriSegment(self, self.segment_queue_size)
+            self.executor.submit(self.fetch, sequence, segment, retries=self.retries)
+            future = futures.Future()
+            future.set_result(segment)
+
+        self.queue(self.futures, (sequence, future))
+
+    def fetch(self, sequence, segment, retries=None):
+        '''Downloads a segment in the fetch thread,
+        encrypted segments are decrypted while they are downloaded'''
+        complete = False
+        try:
+            complete = self.fetch_chunks(sequence, segment, retries)
+        finally:
+            segment.close(complete)
+
+    def fetch_chunks(self, sequence, segment, retries):
+        if self.closed or not retries:
+            return False
+
+        key = sequence.segment.key
+        encrypted = bool(key and key.method != 'NONE')
+        try:
+            # the retries request the same byte range
+            request_params = self.create_request_params(sequence)
+            # skip ignored segment names
+            if self.ignore_names and self.ignore_names_re.search(sequence.segment.uri):
+                log.debug('Skipping segment {0}'.format(sequence.num))
+                return False
+
+            decryptor = encrypted and self.create_decryptor(key, sequence.num)
+        except StreamError as err:
+            log.error('Failed to create decryptor: {0}'.format(err))
+            self.close()
+            return False
+
+        while retries and not self.closed:
+            retries -= 1
+            try:
+                res = self.session.http.get(sequence.segment.uri,
+                                            stream=True,
+                                            timeout=self.timeout,
+                                            exception=StreamError,
+                                            retries=self.retries,
+                                            **request_params)
+            except StreamError as err:
+                log.error('Failed to open segment {0}: {1}'.format(sequence.num, err))
+                return False
+
+            try:
+                chunks = self.iter_content(res)
+                if encrypted:
+                    self.write_decrypted(decryptor, chunks, segment.write)
+                else:
+                    for chunk in chunks:
+                        segment.write(chunk)
+                return not self.closed
+            except IOError as err:
+                log.error('Failed to download segment {0}: {1}'.format(sequence.num, err))
+                # the written chunks are skipped, a new download
+                # is decrypted with a new decryptor
+                segment.retry()
+                if encrypted:
+                    decryptor = self.create_decryptor(key, sequence.num)
+            except StreamError as err:
+                log.error('Failed to decrypt segment {0}: {1}'.format(sequence.num, err))
+                return False
+            finally:
+                res.close()
+        return False
+
+    def iter_content(self, res):
+        for chunk in res.iter_content(self.chunk_size):
+            if self.closed:
+                break
+            yield chunk
+
+    def write(self, sequence, segment, chunk_size=8192):
+        while not self.closed:
+            try:
+                chunk = segment.queue.get(block=True, timeout=0.5)
+            except queue.Empty:
+                continue
+            if chunk is None:
+                break
+            if isinstance(chunk, futures.Future):
+                chunk = chunk.result()
+            self.reader.buffer.write(chunk)
+
+        if segment.complete:
+            log.debug('Download of segment {0} complete'.format(sequence.num))
+
+    def write_decrypted(self, decryptor, chunks, write):
+        '''Decrypts the chunks of a segment with the padding removed,
+        the chunks of the decrypt pool are written as futures'''
+        data = bytearray()
+        for chunk in chunks:
+            data += chunk
+            # the last two blocks are kept for the padding
+            # and garbage after the last block
+            size = max((len(data) - 17) // 16 * 16, 0)
+            if size:
+                view = memoryview(data)
+                try:
+                    if self.decrypt_pool:
+                        decrypted_chunk = decryptor.submit(view[:size])
+                    else:
+                        decrypted_chunk = decryptor.decrypt(view[:size])
+                finally:
+                    view.release()
+                del data[:size]
+                write(decrypted_chunk, size)
+
+        # If the input data is not a multiple of 16, cut off any garbage
+        garbage_len = len(data) % 16
+        if garbage_len:
+            log.debug('Cutting off {0} bytes of garbage '
+                      'before decrypting'.format(garbage_len))
+            del data[-garbage_len:]
+        if data:
+            write(pkcs7_decode(decryptor.decrypt(bytes(data))))
+
+
+class KeyUriHLSStreamWorker(HLSStreamWorker):
+    def process_sequences(self, playlist, sequences):
+        HLSStreamWorker.process_sequences(self, playlist, sequences)
+        # the keys are available before the segments are written
+        self.writer.prefetch_keys(s.segment.key for s in sequences
+                                  if s.num >= self.playlist_sequence)
 
 
 class KeyUriHLSStreamReader(HLSStreamReader):
+    __worker__ = KeyUriHLSStreamWorker
     __writer__ = KeyUriHLSStreamWriter
 
 
 class KeyUriHLSStream(HLSStream):
+    @classmethod
+    def from_stream(cls, stream, **params):
+        '''Creates a hlskeyuri stream from a resolved HLSStream'''
+        args = dict(stream.args)
+        args.pop('url', None)
+        args.update(params)
+        return cls(stream.session, stream.url,
+                   force_restart=stream.force_restart,
+                   start_offset=stream.start_offset,
+                   duration=stream.duration,
+                   **args)
+
     def open(self):
         reader = KeyUriHLSStreamReader(self)
         reader.open()
@@ -69,6 +395,7 @@ class KeyUriHLSStream(HLSStream):
 
 class HLSKeyUriPlugin(Plugin):
     _url_re = re.compile(r'(hlskeyuri://)(.+(?:\.m3u8)?.*)')
+    _synonyms = ('best', 'worst', 'best-unfiltered', 'worst-unfiltered')
 
     arguments = PluginArguments(
         PluginArgument(
@@ -90,6 +417,27 @@ class HLSKeyUriPlugin(Plugin):
 
             '''
         ),
+        PluginArgument(
+            'decrypt-threads',
+            type=num(int, min=1),
+            metavar='THREADS',
+            help='''
+            Decrypt the segments of all streams in a shared pool
+            of THREADS threads, instead of the fetch threads of a stream.
+
+            A segment is downloaded by a fetch thread, its chunks
+            are decrypted in the pool while it is downloaded.
+            The fetch thread does not wait for the pool, the writer
+            waits for the decrypted chunks in the order of the segment.
+            A segment has at most 16 chunks in the pool, a stream
+            does not block the pool for the other streams.
+
+            The pool is created by the first stream, the THREADS
+            of a later stream in the same process are ignored.
+
+            Default is Disabled.
+            '''
+        ),
     )
 
     @classmethod
@@ -98,7 +446,7 @@ class HLSKeyUriPlugin(Plugin):
 
     def _get_streams(self):
         self.session.http.headers.update({'User-Agent': useragents.FIREFOX})
-        log.debug('Version 2018-07-12')
+        log.debug('Version 2026-10-19')
         log.info('This is a custom plugin. '
                  'For support visit https://github.com/back-to/plugins')
 
@@ -114,15 +462,11 @@ class HLSKeyUriPlugin(Plugin):
                       ' stream is not available.')
             return
 
-        stream = streams['best']
-        urlnoproto = stream.url
-
         log.debug('URL={0}; params={1}', urlnoproto, params)
-        streams = KeyUriHLSStream.parse_variant_playlist(self.session, urlnoproto, **params)
-        if not streams:
-            return {'live': KeyUriHLSStream(self.session, urlnoproto, **params)}
-        else:
-            return streams
+        # the resolved streams are used, without a new request
+        return dict((name, KeyUriHLSStream.from_stream(stream, **params))
+                    for name, stream in streams.items()
+                    if name not in self._synonyms and isinstance(stream, HLSStream))
 
 
 __plugin__ = HLSKeyUriPlugin
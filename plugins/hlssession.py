@@ -1,61 +1,1623 @@
+import hashlib
+import json
 import logging
+import math
+import os
 import re
 
+from collections import deque, namedtuple
+from concurrent import futures
+from datetime import datetime
+from isodate import parse_datetime, ISO8601Error, UTC
+from requests import Response
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.exceptions import ConnectionError as RequestsConnectionError, Timeout
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers, select_proxy
+from threading import Condition, Event, Lock, Thread
 from time import time
 
-from streamlink import StreamError
+from streamlink import NoPluginError, PluginError, StreamError
+from streamlink.buffers import RingBuffer
+from streamlink.cache import Cache
+from streamlink.compat import is_py2, urlparse
 from streamlink.plugin import Plugin, PluginArgument, PluginArguments
 from streamlink.plugin.api import useragents
+from streamlink.plugin.api.http_session import HTTPSession
 from streamlink.plugin.plugin import parse_url_params
-from streamlink.stream import HLSStream
-from streamlink.stream.hls import HLSStreamWorker, HLSStreamReader
+from streamlink.stream import HLSStream, hls_playlist
+from streamlink.stream.hls import HLSStreamWorker, HLSStreamReader, HLSStreamWriter, Sequence
+from streamlink.stream.hls_playlist import M3U8Parser, Segment
 from streamlink.utils import update_scheme
-from streamlink.utils.args import num
+from streamlink.utils.args import filesize, num
 from streamlink.utils.times import hours_minutes_seconds
 
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
 log = logging.getLogger(__name__)
 
+EPOCH = datetime(1970, 1, 1, tzinfo=UTC)
+
+# EXT-X-PART and EXT-X-PRELOAD-HINT
+Part = namedtuple('Part', 'uri duration independent byterange')
+RestreamSegment = namedtuple('RestreamSegment', 'num duration discontinuity data')
+# a partial segment of a Low-Latency HLS playlist in the queue
+PartSequence = namedtuple('PartSequence', 'num segment')
+
+
+def segment_date(segment):
+    '''EXT-X-PROGRAM-DATE-TIME of a segment as a timestamp'''
+    if not segment.date:
+        return None
+    try:
+        date = parse_datetime(segment.date)
+    except (ISO8601Error, ValueError):
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=UTC)
+    return (date - EPOCH).total_seconds()
+
+
+def segment_fingerprint(segment):
+    '''Filename of a segment without the query,
+    a new session might only change the token or the host.'''
+    return urlparse(segment.uri).path.rsplit('/', 1)[-1]
+
+
+class HLSSessionM3U8Parser(M3U8Parser):
+    '''M3U8Parser with support for Low-Latency HLS tags
+
+    - EXT-X-SERVER-CONTROL
+    - EXT-X-PART-INF
+    - EXT-X-PART
+    - EXT-X-PRELOAD-HINT
+    '''
+
+    def parse_line(self, *args):
+        # (lineno, line) or only (line) for newer Streamlink versions
+        line = args[-1]
+        if line.startswith('#EXT-X-SERVER-CONTROL'):
+            self.state['server_control'] = self.parse_tag(line, self.parse_attributes)
+        elif line.startswith('#EXT-X-PART-INF'):
+            attr = self.parse_tag(line, self.parse_attributes)
+            self.state['part_target'] = float(attr.get('PART-TARGET') or 0)
+        elif line.startswith('#EXT-X-PART'):
+            attr = self.parse_tag(line, self.parse_attributes)
+            byterange = attr.get('BYTERANGE')
+            if byterange:
+                byterange = self.parse_byterange(byterange)
+            part = Part(self.uri(attr.get('URI')),
+                        float(attr.get('DURATION') or 0),
+                        self.parse_bool(attr.get('INDEPENDENT')),
+                        byterange)
+            # parts are listed before the segment they belong to,
+            # parts after the last segment belong to the next segment
+            parts = self.state.setdefault('parts', {})
+            parts.setdefault(len(self.m3u8.segments), []).append(part)
+        elif line.startswith('#EXT-X-PRELOAD-HINT'):
+            attr = self.parse_tag(line, self.parse_attributes)
+            if attr.get('TYPE') == 'PART' and not attr.get('BYTERANGE-START'):
+                self.state['preload_hint'] = Part(self.uri(attr.get('URI')),
+                                                  0, False, None)
+        else:
+            M3U8Parser.parse_line(self, *args)
+
+    def parse(self, data):
+        m3u8 = M3U8Parser.parse(self, data)
+        m3u8.server_control = self.state.get('server_control') or {}
+        m3u8.part_target = self.state.get('part_target')
+        m3u8.parts = self.state.get('parts') or {}
+        m3u8.preload_hint = self.state.get('preload_hint')
+        return m3u8
+
+
+class HLSSessionReloadScheduler(object):
+    '''Learns the update cadence of a live playlist
+
+    The playlist reload is scheduled shortly after the next expected
+    playlist update, instead of using the target duration.
+    '''
+
+    # reload after the expected update
+    margin = 0.2
+    # weight of a new update interval
+    weight = 0.3
+    # weight of the midpoint for the expected update after a changed reload
+    phase_weight = 0.1
+
+    def __init__(self):
+        self.cadence = None
+        self.last_change = None
+        self.last_changed = True
+        self.last_reload = None
+        self.next_reload = None
+        self.unchanged = 0
+
+        self.reloads = 0
+        self.reloads_unchanged = 0
+        self.reloads_default = 0.0
+        self.latency_total = 0.0
+        self.latency_count = 0
+
+    def default_reload_time(self, target_duration, changed):
+        if changed:
+            return target_duration
+        return max(target_duration / 2, 1)
+
+    def change_time(self, added, now):
+        '''Estimates the time of a playlist update
+
+        The update happened between the last reload, which had the old
+        playlist, and now. After an unchanged reload the interval is short
+        and its midpoint is used. After a changed reload the expected
+        update is moved toward the midpoint, an update that is earlier
+        than expected is found by the next unchanged reload.
+        '''
+        if self.last_reload is None:
+            return now
+        midpoint = (self.last_reload + now) / 2.0
+        if not self.last_changed or self.cadence is None or self.last_change is None:
+            return midpoint
+        expected = self.last_change + self.cadence * max(added, 1)
+        expected += (midpoint - expected) * self.phase_weight
+        return min(max(expected, self.last_reload), now)
+
+    def update(self, changed, target_duration, added=1, now=None):
+        '''Returns the time of the next playlist reload
+
+        Args:
+            changed: the playlist did change since the last reload
+            target_duration: EXT-X-TARGETDURATION of the playlist
+            added: number of new segments since the last reload
+        '''
+        now = now or time()
+        self.reloads += 1
+
+        if self.last_reload is None:
+            # the first reload is the same for both schedules
+            self.reloads_default += 1
+        else:
+            # reloads of the default schedule for the same time
+            self.reloads_default += (now - self.last_reload) / self.default_reload_time(
+                target_duration, self.last_changed)
+
+        if changed:
+            change_time = self.change_time(added, now)
+            self.latency_total += now - change_time
+            self.latency_count += 1
+
+            if self.last_change is not None:
+                # more than one new segment, the playlist was reloaded too late
+                interval = (change_time - self.last_change) / max(added, 1)
+                interval = min(max(interval, self.margin), target_duration * 3)
+                if self.cadence is None:
+                    self.cadence = interval
+                else:
+                    self.cadence += (interval - self.cadence) * self.weight
+
+            self.last_change = change_time
+            self.unchanged = 0
+            reload_time = target_duration
+            if self.cadence is not None:
+                reload_time = self.last_change + self.cadence + self.margin - now
+        else:
+            self.reloads_unchanged += 1
+            self.unchanged += 1
+            if self.cadence is None:
+                reload_time = self.default_reload_time(target_duration, changed)
+            else:
+                # the playlist is late or stalled, back-off
+                reload_time = min(self.margin * 2 ** self.unchanged, target_duration)
+
+        self.last_changed = changed
+        self.last_reload = now
+        self.next_reload = now + max(reload_time, self.margin)
+        return self.next_reload
+
+    def stats(self):
+        '''Counters of the schedule, reloads_saved is negative if late
+        playlist updates needed more reloads than the default schedule'''
+        return {
+            'reloads': self.reloads,
+            'reloads_unchanged': self.reloads_unchanged,
+            'reloads_saved': int(self.reloads_default - self.reloads),
+            'cadence': self.cadence,
+            'latency': (self.latency_total / self.latency_count
+                        if self.latency_count else None),
+        }
+
+
+class HLSSessionHTTP2Adapter(BaseAdapter):
+    '''requests adapter for HTTP/2 with httpx
+
+    httpx uses one connection per origin for all requests,
+    HTTP/1.1 is used if the server does not support HTTP/2.
+    Streamed responses and proxies use the default HTTPAdapter.
+    '''
+
+    # connection-specific headers are not allowed in HTTP/2
+    hop_headers = ('connection', 'keep-alive', 'proxy-connection',
+                   'transfer-encoding', 'upgrade')
+
+    def __init__(self, http):
+        BaseAdapter.__init__(self)
+        self.http = http
+        self.fallback = HTTPAdapter()
+        # raises ImportError without the h2 package
+        self.client = httpx.Client(http2=True, verify=http.verify, cert=http.cert)
+        self.versions = {}
+
+    def close(self):
+        self.client.close()
+        self.fallback.close()
+
+    def send(self, request, stream=False, timeout=None, verify=True,
+             cert=None, proxies=None):
+        if stream or select_proxy(request.url, proxies):
+            return self.fallback.send(request, stream=stream, timeout=timeout,
+                                      verify=verify, cert=cert, proxies=proxies)
+
+        if isinstance(timeout, tuple):
+            timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+        headers = [(key, value) for key, value in request.headers.items()
+                   if key.lower() not in self.hop_headers]
+        try:
+            res = self.client.request(request.method, request.url,
+                                      headers=headers, content=request.body,
+                                      timeout=timeout)
+        except httpx.TimeoutException as err:
+            raise Timeout(err, request=request)
+        except httpx.HTTPError as err:
+            raise RequestsConnectionError(err, request=request)
+
+        origin = '{0}://{1}'.format(res.url.scheme, res.url.host)
+        if self.versions.get(origin) != res.http_version:
+            self.versions[origin] = res.http_version
+            log.debug('{0} uses {1}'.format(origin, res.http_version))
+
+        for cookie in res.cookies.jar:
+            self.http.cookies.set_cookie(cookie)
+
+        response = Response()
+        response.status_code = res.status_code
+        response.headers = CaseInsensitiveDict(res.headers.items())
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.reason = res.reason_phrase
+        response.url = str(res.url)
+        response.request = request
+        response.connection = self
+        response._content = res.content
+        response._content_consumed = True
+        return response
+
+
+class HLSSessionHTTP2(object):
+    '''HTTPSession of the hlssession streams with HTTP/2 for https,
+    the headers, cookies and settings are shared with the Streamlink session'''
+
+    _lock = Lock()
+    _sessions = {}
+
+    @classmethod
+    def http(cls, session):
+        with cls._lock:
+            if session not in cls._sessions:
+                cls._sessions[session] = cls.create(session)
+            return cls._sessions[session]
+
+    @classmethod
+    def create(cls, session):
+        if httpx is None:
+            log.warning('HTTP/2 requires the httpx package, using HTTP/1.1')
+            return session.http
+
+        http = HTTPSession()
+        for name in ('headers', 'cookies', 'params', 'proxies', 'verify',
+                     'cert', 'trust_env', 'timeout'):
+            setattr(http, name, getattr(session.http, name))
+        try:
+            http.mount('https://', HLSSessionHTTP2Adapter(http))
+        except ImportError as err:
+            log.warning('HTTP/2 is not available, using HTTP/1.1: {0}'.format(err))
+            return session.http
+        return http
+
+
+class HLSSessionMemoryBudget(object):
+    '''Process-wide memory budget of all hlssession writers,
+    every open writer with a budget gets the same share.'''
+
+    _lock = Lock()
+    _writers = []
+
+    @classmethod
+    def register(cls, writer):
+        with cls._lock:
+            cls._writers.append(writer)
+        cls.notify()
+
+    @classmethod
+    def unregister(cls, writer):
+        with cls._lock:
+            if writer in cls._writers:
+                cls._writers.remove(writer)
+        cls.notify()
+
+    @classmethod
+    def share(cls, budget):
+        with cls._lock:
+            return budget // max(len(cls._writers), 1)
+
+    @classmethod
+    def notify(cls):
+        # a changed share can unblock a writer
+        with cls._lock:
+            writers = list(cls._writers)
+        for writer in writers:
+            with writer.bytes_lock:
+                writer.bytes_lock.notify_all()
+
+
+class HLSSessionHedge(object):
+    '''Sends a second request for a slow segment download
+
+    A segment request that takes longer than a percentile of the recent
+    download times is sent again, to an alternate host if the playlist
+    has a redundant stream, the first complete response is used.
+
+    The requests run in a pool of three threads per fetch thread, for
+    the primary and the hedged request and for a slow request that is
+    not used anymore and runs until the segment timeout. A request that
+    can not be hedged, without enough download times, budget or free
+    threads, runs in the fetch thread.
+    '''
+
+    # recent download times
+    samples = 50
+    # no hedged requests without enough download times
+    min_samples = 10
+    # seconds, shortest time before a hedged request
+    min_delay = 0.2
+    # max. hedged requests per segment request
+    budget = 0.1
+
+    def __init__(self, percentile, threads=1, hosts=None, metrics=None):
+        self.percentile = percentile
+        self.hosts = hosts or []
+        self.metrics = metrics
+        self.lock = Lock()
+        self.latencies = deque(maxlen=self.samples)
+        self.max_workers = threads * 3
+        self.executor = futures.ThreadPoolExecutor(max_workers=self.max_workers)
+        # submitted requests, that are not complete
+        self.running = 0
+        self.closed = False
+
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def submit(self, get, url):
+        '''Returns the future of get(url) in the pool'''
+        with self.lock:
+            if self.closed:
+                raise StreamError('Hedged request of a closed stream')
+            self.running += 1
+            future = self.executor.submit(get, url)
+        future.add_done_callback(self.done)
+        return future
+
+    def done(self, future):
+        with self.lock:
+            self.running -= 1
+
+    def can_hedge(self):
+        '''A hedged request is possible, with enough download times,
+        budget and free threads for the primary and the hedged request'''
+        with self.lock:
+            return (not self.closed
+                    and len(self.latencies) >= self.min_samples
+                    and self.hedged + 1 <= self.budget * self.requests
+                    and self.running + 2 <= self.max_workers)
+
+    def delay(self):
+        '''Seconds before a hedged request, None without enough samples'''
+        with self.lock:
+            if len(self.latencies) < self.min_samples:
+                return None
+            latencies = sorted(self.latencies)
+        index = min(int(len(latencies) * self.percentile / 100.0), len(latencies) - 1)
+        return max(latencies[index], self.min_delay)
+
+    def take_budget(self):
+        with self.lock:
+            if self.hedged + 1 > self.budget * self.requests:
+                return False
+            self.hedged += 1
+            return True
+
+    def hedge_url(self, url):
+        if not self.hosts:
+            return url
+        host = self.hosts[self.hedged % len(self.hosts)]
+        return urlparse(url)._replace(netloc=host).geturl()
+
+    def result(self, future, start_time):
+        res = future.result()
+        with self.lock:
+            self.latencies.append(time() - start_time)
+        return res
+
+    def get(self, get, url):
+        '''Returns the first complete response of get(url)'''
+        with self.lock:
+            self.requests += 1
+        start_time = time()
+        if not self.can_hedge():
+            res = get(url)
+            with self.lock:
+                self.latencies.append(time() - start_time)
+            return res
+
+        primary = self.submit(get, url)
+        delay = self.delay()
+        if futures.wait([primary], timeout=delay).done or not self.take_budget():
+            return self.result(primary, start_time)
+
+        hedge_url = self.hedge_url(url)
+        log.debug('Hedged request after {0:.2f}s: {1}'.format(delay, hedge_url))
+        if self.metrics:
+            self.metrics.inc('segments_hedged')
+        hedge = self.submit(get, hedge_url)
+
+        error = None
+        pending = set([primary, hedge])
+        while pending:
+            done, pending = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                try:
+                    res = self.result(future, start_time)
+                except StreamError as err:
+                    error = err
+                    continue
+                if future is hedge:
+                    with self.lock:
+                        self.hedge_wins += 1
+                    if self.metrics:
+                        self.metrics.inc('segments_hedge_wins')
+                return res
+        raise error
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+        self.executor.shutdown(wait=False)
+
+    def stats(self):
+        return {
+            'requests': self.requests,
+            'hedged': self.hedged,
+            'hedge_wins': self.hedge_wins,
+            'delay': self.delay(),
+        }
+
+
+class HLSSessionHistogram(object):
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bucket in enumerate(self.buckets):
+            if value <= bucket:
+                self.counts[i] += 1
+
+    def to_json(self):
+        return {
+            'buckets': dict(zip([str(b) for b in self.buckets], self.counts)),
+            'count': self.count,
+            'sum': self.sum,
+        }
+
+
+class HLSSessionMetrics(object):
+    '''Counters and histograms of a single hlssession stream
 
-class TempData(object):
-    pass
+    All open streams are exported with HLSSessionMetricsServer
+    or HLSSessionMetricsFile.
+    '''
+
+    _lock = Lock()
+    _metrics = []
+    _id = 0
+
+    latency_buckets = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+    throughput_buckets = (1e5, 5e5, 1e6, 5e6, 1e7, 5e7, 1e8)
+
+    counter_names = (
+        'segments',
+        'segments_failed',
+        'segments_hedged',
+        'segments_hedge_wins',
+        'segment_bytes',
+        'playlist_reloads',
+        'playlist_reloads_unchanged',
+        'playlist_reloads_failed',
+        'sequences_skipped',
+        'sequences_invalid',
+        'sequences_ignored',
+    )
+    session_reload_causes = ('time', 'invalid_sequence', 'stream_error')
+
+    # HELP of the Prometheus metric families
+    metric_help = {
+        'segments': 'Downloaded segments.',
+        'segments_failed': 'Segments that failed to download.',
+        'segments_hedged': 'Segments with a hedged request.',
+        'segments_hedge_wins': 'Segments that were downloaded by the hedged request.',
+        'segment_bytes': 'Bytes of the downloaded segments.',
+        'playlist_reloads': 'Playlist reloads.',
+        'playlist_reloads_unchanged': 'Playlist reloads without new segments.',
+        'playlist_reloads_failed': 'Playlist reloads that failed.',
+        'sequences_skipped': 'Segments that were skipped after a new session.',
+        'sequences_invalid': 'Segments older than the previous playlist.',
+        'sequences_ignored': 'Segments added by --hlssession-ignore-number.',
+        'session_reloads': 'Session reloads by cause.',
+        'playlist_reloads_unchanged_ratio': 'Ratio of the playlist reloads without new segments.',
+        'live_edge_gap_seconds': 'Media duration between the last queued segment and the live edge.',
+        'segment_latency': 'Seconds to download a segment.',
+        'segment_throughput': 'Bytes per second of a segment download.',
+        'playlist_latency': 'Seconds to reload a playlist.',
+    }
+
+    def __init__(self, url, stream_name):
+        with self._lock:
+            HLSSessionMetrics._id += 1
+            self.id = HLSSessionMetrics._id
+        self.url = url
+        self.stream_name = stream_name
+        self.lock = Lock()
+        self.counters = dict((name, 0) for name in self.counter_names)
+        self.session_reloads = dict((cause, 0) for cause in self.session_reload_causes)
+        self.segment_latency = HLSSessionHistogram(self.latency_buckets)
+        self.segment_throughput = HLSSessionHistogram(self.throughput_buckets)
+        self.playlist_latency = HLSSessionHistogram(self.latency_buckets)
+        self.live_edge_gap = 0.0
+
+    @classmethod
+    def register(cls, metrics):
+        with cls._lock:
+            cls._metrics.append(metrics)
+
+    @classmethod
+    def unregister(cls, metrics):
+        with cls._lock:
+            if metrics in cls._metrics:
+                cls._metrics.remove(metrics)
+
+    @classmethod
+    def all(cls):
+        with cls._lock:
+            return list(cls._metrics)
+
+    def inc(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def segment(self, size, elapsed):
+        with self.lock:
+            self.counters['segments'] += 1
+            self.counters['segment_bytes'] += size
+            self.segment_latency.observe(elapsed)
+            self.segment_throughput.observe(size / max(elapsed, 0.001))
+
+    def playlist_reload(self, elapsed):
+        with self.lock:
+            self.counters['playlist_reloads'] += 1
+            self.playlist_latency.observe(elapsed)
+
+    def session_reload(self, cause):
+        with self.lock:
+            self.session_reloads[cause] += 1
+
+    def to_json(self):
+        with self.lock:
+            reloads = self.counters['playlist_reloads']
+            return {
+                'id': self.id,
+                'url': self.url,
+                'stream': self.stream_name,
+                'counters': dict(self.counters),
+                'session_reloads': dict(self.session_reloads),
+                'playlist_reloads_unchanged_ratio': (
+                    float(self.counters['playlist_reloads_unchanged']) / reloads
+                    if reloads else 0.0),
+                'live_edge_gap': self.live_edge_gap,
+                'segment_latency': self.segment_latency.to_json(),
+                'segment_throughput': self.segment_throughput.to_json(),
+                'playlist_latency': self.playlist_latency.to_json(),
+            }
+
+    @classmethod
+    def prometheus(cls):
+        '''All open streams in the Prometheus text format'''
+        def escape(value):
+            return (str(value).replace('\\', '\\\\')
+                    .replace('"', '\\"').replace('\n', '\\n'))
+
+        streams = []
+        for data in [m.to_json() for m in cls.all()]:
+            labels = 'id="{0}",url="{1}",stream="{2}"'.format(
+                data['id'], escape(data['url']), escape(data['stream']))
+            streams.append((labels, data))
+
+        lines = []
+
+        def family(name, metric_type, help_name=None):
+            # every sample of a metric family follows its HELP and TYPE
+            lines.append('# HELP hlssession_{0} {1}'.format(
+                name, cls.metric_help[help_name or name]))
+            lines.append('# TYPE hlssession_{0} {1}'.format(name, metric_type))
+
+        for name in cls.counter_names:
+            family('{0}_total'.format(name), 'counter', name)
+            for labels, data in streams:
+                lines.append('hlssession_{0}_total{{{1}}} {2}'.format(
+                    name, labels, data['counters'][name]))
+
+        family('session_reloads_total', 'counter', 'session_reloads')
+        for labels, data in streams:
+            for cause, value in sorted(data['session_reloads'].items()):
+                lines.append('hlssession_session_reloads_total{{{0},cause="{1}"}} {2}'.format(
+                    labels, cause, value))
+
+        family('playlist_reloads_unchanged_ratio', 'gauge')
+        for labels, data in streams:
+            lines.append('hlssession_playlist_reloads_unchanged_ratio{{{0}}} {1}'.format(
+                labels, data['playlist_reloads_unchanged_ratio']))
+
+        family('live_edge_gap_seconds', 'gauge')
+        for labels, data in streams:
+            lines.append('hlssession_live_edge_gap_seconds{{{0}}} {1}'.format(
+                labels, data['live_edge_gap']))
+
+        for name in ('segment_latency', 'segment_throughput', 'playlist_latency'):
+            family(name, 'histogram')
+            for labels, data in streams:
+                histogram = data[name]
+                for bucket, value in sorted(histogram['buckets'].items(), key=lambda b: float(b[0])):
+                    lines.append('hlssession_{0}_bucket{{{1},le="{2}"}} {3}'.format(
+                        name, labels, bucket, value))
+                lines.append('hlssession_{0}_bucket{{{1},le="+Inf"}} {2}'.format(
+                    name, labels, histogram['count']))
+                lines.append('hlssession_{0}_sum{{{1}}} {2}'.format(name, labels, histogram['sum']))
+                lines.append('hlssession_{0}_count{{{1}}} {2}'.format(name, labels, histogram['count']))
+
+        return '\n'.join(lines) + '\n'
+
+
+class HLSSessionMetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            body = HLSSessionMetrics.prometheus()
+            content_type = 'text/plain; version=0.0.4'
+        elif self.path == '/metrics.json':
+            body = json.dumps([m.to_json() for m in HLSSessionMetrics.all()])
+            content_type = 'application/json'
+        else:
+            self.send_error(404)
+            return
+
+        body = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class HLSSessionMetricsServer(ThreadingMixIn, HTTPServer):
+    '''Local HTTP server for the metrics of all streams
+
+      - http://127.0.0.1:PORT/metrics (Prometheus)
+      - http://127.0.0.1:PORT/metrics.json
+    '''
+
+    daemon_threads = True
+    _lock = Lock()
+    _servers = {}
+
+    @classmethod
+    def start(cls, port):
+        with cls._lock:
+            if port in cls._servers:
+                return
+            try:
+                server = cls(('127.0.0.1', port), HLSSessionMetricsHandler)
+            except (IOError, OSError) as err:
+                log.error('Failed to start the metrics server: {0}'.format(err))
+                return
+            cls._servers[port] = server
+            thread = Thread(target=server.serve_forever,
+                            name='Thread-HLSSessionMetricsServer')
+            thread.daemon = True
+            thread.start()
+            log.debug('Metrics server: http://127.0.0.1:{0}/metrics'.format(port))
+
+
+class HLSSessionMetricsFile(Thread):
+    '''Writes the metrics of all streams into a JSON file'''
+
+    interval = 10.0
+    _lock = Lock()
+    _files = {}
+
+    def __init__(self, filename):
+        Thread.__init__(self, name='Thread-HLSSessionMetricsFile')
+        self.daemon = True
+        self.filename = filename
+        self._wait = Event()
+
+    @classmethod
+    def start_file(cls, filename):
+        with cls._lock:
+            if filename not in cls._files:
+                cls._files[filename] = cls(filename)
+                cls._files[filename].start()
+
+    def write(self):
+        data = json.dumps({
+            'timestamp': int(time()),
+            'streams': [m.to_json() for m in HLSSessionMetrics.all()],
+        })
+        # the temp file in the same directory replaces the file at once,
+        # a reader never sees a missing or partial file
+        tempname = '{0}.{1}.tmp'.format(self.filename, os.getpid())
+        try:
+            with open(tempname, 'w') as fd:
+                fd.write(data)
+            if hasattr(os, 'replace'):
+                os.replace(tempname, self.filename)
+            else:
+                # Python 2, replaces the file on POSIX
+                os.rename(tempname, self.filename)
+        except (IOError, OSError) as err:
+            log.error('Failed to write the metrics file: {0}'.format(err))
+
+    def run(self):
+        while not self._wait.wait(self.interval):
+            self.write()
+
+
+class HLSSessionRestreamChannel(object):
+    '''A hlssession stream for any number of local clients
+
+    One upstream reader writes the segments into a byte limited cache,
+    the clients get a playlist with local sequence numbers
+    and the segments from the cache.
+    '''
+
+    # segments in the local playlist
+    window = 6
+    # max. bytes of the cache, older segments are removed
+    max_bytes = 64 * 1024 * 1024
+    # seconds without a client request, until the upstream is closed
+    idle_timeout = 60.0
+    # seconds a new client waits for the first segment
+    start_timeout = 30.0
+
+    _lock = Lock()
+    _channels = {}
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = Condition()
+        self.reader = None
+        self.ended = False
+        self.segments = deque()
+        self.segments_bytes = 0
+        self.sequence = 0
+        self.discontinuity = False
+        self.discontinuity_sequence = 0
+        self.last_access = 0
+
+    @classmethod
+    def register(cls, name, stream):
+        '''Returns the key of the channel for a stream'''
+        key = '{0}:{1}'.format(stream.session_url or stream.url, name)
+        key = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+        with cls._lock:
+            if key in cls._channels:
+                # a new upstream will use the new stream
+                cls._channels[key].stream = stream
+            else:
+                cls._channels[key] = cls(stream)
+        return key
+
+    @classmethod
+    def get(cls, key):
+        with cls._lock:
+            return cls._channels.get(key)
+
+    def open(self):
+        if self.reader is not None or self.ended:
+            return
+        log.debug('Starting restream upstream: {0}'.format(self.stream.url))
+        reader = HLSSessionRestreamReader(self.stream, self)
+        try:
+            reader.open()
+        except StreamError as err:
+            log.error('Failed to open the restream upstream: {0}'.format(err))
+            return
+        self.reader = reader
+        # the first segment of a new upstream is not continuous
+        self.discontinuity = bool(self.segments)
+
+    def upstream_closed(self, reader):
+        with self.lock:
+            if self.reader is not reader:
+                return
+            self.reader = None
+            self.ended = reader.worker.playlist_end is not None
+            self.lock.notify_all()
+        if reader.metrics:
+            HLSSessionMetrics.unregister(reader.metrics)
+        log.debug('Restream upstream closed: {0}'.format(self.stream.url))
+
+    def add(self, duration, data):
+        '''Adds a segment, returns True if there are no clients'''
+        with self.lock:
+            self.segments.append(RestreamSegment(
+                self.sequence, duration, self.discontinuity, data))
+            self.sequence += 1
+            self.discontinuity = False
+            self.segments_bytes += len(data)
+            while (len(self.segments) > self.window
+                   and self.segments_bytes > self.max_bytes):
+                segment = self.segments.popleft()
+                self.segments_bytes -= len(segment.data)
+                if segment.discontinuity:
+                    self.discontinuity_sequence += 1
+            self.lock.notify_all()
+            return time() - self.last_access > self.idle_timeout
+
+    def playlist(self):
+        with self.lock:
+            self.last_access = time()
+            self.open()
+            end_time = time() + self.start_timeout
+            while not self.segments and self.reader is not None:
+                timeout = end_time - time()
+                if timeout <= 0:
+                    break
+                self.lock.wait(timeout)
+            if not self.segments:
+                return None
+
+            segments = list(self.segments)[-self.window:]
+            discontinuity_sequence = self.discontinuity_sequence + len(
+                [s for s in list(self.segments)[:-self.window] if s.discontinuity])
+            lines = [
+                '#EXTM3U',
+                '#EXT-X-VERSION:3',
+                '#EXT-X-TARGETDURATION:{0}'.format(
+                    int(math.ceil(max(s.duration for s in segments)))),
+                '#EXT-X-MEDIA-SEQUENCE:{0}'.format(segments[0].num),
+                '#EXT-X-DISCONTINUITY-SEQUENCE:{0}'.format(discontinuity_sequence),
+            ]
+            for segment in segments:
+                if segment.discontinuity:
+                    lines.append('#EXT-X-DISCONTINUITY')
+                lines.append('#EXTINF:{0:.3f},'.format(segment.duration))
+                lines.append('{0}.ts'.format(segment.num))
+            if self.ended and self.reader is None:
+                lines.append('#EXT-X-ENDLIST')
+            return '\n'.join(lines) + '\n'
+
+    def segment(self, num):
+        with self.lock:
+            self.last_access = time()
+            if self.segments and self.segments[0].num <= num <= self.segments[-1].num:
+                return self.segments[num - self.segments[0].num].data
+
+
+class HLSSessionRestreamHandler(BaseHTTPRequestHandler):
+    _path_re = re.compile(r'^/(?P<key>\w+)/(?:(?P<playlist>playlist\.m3u8)|(?P<num>\d+)\.ts)$')
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        match = self._path_re.match(self.path.split('?')[0])
+        channel = match and HLSSessionRestreamChannel.get(match.group('key'))
+        if not channel:
+            self.send_error(404)
+            return
+
+        if match.group('playlist'):
+            body = channel.playlist()
+            if body is None:
+                self.send_error(503)
+                return
+            body = body.encode('utf-8')
+            content_type = 'application/vnd.apple.mpegurl'
+        else:
+            body = channel.segment(int(match.group('num')))
+            if body is None:
+                self.send_error(404)
+                return
+            content_type = 'video/mp2t'
+
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class HLSSessionRestreamServer(ThreadingMixIn, HTTPServer):
+    '''Local HTTP server for the restream channels
+
+      - http://127.0.0.1:PORT/KEY/playlist.m3u8
+      - http://127.0.0.1:PORT/KEY/NUM.ts
+    '''
+
+    daemon_threads = True
+    _lock = Lock()
+    _servers = {}
+
+    @classmethod
+    def start(cls, port):
+        '''Returns True if the server is running'''
+        with cls._lock:
+            if port in cls._servers:
+                return True
+            try:
+                server = cls(('127.0.0.1', port), HLSSessionRestreamHandler)
+            except (IOError, OSError) as err:
+                log.error('Failed to start the restream server: {0}'.format(err))
+                return False
+            cls._servers[port] = server
+            thread = Thread(target=server.serve_forever,
+                            name='Thread-HLSSessionRestreamServer')
+            thread.daemon = True
+            thread.start()
+            log.debug('Restream server: http://127.0.0.1:{0}/'.format(port))
+            return True
+
+
+class HLSSessionStandby(Thread):
+    '''Keeps a second resolved stream of a hlssession stream ready
+
+    The playlist of the standby stream is checked in a low frequency,
+    the worker will use it immediately if the current stream fails.
+    '''
+
+    # seconds between the playlist checks
+    interval = 30.0
+    # seconds between failed resolves
+    retry_interval = 10.0
+
+    def __init__(self, session, session_data):
+        Thread.__init__(self, name='Thread-HLSSessionStandby')
+        self.daemon = True
+        self.closed = False
+        self.session = session
+        self.session_data = session_data
+        self.lock = Lock()
+        self.stream = None
+        # every stream of the standby session, used for variants
+        self.streams = None
+        self.timestamp = 0
+        self._wait = Event()
+
+    @property
+    def ready(self):
+        return self.stream is not None
+
+    def close(self):
+        self.closed = True
+        self._wait.set()
+
+    def take(self):
+        '''Returns the streams of the standby session and resolves a new one'''
+        with self.lock:
+            streams, self.streams, self.stream = self.streams, None, None
+        self._wait.set()
+        return streams
+
+    def resolve(self):
+        return self.session.streams(self.session_data.url,
+                                    stream_types=['hls'])
+
+    def check(self, stream):
+        request_params = dict(stream.args)
+        for key in ('exception', 'stream', 'timeout', 'url'):
+            request_params.pop(key, None)
+        res = self.session.http.get(stream.url, exception=StreamError,
+                                    **request_params)
+        return res.text.startswith('#EXTM3U')
+
+    def expired(self):
+        # a new session would be used by the worker at this time
+        reload_time = self.session_data.session_reload_time
+        return reload_time and time() - self.timestamp >= reload_time
+
+    def run(self):
+        while not self.closed:
+            stream = self.stream
+            try:
+                if stream is None or self.expired():
+                    streams = self.resolve()
+                    stream = streams and streams.get(self.session_data.stream_name)
+                    if stream and self.check(stream):
+                        log.debug('New standby stream: {0}'.format(stream.url))
+                        with self.lock:
+                            self.stream = stream
+                            self.streams = streams
+                            self.timestamp = time()
+                elif not self.check(stream):
+                    raise StreamError('Invalid playlist')
+            except (NoPluginError, PluginError, StreamError) as err:
+                log.debug('Standby stream failed: {0}'.format(err))
+                with self.lock:
+                    if self.stream is stream:
+                        self.stream = self.streams = None
+
+            self._wait.wait(self.interval if self.stream else self.retry_interval)
+            self._wait.clear()
+
+
+class HLSSessionState(object):
+    '''Checkpoint of the last written segment of a hlssession stream
+
+    Streams are stored by their session url and stream name,
+    multiple streams can use the same file.
+    '''
+
+    # the file is shared by every stream of this process
+    lock = Lock()
+    expires = 60 * 60 * 24
+
+    def __init__(self, filename, session_data):
+        self.cache = Cache(filename, key_prefix='hlssession')
+        self.key = '{0}:{1}'.format(session_data.url, session_data.stream_name)
+
+    def load(self):
+        with self.lock:
+            return self.cache.get(self.key)
+
+    def save(self, **state):
+        with self.lock:
+            self.cache.set(self.key, state, expires=self.expires)
+
+    def clear(self):
+        with self.lock:
+            self.cache.set(self.key, None, expires=0)
+
+
+class HLSSessionData(object):
+    '''Session reload data of a single hlssession stream
+
+    Every HLSSessionHLSStreamWorker has its own data,
+    multiple streams can be used in the same process.
+    '''
+
+    def __init__(self, url, stream_name='best', ignore_number=0,
+                 reload_segment=False, reload_time=0, options=None):
+        self.url = url
+        self.options = options or {}
+        self.stream_name = stream_name
+        self.sequence_ignore_number = ignore_number
+        self.session_reload_segment = reload_segment
+        self.session_reload_segment_status = False
+        self.session_reload_time = reload_time
+        self.timestamp = int(time())
+
+    @classmethod
+    def from_stream(cls, stream):
+        options = stream.session_options or {}
+        return cls(
+            stream.session_url or stream.url,
+            stream_name=stream.session_stream_name,
+            ignore_number=options.get('ignore_number') or 0,
+            reload_segment=options.get('segment') or False,
+            reload_time=int(options.get('time') or 0),
+            options=options,
+        )
+
+
+class HLSSessionHLSStreamWriter(HLSStreamWriter):
+    # max. queued segments of a byte or duration limited buffer
+    buffer_max_segments = 100
+
+    def __init__(self, reader, *args, **kwargs):
+        options = reader.stream.session_options or {}
+        self.prefetch = options.get('prefetch')
+        self.buffer_size = options.get('buffer_size')
+        self.buffer_duration = options.get('buffer_duration')
+        self.memory_budget = options.get('memory_budget')
+        self.buffer_limited = bool(self.buffer_size or self.buffer_duration
+                                   or self.memory_budget)
+        if self.prefetch:
+            # number of segments that can be downloaded in advance
+            kwargs['size'] = self.prefetch
+        elif self.buffer_limited:
+            # the queue is limited by bytes and duration
+            kwargs['size'] = self.buffer_max_segments
+        HLSStreamWriter.__init__(self, reader, *args, **kwargs)
+        self.threads = self.session.options.get('hls-segment-threads') or 1
+        if self.prefetch and self.prefetch > self.threads:
+            # at least one download thread for every prefetched segment,
+            # the unused executor of --hls-segment-threads has no threads
+            self.executor.shutdown(wait=False)
+            self.executor = futures.ThreadPoolExecutor(max_workers=self.prefetch)
+            self.threads = self.prefetch
+
+        # downloaded segments, that are not written yet
+        self.bytes_lock = Condition()
+        self.bytes_buffered = 0
+        # estimated size of the running downloads
+        self.bytes_requested = 0
+        self.bytes_in_flight_peak = 0
+        # queued segments, that are not written yet
+        self.queued = 0
+        self.queued_fetched = 0
+        self.queued_duration = 0.0
+        # average size of the last segments
+        self.segment_size = 0
+        if self.memory_budget:
+            HLSSessionMemoryBudget.register(self)
+        # written media duration, also of a resumed stream
+        self.media_time = 0
+
+        self.http = self.session.http
+        if options.get('http2'):
+            self.http = HLSSessionHTTP2.http(self.session)
+
+        self.hedge = None
+        if options.get('hedge'):
+            hosts = (options.get('hedge_hosts') or {}).get(reader.stream.url)
+            self.hedge = HLSSessionHedge(options['hedge'], threads=self.threads,
+                                         hosts=hosts, metrics=reader.metrics)
+
+    def close(self):
+        if not self.closed and self.prefetch:
+            log.debug('Prefetch peak: {0} bytes in flight'.format(
+                self.bytes_in_flight_peak))
+        if self.hedge and not self.closed:
+            log.debug('Hedged request stats: {0}'.format(self.hedge.stats()))
+            self.hedge.close()
+        if self.memory_budget:
+            HLSSessionMemoryBudget.unregister(self)
+        HLSStreamWriter.close(self)
+
+    def buffer_limit(self):
+        '''Max. bytes of the queued segments'''
+        limits = [self.buffer_size]
+        if self.memory_budget:
+            limits.append(HLSSessionMemoryBudget.share(self.memory_budget))
+        limits = [limit for limit in limits if limit]
+        return min(limits) if limits else None
+
+    def buffer_full(self, sequence):
+        if not self.queued:
+            # a single segment is always allowed
+            return False
+        if (self.buffer_duration
+                and self.queued_duration + sequence.segment.duration > self.buffer_duration):
+            return True
+        limit = self.buffer_limit()
+        if limit:
+            segment_size = self.segment_size
+            if not segment_size and self.queued_fetched:
+                segment_size = self.bytes_buffered // self.queued_fetched
+            if not segment_size:
+                # wait for the size of the first segment
+                return True
+            # segments that are not downloaded yet use the average size
+            size = (self.bytes_buffered
+                    + (self.queued - self.queued_fetched + 1) * segment_size)
+            return size > limit
+        return False
+
+    def put(self, sequence):
+        if sequence is not None and self.buffer_limited:
+            # backpressure, the worker waits for written segments
+            with self.bytes_lock:
+                while not self.closed and self.buffer_full(sequence):
+                    self.bytes_lock.wait(1)
+                self.queued += 1
+                self.queued_duration += sequence.segment.duration
+        HLSStreamWriter.put(self, sequence)
+
+    def buffer_release(self, sequence, size=None):
+        with self.bytes_lock:
+            self.queued -= 1
+            self.queued_duration -= sequence.segment.duration
+            if size is not None:
+                self.queued_fetched -= 1
+                self.segment_size = (size if not self.segment_size
+                                     else int(self.segment_size * 0.8 + size * 0.2))
+            self.bytes_lock.notify_all()
+
+    def fetch_segment(self, sequence, retries=None):
+        '''HLSStreamWriter.fetch with the HTTP session of the stream,
+        and hedged requests'''
+        if self.closed or not retries:
+            return
+
+        try:
+            request_params = self.create_request_params(sequence)
+            # skip ignored segment names
+            if self.ignore_names and self.ignore_names_re.search(sequence.segment.uri):
+                log.debug('Skipping segment {0}'.format(sequence.num))
+                return
+
+            def get(url):
+                return self.http.get(url,
+                                     timeout=self.timeout,
+                                     exception=StreamError,
+                                     retries=self.retries,
+                                     **request_params)
+
+            if self.hedge:
+                return self.hedge.get(get, sequence.segment.uri)
+            return get(sequence.segment.uri)
+        except StreamError as err:
+            log.error('Failed to open segment {0}: {1}'.format(sequence.num, err))
+            return
+
+    def count_in_flight(self, requested=0):
+        '''Adds requested bytes, updates the peak of the downloaded and requested bytes'''
+        self.bytes_requested += requested
+        self.bytes_in_flight_peak = max(self.bytes_buffered + self.bytes_requested,
+                                        self.bytes_in_flight_peak)
+
+    def fetch(self, sequence, retries=None):
+        metrics = self.reader.metrics
+        start_time = time()
+        with self.bytes_lock:
+            # a request counts with the average segment size until it is complete
+            requested = self.segment_size
+            self.count_in_flight(requested)
+        try:
+            res = self.fetch_segment(sequence, retries)
+        finally:
+            with self.bytes_lock:
+                self.bytes_requested -= requested
+        if metrics:
+            if res is None:
+                metrics.inc('segments_failed')
+            else:
+                metrics.segment(len(res.content), time() - start_time)
+        if res is not None:
+            with self.bytes_lock:
+                self.bytes_buffered += len(res.content)
+                self.count_in_flight()
+                self.queued_fetched += 1
+                self.bytes_lock.notify_all()
+        elif self.buffer_limited:
+            # failed segments are not written
+            self.buffer_release(sequence)
+        return res
+
+    def write(self, sequence, res, chunk_size=8192):
+        try:
+            if sequence.segment.key and sequence.segment.key.method != 'NONE':
+                HLSStreamWriter.write(self, sequence, res, chunk_size)
+            else:
+                # one write without chunk copies, the buffer
+                # uses slices of the memoryview
+                self.reader.buffer.write(memoryview(res.content))
+                log.debug('Download of segment {0} complete'.format(sequence.num))
+        finally:
+            with self.bytes_lock:
+                self.bytes_buffered -= len(res.content)
+            if self.buffer_limited:
+                self.buffer_release(sequence, len(res.content))
+        self.media_time += sequence.segment.duration
+
+        worker = self.reader.worker
+        if worker.state and not isinstance(sequence, PartSequence):
+            self.save_state(worker, sequence)
+
+    def save_state(self, worker, sequence):
+        if worker.playlist_end is not None and sequence.num >= worker.playlist_end:
+            # nothing to resume
+            worker.state.clear()
+            return
+
+        segment = sequence.segment
+        worker.state.save(
+            stream_url=worker.stream.url,
+            timestamp=worker.session_data.timestamp,
+            sequence=sequence.num,
+            uri=segment.uri,
+            duration=segment.duration,
+            date=segment.date,
+            media_time=self.media_time,
+            time=time(),
+        )
 
 
 class HLSSessionHLSStreamWorker(HLSStreamWorker):
-    def reload_session(self):
+    def __init__(self, reader, *args, **kwargs):
+        # HLSStreamWorker.__init__ will already reload the playlist
+        self.session_data = HLSSessionData.from_stream(reader.stream)
+        self.session_realign = False
+        self.last_sequence = None
+        self.playlist_time = time()
+        self.metrics = reader.metrics
+        self.http = reader.writer.http
+        self.standby = None
+        if self.session_data.options.get('standby'):
+            self.standby = HLSSessionStandby(reader.stream.session, self.session_data)
+            self.standby.start()
+        self.state = None
+        self.state_resume = None
+        if self.session_data.options.get('state_file'):
+            self.state = HLSSessionState(self.session_data.options['state_file'],
+                                         self.session_data)
+            self.state_resume = self.state.load()
+        self.playlist_previous_first = 0
+        self.reload_scheduler = None
+        if self.session_data.options.get('adaptive_reload'):
+            self.reload_scheduler = HLSSessionReloadScheduler()
+
+        # Low-Latency HLS
+        self.low_latency = self.session_data.options.get('low_latency')
+        self.playlist_low_latency = False
+        self.playlist_block_reload = None
+        self.playlist_part_target = None
+        self.playlist_parts = {}
+        self.playlist_preload_hint = None
+        # segment number and index of the next part
+        self.part_sequence = None
+        self.part_index = 0
+
+        self.variants = None
+        HLSStreamWorker.__init__(self, reader, *args, **kwargs)
+
+        variants = getattr(reader.stream, 'session_variants', None)
+        if variants:
+            self.variants = HLSSessionVariants(self, variants)
+
+    def close(self):
+        if not self.closed and self.reload_scheduler:
+            log.debug('Playlist reload stats: {0}'.format(
+                self.reload_scheduler.stats()))
+        if self.standby:
+            self.standby.close()
+        if self.variants:
+            self.variants.close()
+        HLSStreamWorker.close(self)
+
+    def reload_session(self, cause):
         '''Replaces the current stream with a new stream'''
-        TempData.cached_data.update({'timestamp': int(time())})
+        self.session_data.timestamp = int(time())
+        if self.metrics:
+            self.metrics.session_reload(cause)
 
-        cache_stream_name = TempData.cached_data.get('stream_name')
-        cache_stream_url = TempData.cached_data.get('url')
+        cache_stream_name = self.session_data.stream_name
+        cache_stream_url = self.session_data.url
 
         if not (cache_stream_name and cache_stream_url):
             log.warning('Missing cached data for hlssession,'
                         'your Streamlink Application is not setup correctly.')
-            return
+            return False
 
         log.debug('Current stream: {0} - {1}'.format(
             cache_stream_name, cache_stream_url))
-        log.debug('Reloading session playlist')
-        streams = self.session.streams(
-            cache_stream_url, stream_types=['hls'])
 
-        if not streams:
-            log.debug('No stream found for hls-session-reload,'
-                      ' stream is not available.')
-            return
+        streams = self.standby and self.standby.take()
+        if streams:
+            log.debug('Using the standby stream')
+        else:
+            log.debug('Reloading session playlist')
+            try:
+                streams = self.session.streams(
+                    cache_stream_url, stream_types=['hls'])
+            except (NoPluginError, PluginError) as err:
+                log.debug('Failed to reload the session: {0}'.format(err))
+                return False
+
+            if not streams or cache_stream_name not in streams:
+                log.debug('No stream found for hls-session-reload,'
+                          ' stream is not available.')
+                return False
 
         # overwrite the stream
         self.stream = streams[cache_stream_name]
+        if self.variants:
+            self.variants.session_reloaded(streams)
+        # the next playlist has to be aligned with the last segment
+        self.session_realign = True
+        self.playlist_block_reload = None
+        self.part_sequence = None
         log.debug('New stream_url: {0}'.format(self.stream.url))
+        return True
+
+    def session_realign_sequence(self, sequences):
+        '''Find the next unseen sequence in the playlist of a new session
+
+        The sequence numbers of a new session can restart or jump,
+        the last written segment is used to find the next sequence by
+          - EXT-X-PROGRAM-DATE-TIME
+          - the filename of the segment
+          - the media duration since the last playlist reload
+        '''
+        last_sequence = self.last_sequence
+        next_sequence = sequences[-1].num + 1
+
+        last_date = segment_date(last_sequence.segment)
+        if last_date is not None and segment_date(sequences[-1].segment) is not None:
+            last_date += last_sequence.segment.duration
+            for sequence in sequences:
+                date = segment_date(sequence.segment)
+                if date is not None and date + sequence.segment.duration / 2.0 > last_date:
+                    next_sequence = sequence.num
+                    break
+            log.debug('Realign sequence by date: {0}'.format(next_sequence))
+            return next_sequence
+
+        last_fingerprint = segment_fingerprint(last_sequence.segment)
+        for sequence in sequences:
+            if segment_fingerprint(sequence.segment) == last_fingerprint:
+                log.debug('Realign sequence by filename: {0}'.format(sequence.num + 1))
+                return sequence.num + 1
+
+        # media duration of the old playlist after the last segment
+        # and the time since the old playlist was loaded
+        duration = time() - self.playlist_time
+        for sequence in self.playlist_sequences:
+            if sequence.num > last_sequence.num:
+                duration += sequence.segment.duration
+
+        media_duration = 0
+        for sequence in reversed(sequences):
+            media_duration += sequence.segment.duration
+            if media_duration > duration + sequence.segment.duration / 2.0:
+                break
+            next_sequence = sequence.num
+
+        log.debug('Realign sequence by duration ({0:.2f}s): {1}'.format(
+            duration, next_sequence))
+        return next_sequence
 
     def reload_session_invalid_sequence_check(self):
         # only allows reload_session(),
         # if the last reload is older than 10 seconds
-        if TempData.session_reload_segment and (int(time() - TempData.cached_data['timestamp']) >= 10):
+        if self.session_data.session_reload_segment and (int(time() - self.session_data.timestamp) >= 10):
             # if a reload_playlist() fails because of invalid sequences,
             # it will allow the usage of reload_session() on the next
             # failed try of reload_playlist()
-            TempData.session_reload_segment_status = True
+            self.session_data.session_reload_segment_status = True
+
+    def resume_session(self, state):
+        '''Continue after the last written segment of a previous process
+
+        The stored stream is used if it is not expired,
+        otherwise the new stream is aligned with the stored segment.
+        '''
+        log.debug('Resuming after segment {0} ({1:.2f}s of media)'.format(
+            state['sequence'], state['media_time']))
+        self.reader.writer.media_time = state['media_time']
+        self.last_sequence = Sequence(state['sequence'], Segment(
+            state['uri'], state['duration'], None, None, False, None,
+            state['date'], None))
+        # the duration since the checkpoint is used without a date or filename
+        self.playlist_time = state['time']
+        self.session_realign = True
+
+        reload_time = self.session_data.session_reload_time
+        if (state['stream_url'] == self.stream.url
+                or (reload_time and time() - state['timestamp'] >= reload_time)):
+            return False
+
+        args = dict(self.stream.args)
+        args.pop('url', None)
+        self.stream = HLSSessionHLSStream(self.session, state['stream_url'], **args)
+        try:
+            self.reload_playlist()
+        except StreamError as err:
+            log.debug('Stored stream failed: {0}'.format(err))
+            self.stream = self.reader.stream
+            self.session_realign = True
+            return False
+
+        log.debug('Using the stored stream: {0}'.format(self.stream.url))
+        self.session_data.timestamp = state['timestamp']
+        return True
+
+    def reload_playlist(self):
+        if self.closed:
+            return
+
+        if self.state_resume:
+            state, self.state_resume = self.state_resume, None
+            if self.resume_session(state):
+                return
+
+        self.reader.buffer.wait_free()
+        log.debug('Reloading playlist')
+        request_params = self.reader.request_params
+        if self.playlist_block_reload:
+            # blocking playlist reload, the server will respond
+            # after the next part is available
+            request_params = dict(request_params)
+            params = dict(request_params.get('params') or {})
+            params['_HLS_msn'], params['_HLS_part'] = self.playlist_block_reload
+            request_params['params'] = params
+
+        retries = self.playlist_reload_retries
+        if self.standby and self.standby.ready:
+            # don't retry, the standby stream is faster
+            retries = 0
+
+        start_time = time()
+        res = self.http.get(self.stream.url,
+                            exception=StreamError,
+                            retries=retries,
+                            **request_params)
+        if self.metrics:
+            self.metrics.playlist_reload(time() - start_time)
+        try:
+            playlist = hls_playlist.load(res.text, res.url,
+                                         parser=HLSSessionM3U8Parser)
+        except ValueError as err:
+            raise StreamError(err)
+
+        if playlist.is_master:
+            raise StreamError('Attempted to play a variant playlist, use '
+                              "'hls://{0}' instead".format(self.stream.url))
+
+        if playlist.iframes_only:
+            raise StreamError('Streams containing I-frames only is not playable')
+
+        media_sequence = playlist.media_sequence or 0
+        sequences = [Sequence(media_sequence + i, s)
+                     for i, s in enumerate(playlist.segments)]
+
+        self.playlist_parts = dict((media_sequence + i, parts)
+                                   for i, parts in playlist.parts.items())
+        self.playlist_preload_hint = playlist.preload_hint
+        self.playlist_part_target = playlist.part_target
+        # encrypted parts can't be decrypted on their own
+        self.playlist_low_latency = bool(
+            self.low_latency and sequences and playlist.part_target
+            and not playlist.is_endlist
+            and not (sequences[-1].segment.key
+                     and sequences[-1].segment.key.method != 'NONE'))
+
+        self.playlist_block_reload = None
+        if (self.playlist_low_latency
+                and playlist.server_control.get('CAN-BLOCK-RELOAD') == 'YES'):
+            num = sequences[-1].num + 1
+            self.playlist_block_reload = (num, len(self.playlist_parts.get(num, [])))
+
+        if sequences:
+            self.process_sequences(playlist, sequences)
+
+        if self.variants:
+            self.variants.reloaded()
 
     def process_sequences(self, playlist, sequences):
         first_sequence, last_sequence = sequences[0], sequences[-1]
@@ -63,23 +1625,46 @@ class HLSSessionHLSStreamWorker(HLSStreamWorker):
         if first_sequence.segment.key and first_sequence.segment.key.method != 'NONE':
             log.debug('Segments in this playlist are encrypted')
 
+        last_num = (self.playlist_sequences[-1].num
+                    if self.playlist_sequences else last_sequence.num - 1)
+        self.playlist_previous_first = (self.playlist_sequences[0].num
+                                        if self.playlist_sequences else first_sequence.num)
         self.playlist_changed = ([s.num for s in self.playlist_sequences]
                                  != [s.num for s in sequences])
         self.playlist_reload_time = (playlist.target_duration
                                      or last_sequence.segment.duration)
+
+        if self.session_realign:
+            self.session_realign = False
+            if self.last_sequence:
+                self.playlist_sequence = self.session_realign_sequence(sequences)
+
         self.playlist_sequences = sequences
+        self.playlist_time = time()
+
+        if self.metrics:
+            if not self.playlist_changed:
+                self.metrics.inc('playlist_reloads_unchanged')
+            if 0 <= self.playlist_sequence < first_sequence.num:
+                # segments were removed before they were added to the queue
+                self.metrics.inc('sequences_skipped', first_sequence.num - self.playlist_sequence)
 
         if not self.playlist_changed:
             self.playlist_reload_time = max(self.playlist_reload_time / 2, 1)
             # uses reload_session() on the 2nd reload_playlist()
             # if the playlist did not change
-            if TempData.session_reload_segment and TempData.session_reload_segment_status is True:
+            if self.session_data.session_reload_segment and self.session_data.session_reload_segment_status is True:
                 log.debug('Expected reload_session() - invalid sequences')
-                self.reload_session()
-                TempData.session_reload_segment_status = False
+                self.reload_session('invalid_sequence')
+                self.session_data.session_reload_segment_status = False
 
         if playlist.is_endlist:
             self.playlist_end = last_sequence.num
+        elif self.reload_scheduler:
+            self.reload_scheduler.update(
+                self.playlist_changed,
+                playlist.target_duration or last_sequence.segment.duration,
+                added=last_sequence.num - last_num)
 
         if self.playlist_sequence < 0:
             if self.playlist_end is None and not self.hls_live_restart:
@@ -92,11 +1677,16 @@ class HLSSessionHLSStreamWorker(HLSStreamWorker):
     def valid_sequence(self, sequence):
         if sequence.num >= self.playlist_sequence:
             return True
-        elif TempData.sequence_ignore_number and sequence.num <= (self.playlist_sequence - TempData.sequence_ignore_number):
+        elif self.session_data.sequence_ignore_number and sequence.num <= (self.playlist_sequence - self.session_data.sequence_ignore_number):
             log.warning('Added invalid segment number.')
+            if self.metrics:
+                self.metrics.inc('sequences_ignored')
             self.reload_session_invalid_sequence_check()
             return True
         else:
+            if self.metrics and sequence.num < self.playlist_previous_first:
+                # older than the previous playlist, not only an old segment
+                self.metrics.inc('sequences_invalid')
             self.reload_session_invalid_sequence_check()
             return False
 
@@ -115,44 +1705,442 @@ class HLSSessionHLSStreamWorker(HLSStreamWorker):
         # could not skip far enough, so return the default
         return default
 
+    def part_to_sequence(self, sequence, part):
+        segment = sequence.segment
+        return PartSequence(sequence.num, Segment(part.uri, part.duration, None,
+                                                  segment.key, False, part.byterange,
+                                                  None, segment.map))
+
+    def iter_playlist(self):
+        '''Segments of the current playlist,
+        the parts of a Low-Latency HLS playlist are used for the next segment'''
+        for sequence in filter(self.valid_sequence, self.playlist_sequences):
+            if self.part_sequence == sequence.num and self.part_index > 0:
+                # the segment is complete, only the remaining parts are missing
+                parts = self.playlist_parts.get(sequence.num, [])
+                for index, part in enumerate(parts[self.part_index:], self.part_index):
+                    log.debug('Adding part {0}.{1} to queue'.format(
+                        sequence.num, index))
+                    yield self.part_to_sequence(sequence, part)
+                if self.part_index > len(parts):
+                    # a preload hint was the first part of the next segment
+                    self.part_sequence = sequence.num + 1
+                    self.part_index = self.part_index - len(parts)
+            else:
+                log.debug('Adding segment {0} to queue', sequence.num)
+                yield sequence
+            self.last_sequence = sequence
+            self.playlist_sequence = sequence.num + 1
+
+        if not (self.playlist_low_latency and self.playlist_sequences):
+            return
+
+        sequence = Sequence(self.playlist_sequences[-1].num + 1,
+                            self.playlist_sequences[-1].segment)
+        if sequence.num < self.playlist_sequence:
+            return
+
+        if self.part_sequence != sequence.num:
+            self.part_sequence = sequence.num
+            self.part_index = 0
+
+        parts = list(self.playlist_parts.get(sequence.num, []))
+        hint = self.playlist_preload_hint
+        if hint and hint.uri not in [part.uri for part in parts]:
+            parts.append(hint)
+
+        for part in parts[self.part_index:]:
+            log.debug('Adding part {0}.{1} to queue'.format(
+                sequence.num, self.part_index))
+            self.part_index += 1
+            yield self.part_to_sequence(sequence, part)
+
     def iter_segments(self):
         total_duration = 0
         while not self.closed:
-            if TempData.session_reload_time and (
-                    (TempData.cached_data['timestamp']
-                     + TempData.session_reload_time) < int(time())):
+            if self.session_data.session_reload_time and (
+                    (self.session_data.timestamp
+                     + self.session_data.session_reload_time) < int(time())):
                 log.debug('Expected reload_session() - time')
-                self.reload_session()
-            for sequence in filter(self.valid_sequence, self.playlist_sequences):
-                log.debug('Adding segment {0} to queue', sequence.num)
+                self.reload_session('time')
+            for sequence in self.iter_playlist():
                 yield sequence
+                if self.metrics:
+                    # media duration between the queued segment and the live edge
+                    self.metrics.live_edge_gap = sum(
+                        s.segment.duration for s in self.playlist_sequences
+                        if s.num > sequence.num)
                 total_duration += sequence.segment.duration
                 if self.duration_limit and total_duration >= self.duration_limit:
                     log.info('Stopping stream early after {0}'.format(self.duration_limit))
                     return
 
-                # End of stream
-                stream_end = self.playlist_end and sequence.num >= self.playlist_end
-                if self.closed or stream_end:
+                if self.closed:
                     return
 
-                self.playlist_sequence = sequence.num + 1
+            # End of stream
+            if self.playlist_end is not None and self.playlist_sequence > self.playlist_end:
+                return
 
-            if self.wait(self.playlist_reload_time):
+            reload_time = self.playlist_reload_time
+            if self.playlist_low_latency:
+                reload_time = 0 if self.playlist_block_reload else self.playlist_part_target
+            elif self.reload_scheduler and self.reload_scheduler.next_reload:
+                reload_time = max(self.reload_scheduler.next_reload - time(), 0)
+
+            if self.wait(reload_time):
+                reloads = self.reload_scheduler and self.reload_scheduler.reloads
                 try:
                     self.reload_playlist()
                 except StreamError as err:
-                    log.warning('Failed to reload playlist: {0}', err)
-                    if (TempData.session_reload_time or TempData.session_reload_segment):
+                    log.warning('Failed to reload playlist: {0}'.format(err))
+                    # a blocking reload is only used after a successful reload
+                    self.playlist_block_reload = None
+                    if self.metrics:
+                        self.metrics.inc('playlist_reloads_failed')
+                    if (self.standby or self.session_data.session_reload_time
+                            or self.session_data.session_reload_segment):
                         log.warning('Unexpected reload_session() - StreamError')
-                        self.reload_session()
+                        if self.reload_session('stream_error') and self.standby:
+                            # reload the new playlist without waiting
+                            try:
+                                self.reload_playlist()
+                            except StreamError as err:
+                                log.warning('Failed to reload playlist: {0}'.format(err))
+
+                if self.reload_scheduler and self.reload_scheduler.reloads == reloads:
+                    # the playlist was empty or failed, the next reload
+                    # must not use the deadline of the last one
+                    self.reload_scheduler.update(False, self.playlist_reload_time)
+
+
+class HLSSessionVariantWorker(HLSSessionHLSStreamWorker):
+    '''Worker of a variant of a HLSSessionVariants group
+
+    The playlist is reloaded after the playlist of the main worker,
+    the session is reloaded by the main worker.
+    '''
+
+    def __init__(self, reader, *args, **kwargs):
+        self.group = reader.stream.session_group
+        self.reloads = 0
+        # stream of a new session, set by HLSSessionVariants.session_reloaded
+        self.session_stream = None
+        HLSSessionHLSStreamWorker.__init__(self, reader, *args, **kwargs)
+
+    def reload_session(self, cause):
+        # the main worker reloads the session
+        return False
+
+    def reload_playlist(self):
+        # a new stream is only used by this thread,
+        # the realign has to use the playlist of the new stream
+        with self.group.lock:
+            stream, self.session_stream = self.session_stream, None
+        if stream:
+            self.stream = stream
+            self.session_realign = True
+        HLSSessionHLSStreamWorker.reload_playlist(self)
+
+    def process_sequences(self, playlist, sequences):
+        start = self.playlist_sequence < 0
+        HLSSessionHLSStreamWorker.process_sequences(self, playlist, sequences)
+        if start:
+            self.playlist_sequence = self.group.start_sequence(sequences, self.playlist_sequence)
+
+    def iter_segments(self):
+        total_duration = 0
+        while not self.closed:
+            for sequence in self.iter_playlist():
+                yield sequence
+                total_duration += sequence.segment.duration
+                if self.duration_limit and total_duration >= self.duration_limit:
+                    return
+
+                if self.closed:
+                    return
+
+            if self.playlist_end is not None and self.playlist_sequence > self.playlist_end:
+                return
+
+            if self.group.wait(self, self.playlist_reload_time * 2):
+                try:
+                    self.reload_playlist()
+                except StreamError as err:
+                    log.warning('Failed to reload variant playlist: {0}'.format(err))
+                    if self.metrics:
+                        self.metrics.inc('playlist_reloads_failed')
+
+
+class HLSSessionRingBuffer(RingBuffer):
+    '''RingBuffer without a copy of the written data
+
+    Read-only data, like the content of a response, is stored as
+    memoryview slices, a read copies the slices once into bytes.
+    Writable data is copied, it can be reused by the writer.
+    '''
+
+    def write(self, data):
+        if self.closed:
+            return
+
+        view = memoryview(data)
+        if not view.readonly:
+            view = memoryview(bytes(view))
+        written = 0
+        while written < len(view):
+            self.event_free.wait()
+
+            if self.closed:
+                return
+
+            with self.buffer_lock:
+                write_len = min(self.free, len(view) - written)
+                self.chunks.append(view[written:written + write_len])
+                self.length += write_len
+                written += write_len
+
+                self._check_events()
+
+    def _read(self, size=-1):
+        with self.buffer_lock:
+            if size < 0 or size > self.length:
+                size = self.length
+            chunks = []
+            left = size
+            while left:
+                chunk = self.chunks[0]
+                if len(chunk) <= left:
+                    chunks.append(self.chunks.popleft())
+                else:
+                    chunks.append(chunk[:left])
+                    self.chunks[0] = chunk[left:]
+                left -= len(chunks[-1])
+            self.length -= size
+
+            self._check_events()
+
+        if is_py2:
+            return b''.join(chunk.tobytes() for chunk in chunks)
+        return b''.join(chunks)
+
+
+class HLSSessionFileBuffer(object):
+    '''Replaces the RingBuffer of a reader,
+    the segments are written directly into a file'''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = Lock()
+        self.closed = False
+        # an existing recording is not overwritten or appended
+        flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0)
+        self.fd = os.fdopen(os.open(filename, flags), 'wb')
+
+    def write(self, data):
+        with self.lock:
+            if not self.closed:
+                self.fd.write(data)
+
+    def wait_free(self, timeout=None):
+        return True
+
+    def close(self):
+        with self.lock:
+            if not self.closed:
+                self.closed = True
+                self.fd.close()
+
+
+class HLSSessionVariants(object):
+    '''Records other variants of the same session with a main worker
+
+    The variants share the playlist reload time and the session reload
+    of the main worker, the first segment is aligned by the
+    EXT-X-PROGRAM-DATE-TIME or the number of the first segment
+    of the main worker.
+    '''
+
+    def __init__(self, worker, streams):
+        self.worker = worker
+        self.lock = Condition()
+        self.reloads = 0
+        self.closed = False
+        self.first_sequence = worker.playlist_sequence
+        self.first_date = None
+        for sequence in worker.playlist_sequences:
+            if sequence.num == self.first_sequence:
+                self.first_date = segment_date(sequence.segment)
+
+        template = worker.session_data.options.get('variants_output')
+        self.readers = {}
+        for name, stream in sorted(streams.items()):
+            if stream.url == worker.stream.url:
+                continue
+            stream = HLSSessionHLSStream.from_stream(stream)
+            stream.session_group = self
+            stream.session_url = worker.session_data.url
+            stream.session_stream_name = name
+            # the main worker uses the standby stream for every variant
+            stream.session_options = dict(worker.session_data.options, standby=False)
+            reader = HLSSessionVariantReader(stream, template.replace('{name}', name))
+            try:
+                reader.open()
+            except (IOError, OSError, StreamError) as err:
+                log.error('Failed to open variant {0}: {1}'.format(name, err))
+                continue
+            log.info('Writing variant {0} to {1}'.format(name, reader.filename))
+            self.readers[name] = reader
+
+    def start_sequence(self, sequences, default):
+        '''First sequence of a variant'''
+        if self.first_date is not None:
+            for sequence in sequences:
+                date = segment_date(sequence.segment)
+                if date is not None and date + sequence.segment.duration / 2.0 > self.first_date:
+                    return sequence.num
+        if sequences[0].num <= self.first_sequence <= sequences[-1].num + 1:
+            return self.first_sequence
+        return default
+
+    def reloaded(self):
+        with self.lock:
+            self.reloads += 1
+            self.lock.notify_all()
+
+    def wait(self, worker, timeout):
+        '''Waits for the next playlist reload of the main worker'''
+        with self.lock:
+            if worker.reloads == self.reloads and not (self.closed or worker.closed):
+                self.lock.wait(timeout)
+            worker.reloads = self.reloads
+        return not (self.closed or worker.closed)
+
+    def session_reloaded(self, streams):
+        for name, reader in self.readers.items():
+            if name not in streams:
+                log.warning('Variant {0} is not available'.format(name))
+                continue
+            with self.lock:
+                reader.worker.session_stream = streams[name]
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.lock.notify_all()
+        for reader in self.readers.values():
+            reader.close()
 
 
 class HLSSessionHLSStreamReader(HLSStreamReader):
     __worker__ = HLSSessionHLSStreamWorker
+    __writer__ = HLSSessionHLSStreamWriter
+
+    def __init__(self, stream, *args, **kwargs):
+        HLSStreamReader.__init__(self, stream, *args, **kwargs)
+        options = stream.session_options or {}
+        self.metrics = None
+        if options.get('metrics_port') or options.get('metrics_file'):
+            self.metrics = HLSSessionMetrics(stream.session_url or stream.url,
+                                             stream.session_stream_name)
+
+    def create_buffer(self):
+        return HLSSessionRingBuffer(self.session.get_option('ringbuffer-size'))
+
+    def open(self):
+        if self.metrics:
+            HLSSessionMetrics.register(self.metrics)
+        self.buffer = self.create_buffer()
+        self.writer = self.__writer__(self)
+        self.worker = self.__worker__(self)
+
+        self.writer.start()
+        self.worker.start()
+
+    def close(self):
+        HLSStreamReader.close(self)
+        if self.metrics:
+            HLSSessionMetrics.unregister(self.metrics)
+
+
+class HLSSessionRestreamBuffer(object):
+    '''Replaces the RingBuffer of a restream upstream,
+    the data of a segment is collected for the channel'''
+
+    def __init__(self, reader):
+        self.reader = reader
+        self.closed = False
+        self.data = bytearray()
+
+    def write(self, data):
+        self.data += data
+
+    def wait_free(self, timeout=None):
+        return True
+
+    def pop(self):
+        data, self.data = bytes(self.data), bytearray()
+        return data
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.reader.channel.upstream_closed(self.reader)
+
+
+class HLSSessionRestreamWriter(HLSSessionHLSStreamWriter):
+    def write(self, sequence, res, chunk_size=8192):
+        HLSSessionHLSStreamWriter.write(self, sequence, res, chunk_size)
+        data = self.reader.buffer.pop()
+        if data and self.reader.channel.add(sequence.segment.duration, data):
+            log.debug('No restream clients, closing the upstream')
+            self.reader.close()
+
+
+class HLSSessionRestreamReader(HLSSessionHLSStreamReader):
+    __writer__ = HLSSessionRestreamWriter
+
+    def __init__(self, stream, channel, *args, **kwargs):
+        HLSSessionHLSStreamReader.__init__(self, stream, *args, **kwargs)
+        self.channel = channel
+
+    def create_buffer(self):
+        return HLSSessionRestreamBuffer(self)
+
+
+class HLSSessionVariantReader(HLSSessionHLSStreamReader):
+    __worker__ = HLSSessionVariantWorker
+
+    def __init__(self, stream, filename, *args, **kwargs):
+        HLSSessionHLSStreamReader.__init__(self, stream, *args, **kwargs)
+        self.filename = filename
+
+    def create_buffer(self):
+        return HLSSessionFileBuffer(self.filename)
 
 
 class HLSSessionHLSStream(HLSStream):
+    # set by HLSSessionPlugin, used for the HLSSessionData of a worker
+    session_url = None
+    session_stream_name = 'best'
+    session_options = None
+    # streams that are recorded with this stream
+    session_variants = None
+    # HLSSessionVariants of a variant stream
+    session_group = None
+
+    @classmethod
+    def from_stream(cls, stream, **params):
+        '''Creates a hlssession stream from a resolved HLSStream'''
+        args = dict(stream.args)
+        args.pop('url', None)
+        args.update(params)
+        return cls(stream.session, stream.url,
+                   force_restart=stream.force_restart,
+                   start_offset=stream.start_offset,
+                   duration=stream.duration,
+                   **args)
+
     def open(self):
         reader = HLSSessionHLSStreamReader(self)
         reader.open()
@@ -162,8 +2150,74 @@ class HLSSessionHLSStream(HLSStream):
 
 class HLSSessionPlugin(Plugin):
     _url_re = re.compile(r'(hlssession://)(.+(?:\.m3u8)?.*)')
+    _alt_re = re.compile(r'^(.+)_alt\d*$')
+    _synonyms = ('best', 'worst', 'best-unfiltered', 'worst-unfiltered')
 
     arguments = PluginArguments(
+        PluginArgument(
+            'adaptive-reload',
+            action='store_true',
+            help='''
+            Learn the update cadence of the playlist and reload it
+            shortly after the next expected update, with a back-off
+            if the playlist did not change.
+
+            Reduces the latency behind the live edge. An update that is
+            earlier than expected is found by an extra reload, a stalled
+            playlist is reloaded less often.
+
+            Default is False.
+            '''
+        ),
+        PluginArgument(
+            'buffer-size',
+            type=filesize,
+            metavar='SIZE',
+            help='''
+            Max. size of the downloaded segments, that are not written yet.
+            The playlist worker waits until segments are written.
+
+            Default is Disabled.
+            '''
+        ),
+        PluginArgument(
+            'buffer-duration',
+            type=num(float, min=1),
+            metavar='SECONDS',
+            help='''
+            Max. media duration of the queued segments, that are not written yet.
+
+            Default is Disabled.
+            '''
+        ),
+        PluginArgument(
+            'hedge',
+            type=num(int, min=50, max=99),
+            metavar='PERCENTILE',
+            help='''
+            Send a second request for a segment, if the download takes
+            longer than this percentile of the recent download times,
+            the first complete response is used.
+
+            A redundant stream of the playlist is used as alternate host.
+            Max. 10% of the segment requests are hedged.
+
+            Default is Disabled.
+            '''
+        ),
+        PluginArgument(
+            'http2',
+            action='store_true',
+            help='''
+            Use HTTP/2 for the playlist and segment requests of https streams,
+            all requests to the same host use one connection.
+
+            Requires the httpx package with HTTP/2 support (httpx[http2]),
+            HTTP/1.1 is used without it or if the server does not support HTTP/2.
+
+            Default is False.
+            '''
+        ),
         PluginArgument(
             'ignore_number',
             # dest='hls-segment-ignore-number',
@@ -181,6 +2235,89 @@ class HLSSessionPlugin(Plugin):
             Default is Disabled.
             '''
         ),
+        PluginArgument(
+            'low-latency',
+            action='store_true',
+            help='''
+            Use Low-Latency HLS features if the playlist supports them,
+            blocking playlist reloads (EXT-X-SERVER-CONTROL),
+            partial segments (EXT-X-PART) and EXT-X-PRELOAD-HINT.
+
+            Encrypted partial segments are not supported.
+
+            Default is False.
+            '''
+        ),
+        PluginArgument(
+            'memory-budget',
+            type=filesize,
+            metavar='SIZE',
+            help='''
+            Max. size of the downloaded segments of all hlssession streams
+            of this process, every open stream gets the same share.
+
+            Default is Disabled.
+            '''
+        ),
+        PluginArgument(
+            'metrics-port',
+            type=num(int, min=1, max=65535),
+            metavar='PORT',
+            help='''
+            Export the metrics of all hlssession streams with a local HTTP server.
+
+              http://127.0.0.1:PORT/metrics (Prometheus text format)
+              http://127.0.0.1:PORT/metrics.json
+
+            Default is Disabled.
+            '''
+        ),
+        PluginArgument(
+            'metrics-file',
+            metavar='FILENAME',
+            help='''
+            Write the metrics of all hlssession streams
+            every 10 seconds into a JSON file.
+
+            Default is Disabled.
+            '''
+        ),
+        PluginArgument(
+            'prefetch',
+            type=num(int, min=1, max=10),
+            metavar='SEGMENTS',
+            help='''
+            Number of segments that are downloaded in parallel and in advance,
+            the segments are still written in the correct order.
+
+            Unlike --hls-segment-threads, which only sets the download threads
+            and queues up to 20 segments, the queue is limited to SEGMENTS
+            segments. The download threads are --hls-segment-threads,
+            at least SEGMENTS. The peak of the downloaded and requested
+            bytes is logged, a request counts with the average segment size.
+
+            Useful for high latency servers.
+
+            Default is Disabled.
+            '''
+        ),
+        PluginArgument(
+            'restream-port',
+            type=num(int, min=1, max=65535),
+            metavar='PORT',
+            help='''
+            Restream the streams with a local HTTP server,
+            every stream uses only one upstream connection
+            for any number of clients.
+
+              http://127.0.0.1:PORT/KEY/playlist.m3u8
+
+            The upstream is closed if there was no client request
+            for 60 seconds.
+
+            Default is Disabled.
+            '''
+        ),
         PluginArgument(
             'segment',
             # dest='hls-session-reload-segment',
@@ -194,6 +2331,30 @@ class HLSSessionPlugin(Plugin):
             if the time is set incorrectly, it might not work for every stream.
             '''
         ),
+        PluginArgument(
+            'standby',
+            action='store_true',
+            help='''
+            Keep a second resolved stream ready, its playlist is checked
+            every 30 seconds. If the current playlist fails, the standby
+            stream is used immediately and a new standby stream is resolved.
+
+            Default is False.
+            '''
+        ),
+        PluginArgument(
+            'state-file',
+            metavar='FILENAME',
+            help='''
+            Save the last written segment of the stream in FILENAME,
+            a restarted stream will continue after this segment
+            if it is still available in the playlist.
+
+            A relative FILENAME is stored in the Streamlink cache directory.
+
+            Default is Disabled.
+            '''
+        ),
         PluginArgument(
             'time',
             # dest='hls-session-reload-time',
@@ -207,8 +2368,34 @@ class HLSSessionPlugin(Plugin):
 
             Default is Disabled.
 
-            Note: --hlssession-ignore-number can be used for new playlists
-            that contain different segment numbers
+            Note: new playlists are aligned with the last segment
+            by EXT-X-PROGRAM-DATE-TIME, the segment filename or the
+            media duration, --hlssession-ignore-number can still be used
+            for new playlists that contain different segment numbers
+            '''
+        ),
+        PluginArgument(
+            'variants',
+            metavar='NAMES',
+            help='''
+            Comma separated list of stream names or "all",
+            these variants are recorded with the selected stream
+            into the --hlssession-variants-output files.
+
+            The variants use the playlist reload time and
+            the session reload of the selected stream.
+
+            Default is Disabled.
+            '''
+        ),
+        PluginArgument(
+            'variants-output',
+            metavar='FILENAME',
+            help='''
+            Output file of a variant, {name} is replaced by the stream name.
+            An existing file is not overwritten, the variant is skipped.
+
+            Default is "{name}.ts".
             '''
         ),
     )
@@ -217,9 +2404,22 @@ class HLSSessionPlugin(Plugin):
     def can_handle_url(cls, url):
         return cls._url_re.match(url)
 
+    def _alternate_hosts(self, streams):
+        '''Hosts of redundant streams with the same path'''
+        hosts = {}
+        for name, stream in streams.items():
+            match = self._alt_re.match(name)
+            if not match:
+                continue
+            main = streams.get(match.group(1))
+            alt_url, main_url = urlparse(stream.url), urlparse(getattr(main, 'url', ''))
+            if main and alt_url._replace(netloc=main_url.netloc) == main_url:
+                hosts.setdefault(main.url, []).append(alt_url.netloc)
+        return hosts
+
     def _get_streams(self):
         self.session.http.headers.update({'User-Agent': useragents.FIREFOX})
-        log.debug('Version 2018-07-12')
+        log.debug('Version 2026-10-19')
         log.info('This is a custom plugin. '
                  'For support visit https://github.com/back-to/plugins')
 
@@ -227,31 +2427,32 @@ class HLSSessionPlugin(Plugin):
         urlnoproto = self._url_re.match(url).group(2)
         urlnoproto = update_scheme('http://', urlnoproto)
 
-        if not hasattr(TempData, 'sequence_ignore_number'):
-            TempData.sequence_ignore_number = (
-                HLSSessionPlugin.get_option('ignore_number')
-                or 0)
-
-        if not hasattr(TempData, 'session_reload_segment'):
-            TempData.session_reload_segment = (
-                HLSSessionPlugin.get_option('segment')
-                or False)
-        if not hasattr(TempData, 'session_reload_segment_status'):
-            TempData.session_reload_segment_status = False
-
-        if not hasattr(TempData, 'session_reload_time'):
-            TempData.session_reload_time = int(
-                HLSSessionPlugin.get_option('time')
-                or 0)
-
-        if not hasattr(TempData, 'cached_data'):
-            TempData.cached_data = {}
-            # set a timestamp, if it was not set previously
-            if not TempData.cached_data.get('timestamp'):
-                TempData.cached_data.update({'timestamp': int(time())})
+        session_url = urlnoproto
+        session_options = {
+            'ignore_number': self.get_option('ignore_number'),
+            'segment': self.get_option('segment'),
+            'time': self.get_option('time'),
+            'adaptive_reload': self.get_option('adaptive_reload'),
+            'prefetch': self.get_option('prefetch'),
+            'low_latency': self.get_option('low_latency'),
+            'metrics_port': self.get_option('metrics_port'),
+            'metrics_file': self.get_option('metrics_file'),
+            'standby': self.get_option('standby'),
+            'state_file': self.get_option('state_file'),
+            'restream_port': self.get_option('restream_port'),
+            'variants': self.get_option('variants'),
+            'variants_output': self.get_option('variants_output') or '{name}.ts',
+            'hedge': self.get_option('hedge'),
+            'buffer_size': self.get_option('buffer_size'),
+            'buffer_duration': self.get_option('buffer_duration'),
+            'memory_budget': self.get_option('memory_budget'),
+            'http2': self.get_option('http2'),
+        }
 
-            TempData.cached_data.update({'stream_name': 'best'})
-            TempData.cached_data.update({'url': urlnoproto})
+        if session_options['metrics_port']:
+            HLSSessionMetricsServer.start(session_options['metrics_port'])
+        if session_options['metrics_file']:
+            HLSSessionMetricsFile.start_file(session_options['metrics_file'])
 
         streams = self.session.streams(
             urlnoproto, stream_types=['hls'])
@@ -261,15 +2462,45 @@ class HLSSessionPlugin(Plugin):
                       ' stream is not available.')
             return
 
-        stream = streams['best']
-        urlnoproto = stream.url
+        variants = {}
+        if session_options['variants']:
+            names = [n.strip() for n in session_options['variants'].split(',')]
+            for name, stream in streams.items():
+                if (name in self._synonyms or self._alt_re.match(name)
+                        or not isinstance(stream, HLSStream)):
+                    continue
+                if name in names or 'all' in names:
+                    variants[name] = stream
+            if not variants:
+                log.warning('No variants found for: {0}'.format(session_options['variants']))
+
+        if session_options['hedge']:
+            session_options['hedge_hosts'] = self._alternate_hosts(streams)
 
         self.logger.debug('URL={0}; params={1}', urlnoproto, params)
-        streams = HLSSessionHLSStream.parse_variant_playlist(self.session, urlnoproto, **params)
-        if not streams:
-            return {'live': HLSSessionHLSStream(self.session, urlnoproto, **params)}
-        else:
-            return streams
+        # the resolved streams are used, without a new request
+        streams = dict((name, HLSSessionHLSStream.from_stream(stream, **params))
+                       for name, stream in streams.items()
+                       if name not in self._synonyms and isinstance(stream, HLSStream))
+
+        for name, stream in streams.items():
+            stream.session_url = session_url
+            stream.session_stream_name = name
+            stream.session_options = session_options
+
+        if variants:
+            for stream in streams.values():
+                stream.session_variants = variants
+
+        restream_port = session_options['restream_port']
+        if restream_port and HLSSessionRestreamServer.start(restream_port):
+            for name, stream in list(streams.items()):
+                key = HLSSessionRestreamChannel.register(name, stream)
+                streams[name] = HLSStream(
+                    self.session,
+                    'http://127.0.0.1:{0}/{1}/playlist.m3u8'.format(restream_port, key))
+
+        return streams
 
 
 __plugin__ = HLSSessionPlugin
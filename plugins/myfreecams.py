@@ -3,6 +3,10 @@ import random
 import re
 import uuid
 
+from collections import deque
+from threading import Lock
+from time import time
+
 from streamlink.compat import unquote
 from streamlink.exceptions import NoStreamsError, PluginError
 from streamlink.plugin import Plugin, PluginArgument, PluginArguments
@@ -10,11 +14,244 @@ from streamlink.plugin.api import useragents, validate
 from streamlink.stream import DASHStream, HLSStream
 from streamlink.utils import parse_json
 
-from websocket import create_connection
+from websocket import create_connection, WebSocketTimeoutException
 
 log = logging.getLogger(__name__)
 
 
+class MyFreeCamsServers(object):
+    '''Cached serverconfig.js
+
+    The config is stored in memory and in the plugin cache,
+    after ttl seconds it is revalidated with ETag and Last-Modified.
+    '''
+
+    ttl = 60 * 60
+    cache_expires = 60 * 60 * 24 * 7
+    # camserver types, in the order of their lookup
+    server_types = ('h5video_servers', 'wzobs_servers', 'ngvideo_servers')
+
+    _lock = Lock()
+    _config = None
+
+    def __init__(self, servers, etag=None, last_modified=None, timestamp=None):
+        self.servers = servers
+        self.etag = etag
+        self.last_modified = last_modified
+        self.timestamp = timestamp or time()
+
+        self.chat_servers = servers['chat_servers']
+        # camserver id to (host, server type)
+        self.camservers = {}
+        for server_type in reversed(self.server_types):
+            for key, value in servers[server_type].items():
+                if value:
+                    self.camservers[key] = (value, server_type)
+
+    def camserver(self, key):
+        return self.camservers.get(str(key), (None, None))
+
+    def to_dict(self):
+        return {
+            'servers': self.servers,
+            'etag': self.etag,
+            'last_modified': self.last_modified,
+            'timestamp': self.timestamp,
+        }
+
+    @classmethod
+    def get(cls, plugin):
+        with cls._lock:
+            if cls._config is None:
+                data = plugin.cache.get('serverconfig')
+                if data:
+                    cls._config = cls(**data)
+
+            config = cls._config
+            if config is not None and config.timestamp + cls.ttl > time():
+                return config
+
+            headers = {}
+            if config is not None:
+                if config.etag:
+                    headers['If-None-Match'] = config.etag
+                if config.last_modified:
+                    headers['If-Modified-Since'] = config.last_modified
+
+            try:
+                res = plugin.session.http.get(plugin.JS_SERVER_URL, headers=headers)
+            except PluginError as err:
+                if config is None:
+                    raise
+                log.warning('Using the cached serverconfig.js: {0}'.format(err))
+                return config
+
+            if config is not None and res.status_code == 304:
+                log.debug('serverconfig.js is not modified')
+                config.timestamp = time()
+            else:
+                config = cls(parse_json(res.text),
+                             etag=res.headers.get('ETag'),
+                             last_modified=res.headers.get('Last-Modified'))
+
+            cls._config = config
+            plugin.cache.set('serverconfig', config.to_dict(),
+                             expires=cls.cache_expires)
+            return config
+
+
+class MyFreeCamsParser(object):
+    '''Incremental parser of MyFreeCams chat messages
+
+    Every message starts with its length as 4 digits, the received data
+    is appended to a buffer and read from an offset.
+    '''
+
+    # read bytes that are removed from the buffer
+    compact_size = 64 * 1024
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.offset = 0
+
+    def feed(self, data):
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        self.buffer.extend(data)
+
+    def messages(self):
+        '''Yields FCTYPE, nArg1 and the message of every complete message'''
+        buffer = self.buffer
+        size = len(buffer)
+        while size - self.offset >= 4:
+            start = self.offset + 4
+            try:
+                message_length = int(bytes(buffer[self.offset:start]))
+            except ValueError:
+                log.debug('Invalid message length, the buffer is dropped')
+                self.offset = size
+                break
+
+            end = start + message_length
+            if end > size:
+                break
+            self.offset = end
+
+            message = unquote(bytes(buffer[start:end]).decode('utf-8'))
+            fields = message.split(' ', 5)
+            try:
+                FCTYPE = int(fields[0])
+                nArg1 = int(fields[3])
+            except (IndexError, ValueError):
+                log.debug('Invalid message: {0}'.format(message[:64]))
+                continue
+
+            yield FCTYPE, nArg1, message
+
+        if self.offset == size or self.offset >= self.compact_size:
+            del buffer[:self.offset]
+            self.offset = 0
+
+
+class MyFreeCamsChat(object):
+    '''Guest connection to a MyFreeCams chat server
+
+    Every username lookup has its own query id in nArg1,
+    multiple lookups are sent on the same connection.
+    '''
+
+    url = 'wss://{0}.myfreecams.com/fcsl'
+    # lookups without a reply on one chat server
+    max_queries = 20
+    # seconds to wait for the reply of a lookup
+    timeout = 10.0
+
+    def __init__(self, chat_servers):
+        self.chat_servers = chat_servers
+        self.ws = None
+        self.php_message = ''
+        self.query_id = 19
+
+    def connect(self):
+        try_to_connect = 0
+        while (try_to_connect < 5):
+            try:
+                xchat = str(random.choice(self.chat_servers))
+                host = self.url.format(xchat)
+                self.ws = create_connection(host)
+                self.ws.send('hello fcserver\n\0')
+                r_id = str(uuid.uuid4().hex[0:32])
+                self.ws.send('1 0 0 20071025 0 {0}@guest:guest\n'.format(r_id))
+                log.debug('Websocket server {0} connected'.format(xchat))
+                try_to_connect = 5
+            except Exception:
+                try_to_connect += 1
+                log.debug('Failed to connect to WS server: {0} - try {1}'.format(xchat, try_to_connect))
+                if try_to_connect == 5:
+                    log.error('can\'t connect to the websocket')
+                    raise
+
+    def close(self):
+        try:
+            self.ws.send('99 0 0 0 0')
+        finally:
+            self.ws.close()
+
+    def messages(self):
+        '''Yields FCTYPE, nArg1 and the message of every received message'''
+        parser = MyFreeCamsParser()
+        while True:
+            parser.feed(self.ws.recv())
+            for FCTYPE, nArg1, message in parser.messages():
+                if FCTYPE == 81:
+                    self.php_message = message
+                yield FCTYPE, nArg1, message
+
+    def wait(self, fctype):
+        '''Returns the next message of a FCTYPE'''
+        for FCTYPE, nArg1, message in self.messages():
+            if FCTYPE == fctype:
+                return message
+
+    def lookup(self, usernames):
+        '''Returns the FCTYPE 10 message of every username
+
+        Up to max_queries lookups are sent before their reply,
+        a username without a reply after timeout seconds is missing.
+        '''
+        pending = deque(usernames)
+        queries = {}
+        results = {}
+        logged_in = False
+        self.ws.settimeout(self.timeout)
+        try:
+            for FCTYPE, nArg1, message in self.messages():
+                if FCTYPE == 1:
+                    logged_in = True
+                elif FCTYPE == 10 and nArg1 in queries:
+                    results[queries.pop(nArg1)[0]] = message
+
+                now = time()
+                for query_id, (username, sent) in list(queries.items()):
+                    if now - sent > self.timeout:
+                        log.debug('No reply for {0}'.format(username))
+                        del queries[query_id]
+
+                if logged_in:
+                    while pending and len(queries) < self.max_queries:
+                        self.query_id += 1
+                        username = pending.popleft()
+                        queries[self.query_id] = (username, now)
+                        self.ws.send('10 0 0 {0} 0 {1}\n'.format(self.query_id, username))
+                    if not queries:
+                        break
+        except WebSocketTimeoutException:
+            log.debug('No reply for {0} lookups'.format(len(queries) + len(pending)))
+        finally:
+            self.ws.settimeout(None)
+        return results
+
+
 class MyFreeCams(Plugin):
     '''Streamlink Plugin for MyFreeCams
 
@@ -38,7 +275,6 @@ class MyFreeCams(Plugin):
             \?id=(?P<user_id>\d+)
         )''', re.VERBOSE)
     _dict_re = re.compile(r'''(?P<data>{.*})''')
-    _socket_re = re.compile(r'''(\w+) (\w+) (\w+) (\w+) (\w+)''')
 
     _data_schema = validate.Schema(
         {
@@ -140,94 +376,56 @@ class MyFreeCams(Plugin):
             message: data to create a video url.
             php_message: data for self._php_fallback
         '''
-        try_to_connect = 0
-        while (try_to_connect < 5):
-            try:
-                xchat = str(random.choice(chat_servers))
-                host = 'wss://{0}.myfreecams.com/fcsl'.format(xchat)
-                ws = create_connection(host)
-                ws.send('hello fcserver\n\0')
-                r_id = str(uuid.uuid4().hex[0:32])
-                ws.send('1 0 0 20071025 0 {0}@guest:guest\n'.format(r_id))
-                log.debug('Websocket server {0} connected'.format(xchat))
-                try_to_connect = 5
-            except Exception:
-                try_to_connect += 1
-                log.debug('Failed to connect to WS server: {0} - try {1}'.format(xchat, try_to_connect))
-                if try_to_connect == 5:
-                    log.error('can\'t connect to the websocket')
-                    raise
-
-        buff = ''
-        php_message = ''
-        ws_close = 0
-        while ws_close == 0:
-            socket_buffer = ws.recv()
-            socket_buffer = buff + socket_buffer
-            buff = ''
-            while True:
-                ws_answer = self._socket_re.search(socket_buffer)
-                if bool(ws_answer) == 0:
-                    break
-
-                FC = ws_answer.group(1)
-                FCTYPE = int(FC[4:])
-
-                message_length = int(FC[0:4])
-                message = socket_buffer[4:4 + message_length]
-
-                if len(message) < message_length:
-                    buff = ''.join(socket_buffer)
-                    break
-
-                message = unquote(message)
-
-                if FCTYPE == 1 and username:
-                    ws.send('10 0 0 20 0 {0}\n'.format(username))
-                elif FCTYPE == 81:
-                    php_message = message
-                    if username is None:
-                        ws_close = 1
-                elif FCTYPE == 10:
-                    ws_close = 1
+        chat = MyFreeCamsChat(chat_servers)
+        chat.connect()
+        try:
+            if username:
+                message = chat.lookup([username]).get(username, '')
+            else:
+                message = chat.wait(81)
+        finally:
+            chat.close()
+        return message, chat.php_message
 
-                socket_buffer = socket_buffer[4 + message_length:]
+    def lookup(self, usernames):
+        '''Model data of multiple usernames with one chat connection
 
-                if len(socket_buffer) == 0:
-                    break
+        Args:
+            usernames: list of Model Usernames
 
-        ws.send('99 0 0 0 0')
-        ws.close()
-        return message, php_message
+        Returns:
+            dict of username to the data of self._data_schema,
+            None for an unknown username or a lookup without a reply
+        '''
+        servers = self._get_servers()
+        chat = MyFreeCamsChat(servers.chat_servers)
+        chat.connect()
+        try:
+            messages = chat.lookup(usernames)
+        finally:
+            chat.close()
+
+        models = {}
+        for username in usernames:
+            models[username] = None
+            data = self._dict_re.search(messages.get(username, ''))
+            if data is None:
+                continue
+            try:
+                models[username] = parse_json(data.group('data'), schema=self._data_schema)
+            except PluginError as err:
+                log.debug('Invalid data for {0}: {1}'.format(username, err))
+        return models
 
     def _get_servers(self):
-        res = self.session.http.get(self.JS_SERVER_URL)
-        servers = parse_json(res.text)
-        return servers
+        return MyFreeCamsServers.get(self)
 
     def _get_camserver(self, servers, key):
-        server_type = None
-        value = None
-
-        h5video_servers = servers['h5video_servers']
-        ngvideo_servers = servers['ngvideo_servers']
-        wzobs_servers = servers['wzobs_servers']
-
-        if h5video_servers.get(str(key)):
-            value = h5video_servers[str(key)]
-            server_type = 'h5video_servers'
-        elif wzobs_servers.get(str(key)):
-            value = wzobs_servers[str(key)]
-            server_type = 'wzobs_servers'
-        elif ngvideo_servers.get(str(key)):
-            value = ngvideo_servers[str(key)]
-            server_type = 'ngvideo_servers'
-
-        return value, server_type
+        return servers.camserver(key)
 
     def _get_streams(self):
         self.session.http.headers.update({'User-Agent': useragents.FIREFOX})
-        log.debug('Version 2018-07-12')
+        log.debug('Version 2026-10-19')
         log.info('This is a custom plugin. '
                  'For support visit https://github.com/back-to/plugins')
         match = self._url_re.match(self.url)
@@ -235,7 +433,7 @@ class MyFreeCams(Plugin):
         user_id = match.group('user_id')
 
         servers = self._get_servers()
-        chat_servers = servers['chat_servers']
+        chat_servers = servers.chat_servers
 
         message, php_message = self._websocket_data(username, chat_servers)
 
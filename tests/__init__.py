@@ -0,0 +1,13 @@
+import imp
+import os
+
+PLUGINS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'plugins')
+
+
+def load_plugin(name):
+    '''Loads the module of a plugin from plugins/'''
+    file, pathname, desc = imp.find_module(name, [PLUGINS])
+    try:
+        return imp.load_module('streamlink.plugin.{0}'.format(name), file, pathname, desc)
+    finally:
+        file.close()
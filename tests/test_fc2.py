@@ -0,0 +1,254 @@
+import json
+import subprocess
+import sys
+import unittest
+
+from threading import Event
+
+from streamlink import Streamlink
+
+from tests import load_plugin
+
+fc2 = load_plugin('fc2')
+
+
+class FakeControl(object):
+    def __init__(self):
+        self.closed = Event()
+        self.released = Event()
+
+    def release(self):
+        self.released.set()
+
+    def close(self):
+        self.closed.set()
+
+
+class FakeProcessIO(object):
+    def __init__(self, code):
+        self.process = subprocess.Popen([sys.executable, '-c', code],
+                                        stdout=subprocess.PIPE)
+
+    def read(self, size=-1):
+        return self.process.stdout.read(size)
+
+    def close(self):
+        self.process.kill()
+        self.process.wait()
+        self.process.stdout.close()
+
+
+class TestFC2RTMPStreamIO(unittest.TestCase):
+
+    def test_close(self):
+        control = FakeControl()
+        fd = fc2.FC2RTMPStreamIO(FakeProcessIO('import time; time.sleep(30)'), control)
+        self.assertFalse(control.closed.is_set())
+        fd.close()
+        self.assertTrue(control.closed.is_set())
+
+    def test_process_exit(self):
+        control = FakeControl()
+        fd = fc2.FC2RTMPStreamIO(FakeProcessIO('print("flv")'), control)
+        # the control is kept for a reconnect
+        self.assertTrue(control.released.wait(10))
+        self.assertFalse(control.closed.is_set())
+        self.assertEqual(fd.read(3), b'flv')
+        fd.close()
+        self.assertFalse(control.closed.is_set())
+
+
+class FakeWebSocket(object):
+    connected = True
+
+    def __init__(self, control):
+        self.control = control
+
+    def send(self, payload):
+        # the media server information of a new media token
+        if 'get_media_server_information' in payload:
+            self.control.on_message({'name': '_response_', 'arguments': {
+                'host': '127.0.0.1', 'application': 'live',
+                'media_token': 'token{0}'.format(self.control.count_ping),
+                'play_rtmp_stream': 'stream'}})
+
+    def close(self):
+        self.connected = False
+
+
+class TestFC2Control(unittest.TestCase):
+
+    def control(self, grace_timeout):
+        control = fc2.FC2Control('ws://127.0.0.1/control')
+        control.grace_timeout = grace_timeout
+        control.ws = FakeWebSocket(control)
+        return control
+
+    def test_grace_timeout(self):
+        control = self.control(0.1)
+        control.release()
+        control.grace_timer.join(5)
+        self.assertFalse(control.ws.connected)
+
+    def test_acquire(self):
+        control = self.control(0.1)
+        control.release()
+        timer = control.grace_timer
+        control.acquire()
+        timer.join(5)
+        self.assertTrue(control.ws.connected)
+
+    def test_reconnect(self):
+        control = self.control(30)
+        control.media_server_information()
+        plugin = FakePlugin({})
+        plugin.url = 'https://live.fc2.com/100/'
+        plugin._rtmp_params = fc2.FC2._rtmp_params.__get__(plugin)
+        plugin._get_ws_data = fc2.FC2._get_ws_data.__get__(plugin)
+        plugin._url_re = fc2.FC2._url_re
+        stream = fc2.FC2RTMPStream(Streamlink(), {}, plugin, control)
+        rtmp_open = fc2.RTMPStream.open
+        fc2.RTMPStream.open = lambda self: FakeProcessIO('print("flv")')
+        try:
+            fd = stream.open()
+            fd.fd.process.wait()
+            fd.close()
+            # a reconnect after a drop only requests a new media token
+            fd = stream.open()
+            fd.close()
+        finally:
+            fc2.RTMPStream.open = rtmp_open
+        self.assertIs(stream.control, control)
+        self.assertEqual(plugin.requests, [])
+        self.assertEqual(stream.parameters['app'], 'live?media_token=token2')
+        control.close()
+
+
+class FakePlugin(object):
+    def __init__(self, errors):
+        self.errors = errors
+        self.requests = []
+
+    def _get_version(self, user_id):
+        self.requests.append(user_id)
+        if user_id in self.errors:
+            raise self.errors[user_id]
+        return '1'
+
+    def _get_ws_url(self, user_id, version):
+        return 'ws://127.0.0.1/control/{0}'.format(user_id)
+
+
+class TestFC2Monitor(unittest.TestCase):
+
+    def test_poll(self):
+        plugin = FakePlugin({
+            '100': fc2.PluginError('The broadcaster is currently not available'),
+            '101': KeyError('channel_data'),
+            '102': IOError('Connection reset'),
+        })
+        monitor = fc2.FC2Monitor(plugin, ['100', '101', '102', '103'])
+        online = []
+        monitor.online = lambda user_id, ws_url: online.append((user_id, ws_url))
+        # a failed channel does not stop the other channels
+        monitor.poll()
+        self.assertEqual(sorted(plugin.requests), ['100', '101', '102', '103'])
+        self.assertEqual(online, [('103', 'ws://127.0.0.1/control/103')])
+
+
+class FakeControlWebSocket(object):
+    '''WebSocket with the messages of the server after started is set,
+    closed after the last message'''
+
+    def __init__(self, messages):
+        self.messages = list(messages)
+        self.connected = True
+        self.sent = []
+        self.started = Event()
+        self.closed = Event()
+
+    def send(self, payload):
+        self.sent.append(json.loads(payload)['name'])
+
+    def recv(self):
+        self.started.wait(10)
+        if not self.messages:
+            self.closed.wait(10)
+            raise IOError('closed')
+        return json.dumps(self.messages.pop(0))
+
+    def close(self):
+        self.connected = False
+        self.closed.set()
+
+
+class TestFC2MonitorControl(unittest.TestCase):
+
+    def setUp(self):
+        self.create_connection = fc2.create_connection
+        self.events = []
+        self.offline = Event()
+        self.monitor = fc2.FC2Monitor(FakePlugin({}), ['100'],
+                                      on_online=self.on_online,
+                                      on_offline=self.on_offline)
+
+    def tearDown(self):
+        fc2.create_connection = self.create_connection
+        self.monitor.close()
+
+    def on_online(self, user_id):
+        self.events.append('online')
+
+    def on_offline(self, user_id):
+        self.events.append('offline')
+        self.offline.set()
+
+    def online(self, ws, error=None):
+        def create_connection(url):
+            if error:
+                raise error
+            # the channel is not online before the connect
+            self.events.append('connect')
+            return ws
+        fc2.create_connection = create_connection
+        self.monitor.online('100', 'ws://127.0.0.1/control/100')
+
+    def test_connect_error(self):
+        self.online(None, error=IOError('Connection refused'))
+        self.assertEqual(self.events, [])
+        self.assertEqual(self.monitor.controls, {})
+
+    def test_publish_stop(self):
+        ws = FakeControlWebSocket([{'name': 'user_count', 'arguments': {}},
+                                   {'name': 'publish_stop', 'arguments': {}}])
+        self.online(ws)
+        self.assertEqual(self.events, ['connect', 'online'])
+        ws.started.set()
+        self.assertTrue(self.offline.wait(10))
+        self.assertEqual(self.events, ['connect', 'online', 'offline'])
+        self.assertEqual(self.monitor.controls, {})
+        self.assertFalse(ws.connected)
+
+    def test_channel_information(self):
+        ws = FakeControlWebSocket([{'name': 'channel_information', 'arguments': {'fee': 0}},
+                                   {'name': 'channel_information', 'arguments': {'fee': 100}}])
+        self.online(ws)
+        ws.started.set()
+        # a channel with a fee is offline for the monitor
+        self.assertTrue(self.offline.wait(10))
+        self.assertEqual(self.events, ['connect', 'online', 'offline'])
+        self.assertEqual(ws.messages, [])
+
+    def test_closed_while_connecting(self):
+        ws = FakeControlWebSocket([])
+        ws.started.set()
+        # the server closes the control before connect() returns
+        ws.send = lambda payload: self.monitor.controls['100'].close()
+        self.online(ws)
+        # the channel was never online
+        self.assertEqual(self.events, ['connect'])
+        self.assertEqual(self.monitor.controls, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,388 @@
+import time
+import unittest
+
+from collections import defaultdict
+from concurrent import futures
+from threading import Event, Thread
+
+from Crypto.Cipher import AES
+
+from streamlink import Streamlink
+from streamlink.compat import queue
+from streamlink.stream.hls import Sequence
+from streamlink.stream.hls_playlist import ByteRange, Key, Segment
+
+from tests import load_plugin
+from tools import hlsbench
+from tools.hlsorigin import HLSOrigin
+
+hlskeyuri = load_plugin('hlskeyuri')
+
+KEY = b'0123456789abcdef'
+IV = b'\x00' * 15 + b'\x07'
+
+
+def encrypt(data):
+    padding = 16 - len(data) % 16
+    data += bytes(bytearray([padding] * padding))
+    return AES.new(KEY, AES.MODE_CBC, IV).encrypt(data)
+
+
+def split(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class FakeResponse(object):
+    def __init__(self, data, fail_after=None, wait=None):
+        self.data = data
+        self.fail_after = fail_after
+        # the body after wait[0] bytes is sent when wait[1] is set
+        self.wait = wait
+        self.closed = False
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.data), chunk_size):
+            if self.fail_after is not None and i >= self.fail_after:
+                raise IOError('Connection broken')
+            if self.wait and i >= self.wait[0]:
+                self.wait[1].wait(10)
+            yield self.data[i:i + chunk_size]
+
+    def close(self):
+        self.closed = True
+
+
+class FakeHTTP(object):
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def get(self, url, **kwargs):
+        self.requests.append(kwargs)
+        return self.responses.pop(0)
+
+
+class FakeBuffer(object):
+    def __init__(self):
+        self.data = b''
+        self.written = Event()
+
+    def write(self, data):
+        self.data += data
+        self.written.set()
+
+
+class FakeReader(object):
+    request_params = {}
+
+    def __init__(self):
+        self.buffer = FakeBuffer()
+
+
+class FakeSession(object):
+    def __init__(self, responses):
+        self.http = FakeHTTP(responses)
+
+
+class TestWriteDecrypted(unittest.TestCase):
+
+    def decrypt(self, chunks):
+        writer = hlskeyuri.KeyUriHLSStreamWriter.__new__(hlskeyuri.KeyUriHLSStreamWriter)
+        writer.decrypt_pool = None
+        data = []
+        writer.write_decrypted(AES.new(KEY, AES.MODE_CBC, IV), chunks,
+                               lambda chunk, size=None: data.append(chunk))
+        return b''.join(data)
+
+    def test_chunks(self):
+        data = bytes(bytearray(range(256))) * 20
+        for size in (1, 15, 16, 17, 31, 32, 33, 4096, len(data) + 16):
+            self.assertEqual(self.decrypt(split(encrypt(data), size)), data, size)
+
+    def test_padding(self):
+        # a full block of padding and a single byte of padding
+        for data in (b'x' * 32, b'x' * 31, b''):
+            self.assertEqual(self.decrypt(split(encrypt(data), 7)), data)
+
+    def test_garbage(self):
+        data = b'segment data' * 100
+        self.assertEqual(self.decrypt(split(encrypt(data) + b'garbage', 16)), data)
+
+
+class TestFetch(unittest.TestCase):
+
+    def writer(self, responses, decrypt_pool=None):
+        writer = hlskeyuri.KeyUriHLSStreamWriter.__new__(hlskeyuri.KeyUriHLSStreamWriter)
+        writer.closed = False
+        writer.ignore_names = None
+        writer.timeout = 10
+        writer.retries = 3
+        writer.decrypt_pool = decrypt_pool
+        writer.chunk_size = 64
+        writer.session = FakeSession(responses)
+        writer.reader = FakeReader()
+        writer.create_request_params = lambda sequence: {}
+        writer.key_uri = None
+        key = futures.Future()
+        key.set_result(KEY)
+        writer.get_key = lambda uri: key
+        return writer
+
+    def sequence(self, encrypted=True, byterange=None):
+        key = Key('AES-128', 'key', IV, None, None) if encrypted else None
+        return Sequence(1, Segment('1.ts', 1.0, None, key, False, byterange, None, None))
+
+    def fetch(self, writer, sequence, retries=3):
+        segment = hlskeyuri.KeyUriSegment(writer, 1000)
+        writer.fetch(sequence, segment, retries=retries)
+        chunks = []
+        while True:
+            chunk = segment.queue.get_nowait()
+            if chunk is None:
+                return segment, b''.join(chunks)
+            if isinstance(chunk, futures.Future):
+                chunk = chunk.result(5)
+            chunks.append(chunk)
+
+    def test_retry(self):
+        data = b'segment data' * 100
+        broken = FakeResponse(encrypt(data), fail_after=256)
+        writer = self.writer([broken, FakeResponse(encrypt(data))])
+        segment, written = self.fetch(writer, self.sequence())
+        # the chunks of the broken download are not written again
+        self.assertEqual(written, data)
+        self.assertTrue(segment.complete)
+        self.assertTrue(broken.closed)
+        self.assertEqual(len(writer.session.http.requests), 2)
+        self.assertTrue(writer.session.http.requests[0]['stream'])
+
+    def test_retry_byterange(self):
+        data = b'segment data' * 100
+        writer = self.writer([FakeResponse(encrypt(data), fail_after=256),
+                              FakeResponse(encrypt(data))])
+        writer.byterange_offsets = defaultdict(int)
+        del writer.create_request_params
+        sequence = self.sequence(byterange=ByteRange(len(encrypt(data)), None))
+        segment, written = self.fetch(writer, sequence)
+        self.assertEqual(written, data)
+        ranges = [r['headers']['Range'] for r in writer.session.http.requests]
+        self.assertEqual(ranges, ['bytes=0-1215', 'bytes=0-1215'])
+
+    def test_retries(self):
+        data = b'segment data' * 100
+        writer = self.writer([FakeResponse(encrypt(data), fail_after=0),
+                              FakeResponse(encrypt(data), fail_after=0)])
+        segment, written = self.fetch(writer, self.sequence(), retries=2)
+        self.assertFalse(segment.complete)
+        self.assertEqual(written, b'')
+
+    def test_unencrypted(self):
+        data = b'segment data' * 100
+        broken = FakeResponse(data, fail_after=256)
+        writer = self.writer([broken, FakeResponse(data)])
+        segment, written = self.fetch(writer, self.sequence(encrypted=False))
+        self.assertEqual(written, data)
+        self.assertTrue(segment.complete)
+
+    def test_decrypt_pool(self):
+        data = b'segment data' * 100
+        pool = futures.ThreadPoolExecutor(max_workers=1)
+        try:
+            writer = self.writer([FakeResponse(encrypt(data))], decrypt_pool=pool)
+            segment, written = self.fetch(writer, self.sequence())
+        finally:
+            pool.shutdown()
+        self.assertEqual(written, data)
+        self.assertTrue(writer.session.http.requests[0]['stream'])
+
+    def test_decrypt_pool_handoff(self):
+        data = b'segment data' * 100
+        busy = Event()
+        pool = futures.ThreadPoolExecutor(max_workers=1)
+        try:
+            # the pool is busy with another stream
+            pool.submit(busy.wait, 10)
+            writer = self.writer([FakeResponse(encrypt(data))], decrypt_pool=pool)
+            segment = hlskeyuri.KeyUriSegment(writer, 1000)
+            # the fetch thread does not wait for the decryption
+            writer.fetch(self.sequence(), segment, retries=3)
+            self.assertTrue(segment.complete)
+            self.assertFalse(writer.reader.buffer.written.is_set())
+            busy.set()
+            writer.write(self.sequence(), segment)
+        finally:
+            busy.set()
+            pool.shutdown()
+        self.assertEqual(writer.reader.buffer.data, data)
+
+    def test_decrypt_pool_retry(self):
+        data = b'segment data' * 100
+        pool = futures.ThreadPoolExecutor(max_workers=2)
+        try:
+            writer = self.writer([FakeResponse(encrypt(data), fail_after=256),
+                                  FakeResponse(encrypt(data))], decrypt_pool=pool)
+            segment, written = self.fetch(writer, self.sequence())
+        finally:
+            pool.shutdown()
+        self.assertEqual(written, data)
+        self.assertTrue(segment.complete)
+
+    def test_write_while_downloading(self):
+        data = b'segment data' * 100
+        release = Event()
+        writer = self.writer([FakeResponse(encrypt(data), wait=(512, release))])
+        writer.segment_queue_size = 2
+        writer.executor = futures.ThreadPoolExecutor(max_workers=1)
+        writer.futures = queue.Queue(10)
+        try:
+            writer.put(self.sequence())
+            sequence, future = writer.futures.get_nowait()
+            thread = Thread(target=writer.write, args=(sequence, future.result()))
+            thread.start()
+            # the first chunks are written before the download is complete
+            self.assertTrue(writer.reader.buffer.written.wait(5))
+            self.assertFalse(release.is_set())
+            release.set()
+            thread.join(5)
+        finally:
+            writer.executor.shutdown()
+        self.assertEqual(writer.reader.buffer.data, data)
+
+
+class TestKeyUriCache(unittest.TestCase):
+
+    def setUp(self):
+        self.requests = []
+
+    def fetch(self, uri):
+        self.requests.append(uri)
+        future = futures.Future()
+        future.set_result(uri.encode('ascii'))
+        return future
+
+    def test_lru(self):
+        cache = hlskeyuri.KeyUriCache(maxsize=2)
+        for uri in ('a', 'b', 'a', 'c'):
+            cache.get(uri, self.fetch)
+        # b is the least recently used key
+        self.assertEqual(list(cache.keys), ['a', 'c'])
+        self.assertEqual(cache.get('a', self.fetch).result(), b'a')
+        cache.get('b', self.fetch)
+        self.assertEqual(self.requests, ['a', 'b', 'c', 'b'])
+
+    def test_ttl(self):
+        cache = hlskeyuri.KeyUriCache(ttl=60)
+        future = cache.get('a', self.fetch)
+        self.assertIs(cache.get('a', self.fetch), future)
+        cache.keys['a'] = (time.time() - 61, future)
+        self.assertIsNot(cache.get('a', self.fetch), future)
+        self.assertEqual(self.requests, ['a', 'a'])
+
+    def test_failed(self):
+        cache = hlskeyuri.KeyUriCache()
+        running = futures.Future()
+        self.assertIs(cache.get('a', lambda uri: running), running)
+        # a running request is used by every segment
+        self.assertIs(cache.get('a', self.fetch), running)
+        running.set_exception(hlskeyuri.StreamError('Unable to open URL'))
+        # a failed request is not cached
+        self.assertEqual(cache.get('a', self.fetch).result(), b'a')
+        self.assertEqual(self.requests, ['a'])
+
+
+class FakeKeyExecutor(object):
+    def submit(self, fn, *args):
+        future = futures.Future()
+        future.set_result(fn(*args))
+        return future
+
+
+class FakeWorker(object):
+    def process_sequences(self, playlist, sequences):
+        self.processed = list(sequences)
+
+
+class TestPrefetchKeys(unittest.TestCase):
+
+    def setUp(self):
+        self.HLSStreamWorker = hlskeyuri.HLSStreamWorker
+        hlskeyuri.HLSStreamWorker = FakeWorker
+
+    def tearDown(self):
+        hlskeyuri.HLSStreamWorker = self.HLSStreamWorker
+
+    def writer(self, template=None):
+        writer = hlskeyuri.KeyUriHLSStreamWriter.__new__(hlskeyuri.KeyUriHLSStreamWriter)
+        writer.key_cache = hlskeyuri.KeyUriCache()
+        writer.key_executor = FakeKeyExecutor()
+        writer.key_uri_parts = writer._key_uri_re.split(template) if template else None
+        writer.key_uris = {}
+        writer.requests = []
+        writer.fetch_key = lambda uri: writer.requests.append(uri) or KEY
+        return writer
+
+    def key(self, uri, method='AES-128'):
+        return Key(method, uri, None, None, None)
+
+    def test_prefetch(self):
+        writer = self.writer()
+        keys = [None, self.key(None, 'NONE'), self.key('http://keys/1'),
+                self.key('http://keys/1'), self.key('http://keys/2'),
+                self.key('http://keys/3', 'SAMPLE-AES')]
+        writer.prefetch_keys(keys)
+        self.assertEqual(sorted(writer.requests), ['http://keys/1', 'http://keys/2'])
+        # the segments use the prefetched keys
+        writer.prefetch_keys(keys)
+        self.assertEqual(writer.get_key('http://keys/2').result(), KEY)
+        self.assertEqual(len(writer.requests), 2)
+
+    def test_prefetch_key_uri(self):
+        writer = self.writer('${scheme}${netloc}/keys${path}${query}')
+        writer.prefetch_keys([self.key('http://host/1?token=a')])
+        self.assertEqual(writer.requests, ['http://host/keys/1?token=a'])
+
+    def test_process_sequences(self):
+        writer = self.writer()
+        worker = hlskeyuri.KeyUriHLSStreamWorker.__new__(hlskeyuri.KeyUriHLSStreamWorker)
+        worker.writer = writer
+        worker.playlist_sequence = 2
+        sequences = [Sequence(num, Segment('{0}.ts'.format(num), 1.0, None,
+                                           self.key('http://keys/{0}'.format(num // 2)),
+                                           False, None, None, None))
+                     for num in range(5)]
+        worker.process_sequences(None, sequences)
+        self.assertEqual(worker.processed, sequences)
+        # only the keys of the new segments
+        self.assertEqual(sorted(writer.requests), ['http://keys/1', 'http://keys/2'])
+
+
+class TestKeyUriDecryptPool(unittest.TestCase):
+
+    def test_shared(self):
+        executor = hlskeyuri.KeyUriDecryptPool.get(2)
+        # the threads of the first stream are used
+        self.assertIs(hlskeyuri.KeyUriDecryptPool.get(4), executor)
+        self.assertEqual(hlskeyuri.KeyUriDecryptPool._threads, 2)
+
+
+class TestHLSKeyUriPlugin(unittest.TestCase):
+
+    def test_streams(self):
+        session = Streamlink()
+        plugin = hlsbench.load_plugin(session, 'hlskeyuri')
+        plugin.options.set('key_uri', '${scheme}${netloc}${path}${query}')
+        with HLSOrigin.scenario('encrypted') as origin:
+            streams = session.streams('hlskeyuri://{0}'.format(origin.url))
+            # the master playlist is not requested again
+            self.assertEqual(origin.stats['master'], 1)
+        self.assertEqual(sorted(streams), ['240p', '480p', 'best', 'worst'])
+        for stream in streams.values():
+            self.assertIsInstance(stream, hlskeyuri.KeyUriHLSStream)
+        # the synonyms are the streams of the variants
+        self.assertIs(streams['best'], streams['480p'])
+        self.assertIs(streams['worst'], streams['240p'])
+        self.assertTrue(streams['240p'].url.endswith('/240p.m3u8'))
+
+
+if __name__ == '__main__':
+    unittest.main()
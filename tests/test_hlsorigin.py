@@ -0,0 +1,169 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+try:
+    from urllib.request import urlopen
+except ImportError:
+    from urllib2 import urlopen
+
+from streamlink import Streamlink
+
+from tools import hlsbench
+from tools.hlsorigin import HLSOrigin
+
+
+class TestHLSOrigin(unittest.TestCase):
+
+    def get(self, origin, path):
+        return urlopen(origin.url.replace('/master.m3u8', path)).read().decode('utf-8')
+
+    def test_media_playlist(self):
+        with HLSOrigin.scenario('live') as origin:
+            master = self.get(origin, '/master.m3u8')
+            self.assertIn('RESOLUTION=853x480', master)
+            playlist = self.get(origin, '/1/480p.m3u8')
+            self.assertIn('#EXT-X-MEDIA-SEQUENCE:0', playlist)
+            self.assertEqual(playlist.count('#EXTINF'), origin.window)
+
+    def test_low_latency_playlist(self):
+        with HLSOrigin.scenario('lowlatency') as origin:
+            self.get(origin, '/master.m3u8')
+            playlist = self.get(origin, '/1/480p.m3u8')
+            self.assertIn('CAN-BLOCK-RELOAD=YES', playlist)
+            self.assertIn('#EXT-X-PRELOAD-HINT', playlist)
+
+    def test_reset(self):
+        origin = HLSOrigin.scenario('reset')
+        origin.start_time = 0
+        session = {'created': 10.0, 'offset': origin.first_sequence}
+        self.assertEqual(origin.session_sequence(session, 13, now=13.0), 1013)
+        # the first segment of the playlist at the reset is 0
+        self.assertEqual(origin.session_sequence(session, 14 - origin.window, now=14.0), 0)
+
+
+class TestScenarios(unittest.TestCase):
+    '''hlssession and hlskeyuri with the scenarios of tools/hlsorigin.py'''
+
+    duration = 6
+
+    def run_scenario(self, name, options=None, plugin='hlssession', duration=None,
+                     **origin_options):
+        with HLSOrigin.scenario(name, seed=1, **origin_options) as origin:
+            result = hlsbench.run(origin.url, plugin=plugin,
+                                  duration=duration or self.duration, options=options)
+        stream = result['streams'][0]
+        self.assertNotIn('error', stream)
+        self.assertGreater(stream['chunks'], 0)
+        return result['total'], stream
+
+    def test_live(self):
+        total, stream = self.run_scenario('live')
+        self.assertEqual(total['gaps'], 0)
+        self.assertEqual(total['duplicates'], 0)
+        self.assertEqual(stream['variants'], ['480p'])
+
+    def test_expire(self):
+        # the session is reloaded before the token expires
+        total, stream = self.run_scenario('expire', {'time': 2})
+        self.assertEqual(total['gaps'], 0)
+        self.assertEqual(total['duplicates'], 0)
+        self.assertGreater(total['origin']['sessions'], 1)
+
+    def test_restart(self):
+        total, stream = self.run_scenario('restart', {'time': 2})
+        self.assertEqual(total['gaps'], 0)
+        self.assertEqual(total['duplicates'], 0)
+
+    def test_jump(self):
+        total, stream = self.run_scenario('jump', {'time': 2})
+        self.assertEqual(total['gaps'], 0)
+        self.assertEqual(total['duplicates'], 0)
+
+    def test_reset(self):
+        # the segments with the new numbers are added again
+        total, stream = self.run_scenario('reset', {'ignore-number': 10})
+        self.assertEqual(total['gaps'], 0)
+        self.assertGreater(stream['chunks'], self.duration + 1)
+
+    def test_dead(self):
+        # the failed playlist reload is retried before the session reload
+        total, stream = self.run_scenario('dead', {'segment': True}, duration=10)
+        self.assertEqual(total['gaps'], 0)
+        self.assertGreater(total['origin']['sessions'], 1)
+
+    def test_dead_standby(self):
+        # the standby stream is used without a retry of the failed playlist
+        total, stream = self.run_scenario('dead', {'standby': True}, duration=10)
+        self.assertEqual(total['gaps'], 0)
+        self.assertEqual(total['duplicates'], 0)
+        self.assertGreater(total['origin']['sessions'], 2)
+        self.assertGreater(stream['metrics']['session_reloads']['stream_error'], 0)
+
+    def test_state_file(self):
+        # the restarted stream continues after the stored segment
+        tmpdir = tempfile.mkdtemp()
+        session = Streamlink()
+        plugin = hlsbench.load_plugin(session, 'hlssession')
+        plugin.options.set('state-file', os.path.join(tmpdir, 'state.json'))
+        try:
+            with HLSOrigin.scenario('live', seed=1) as origin:
+                check = hlsbench.StreamCheck(hlsbench.status(origin.url))
+                results = []
+                for _ in range(2):
+                    result = {}
+                    stream = session.streams('hlssession://{0}'.format(origin.url))['best']
+                    hlsbench.read_stream(stream, check, 4, result)
+                    results.append(result)
+                    # the live edge of a new stream is after the last segment
+                    time.sleep(3 * origin.segment_duration)
+        finally:
+            shutil.rmtree(tmpdir)
+        for result in results:
+            self.assertNotIn('error', result)
+        self.assertGreater(results[1]['chunks'], results[0]['chunks'])
+        self.assertEqual(check.gaps, 0)
+        self.assertEqual(check.duplicates, 0)
+
+    def test_errors(self):
+        total, stream = self.run_scenario('errors')
+        self.assertEqual(total['gaps'], 0)
+
+    def test_stall_prefetch(self):
+        # a stalled segment does not stop the next downloads
+        total, stream = self.run_scenario('stall', {'prefetch': 3})
+        self.assertEqual(total['gaps'], 0)
+        self.assertEqual(total['duplicates'], 0)
+
+    def test_stall_hedge(self):
+        total, stream = self.run_scenario('stall', {'hedge': 90})
+        self.assertEqual(total['gaps'], 0)
+        self.assertEqual(total['duplicates'], 0)
+
+    def test_freeze(self):
+        total, stream = self.run_scenario('freeze', {'adaptive-reload': True})
+        self.assertEqual(total['gaps'], 0)
+        self.assertEqual(total['duplicates'], 0)
+
+    def test_empty(self):
+        total, stream = self.run_scenario('empty', {'adaptive-reload': True})
+        self.assertEqual(total['gaps'], 0)
+        # no reloads without a wait for an empty playlist
+        self.assertLess(total['playlist_requests'], self.duration * 3)
+
+    def test_low_latency(self):
+        total, stream = self.run_scenario('lowlatency', {'low-latency': True})
+        self.assertEqual(total['gaps'], 0)
+        self.assertEqual(total['duplicates'], 0)
+        self.assertLess(stream['latency'], 1.0)
+
+    def test_encrypted(self):
+        total, stream = self.run_scenario('encrypted', plugin='hlskeyuri')
+        self.assertEqual(total['gaps'], 0)
+        self.assertEqual(total['duplicates'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,721 @@
+import json
+import os
+import re
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+import unittest
+
+from concurrent import futures
+from threading import Condition, Event, Thread, current_thread
+
+from streamlink import Streamlink
+from streamlink.compat import queue, urlparse
+from streamlink.stream.hls import Sequence
+from streamlink.stream.hls_playlist import Segment
+
+from tests import load_plugin
+from tools import hlsbench
+from tools.hlsorigin import HLSOrigin
+
+try:
+    from urllib.request import urlopen
+except ImportError:
+    from urllib2 import urlopen
+
+try:
+    from tools import h2bench
+except ImportError:
+    h2bench = None
+
+hlssession = load_plugin('hlssession')
+
+
+def segment(name, duration=2.0, date=None):
+    return Segment('http://127.0.0.1/{0}'.format(name), duration, None, None, False,
+                   None, date, None)
+
+
+def worker():
+    worker = hlssession.HLSSessionHLSStreamWorker.__new__(hlssession.HLSSessionHLSStreamWorker)
+    worker.session_data = hlssession.HLSSessionData('http://127.0.0.1/master.m3u8')
+    worker.metrics = None
+    worker.playlist_time = time.time()
+    worker.playlist_sequences = []
+    worker.playlist_previous_first = 0
+    worker.playlist_sequence = -1
+    worker.last_sequence = None
+    return worker
+
+
+class TestHLSSessionRealign(unittest.TestCase):
+
+    def test_date(self):
+        w = worker()
+        w.last_sequence = Sequence(5, segment('a/5.ts', date='2019-01-01T10:00:10Z'))
+        # the numbers of the new session restart
+        sequences = [Sequence(i, segment('b/{0}.ts'.format(i),
+                                         date='2019-01-01T10:00:{0:02d}Z'.format(4 + i * 2)))
+                     for i in range(6)]
+        self.assertEqual(w.session_realign_sequence(sequences), 4)
+
+    def test_filename(self):
+        w = worker()
+        w.last_sequence = Sequence(5, segment('a/5.ts?token=old'))
+        sequences = [Sequence(100 + i, segment('b/{0}.ts?token=new'.format(i)))
+                     for i in range(2, 8)]
+        self.assertEqual(w.session_realign_sequence(sequences), 106)
+
+    def test_duration(self):
+        w = worker()
+        w.last_sequence = Sequence(5, segment('a/5.ts'))
+        # two segments of the old playlist were not written
+        w.playlist_sequences = [Sequence(i, segment('a/{0}.ts'.format(i)))
+                                for i in range(3, 8)]
+        sequences = [Sequence(i, segment('b/new{0}.ts'.format(i))) for i in range(6)]
+        self.assertEqual(w.session_realign_sequence(sequences), 4)
+
+
+class TestHLSSessionParts(unittest.TestCase):
+
+    def setUp(self):
+        self.worker = worker()
+        self.worker.playlist_low_latency = True
+        self.worker.part_sequence = None
+        self.worker.part_index = 0
+
+    def part(self, num, index):
+        return hlssession.Part('http://127.0.0.1/{0}.{1}.ts'.format(num, index), 0.25, True, None)
+
+    def reload(self, last, parts, hint):
+        '''playlist with the segments up to last, the parts of the next segment and a hint'''
+        w = self.worker
+        w.playlist_sequences = [Sequence(n, segment('{0}.ts'.format(n)))
+                                for n in range(last - 2, last + 1)]
+        w.playlist_parts = dict((n, [self.part(n, i) for i in range(count)])
+                                for n, count in parts.items())
+        w.playlist_preload_hint = hint and self.part(*hint)
+        if w.playlist_sequence < 0:
+            w.playlist_sequence = last
+        return [(sequence.num, sequence.segment.uri.rsplit('/', 1)[-1])
+                for sequence in w.iter_playlist()]
+
+    def test_parts(self):
+        self.assertEqual(self.reload(1, {2: 2}, (2, 2)),
+                         [(1, '1.ts'), (2, '2.0.ts'), (2, '2.1.ts'), (2, '2.2.ts')])
+        # the parts of a complete segment are not added again
+        self.assertEqual(self.reload(2, {2: 4, 3: 1}, (3, 1)),
+                         [(2, '2.3.ts'), (3, '3.0.ts'), (3, '3.1.ts')])
+        # a blocking reload with a new part of the same segment
+        self.assertEqual(self.reload(2, {2: 4, 3: 3}, (3, 3)),
+                         [(3, '3.2.ts'), (3, '3.3.ts')])
+
+    def test_hint_listed(self):
+        # the preload hint is already listed as a part
+        self.assertEqual(self.reload(1, {2: 2}, (2, 1)),
+                         [(1, '1.ts'), (2, '2.0.ts'), (2, '2.1.ts')])
+
+    def test_hint_next_segment(self):
+        self.reload(1, {2: 2}, (2, 2))
+        # the hint was the first part of the next segment
+        self.assertEqual(self.reload(2, {2: 2, 3: 2}, (3, 2)),
+                         [(3, '3.1.ts'), (3, '3.2.ts')])
+
+    def test_parser(self):
+        playlist = hlssession.hls_playlist.load('\n'.join([
+            '#EXTM3U',
+            '#EXT-X-TARGETDURATION:1',
+            '#EXT-X-SERVER-CONTROL:CAN-BLOCK-RELOAD=YES,PART-HOLD-BACK=0.750',
+            '#EXT-X-PART-INF:PART-TARGET=0.250',
+            '#EXT-X-MEDIA-SEQUENCE:10',
+            '#EXT-X-PART:DURATION=0.250,URI="10.0.ts",INDEPENDENT=YES',
+            '#EXTINF:1.000,',
+            '10.ts',
+            '#EXT-X-PART:DURATION=0.250,URI="11.0.ts",INDEPENDENT=YES',
+            '#EXT-X-PART:DURATION=0.250,URI="11.1.ts"',
+            '#EXT-X-PRELOAD-HINT:TYPE=PART,URI="11.2.ts"',
+        ]), 'http://127.0.0.1/480p.m3u8', parser=hlssession.HLSSessionM3U8Parser)
+        self.assertEqual(playlist.part_target, 0.25)
+        self.assertEqual(playlist.server_control['CAN-BLOCK-RELOAD'], 'YES')
+        # the parts after the last segment belong to the next segment
+        self.assertEqual([part.uri for part in playlist.parts[1]],
+                         ['http://127.0.0.1/11.0.ts', 'http://127.0.0.1/11.1.ts'])
+        self.assertEqual(playlist.preload_hint.uri, 'http://127.0.0.1/11.2.ts')
+
+
+class TestHLSSessionReloadScheduler(unittest.TestCase):
+
+    def run_schedule(self, updates, target_duration=4, until=None):
+        '''Reloads a playlist with the update times of updates,
+        returns the scheduler, the reload times and the latencies'''
+        scheduler = hlssession.HLSSessionReloadScheduler()
+        until = until or updates[-1]
+        now = 0.01
+        seen = 0
+        reloads = []
+        latencies = []
+        while now < until:
+            count = len([u for u in updates if u <= now])
+            if count > seen:
+                latencies.append(now - updates[count - 1])
+            reloads.append(now)
+            now = scheduler.update(count > seen, target_duration,
+                                   added=max(count - seen, 1), now=now)
+            seen = count
+        return scheduler, reloads, latencies
+
+    def test_cadence(self):
+        scheduler, reloads, latencies = self.run_schedule(
+            [0.5 + n * 3.0 for n in range(100)], target_duration=6)
+        self.assertAlmostEqual(scheduler.cadence, 3.0, delta=0.3)
+        # about one reload per update instead of every target duration
+        self.assertLess(len(reloads), 150)
+        self.assertLess(sum(latencies[50:]) / 50, 1.0)
+
+    def test_latency(self):
+        scheduler, reloads, latencies = self.run_schedule(
+            [0.5 + n * 4.0 for n in range(100)])
+        stats = scheduler.stats()
+        # the estimate is not the margin of the scheduler
+        self.assertNotAlmostEqual(stats['latency'], scheduler.margin, delta=0.05)
+        self.assertAlmostEqual(stats['latency'], sum(latencies) / len(latencies), delta=0.3)
+
+    def test_phase_drift(self):
+        for shift in (-1.5, 1.5):
+            updates = [0.5 + n * 4.0 + (shift if n >= 50 else 0) for n in range(100)]
+            scheduler, reloads, latencies = self.run_schedule(updates)
+            # the reloads follow the new phase of the updates
+            self.assertLess(sum(latencies[-20:]) / 20, 1.0, shift)
+
+    def test_back_off(self):
+        scheduler, reloads, latencies = self.run_schedule(
+            [0.5 + n * 4.0 for n in range(20)], until=120)
+        intervals = [b - a for a, b in zip(reloads, reloads[1:])][-10:]
+        # the stalled playlist is reloaded with a growing interval,
+        # up to the target duration
+        self.assertEqual(intervals, sorted(intervals))
+        self.assertEqual(intervals[-1], 4)
+        self.assertLess(intervals[-10], 4)
+
+    def test_reloads_saved(self):
+        scheduler = hlssession.HLSSessionReloadScheduler()
+        scheduler.update(True, 6, now=100)
+        scheduler.update(True, 6, now=106)
+        # the default schedule reloads an unchanged playlist every 3 seconds
+        scheduler.update(False, 6, now=112)
+        scheduler.update(False, 6, now=118)
+        stats = scheduler.stats()
+        self.assertEqual(stats['reloads'], 4)
+        self.assertEqual(stats['reloads_unchanged'], 2)
+        # 1 + 6 / 6 + 6 / 6 + 6 / 3 reloads of the default schedule
+        self.assertEqual(stats['reloads_saved'], 1)
+
+
+class FakeContent(object):
+    def __init__(self, content):
+        self.content = content
+
+
+class TestHLSSessionPrefetch(unittest.TestCase):
+
+    def writer(self):
+        writer = hlssession.HLSSessionHLSStreamWriter.__new__(hlssession.HLSSessionHLSStreamWriter)
+        writer.bytes_lock = Condition()
+        writer.bytes_buffered = 0
+        writer.bytes_requested = 0
+        writer.bytes_in_flight_peak = 0
+        writer.queued_fetched = 0
+        writer.segment_size = 1000
+        writer.buffer_limited = False
+        writer.reader = type('FakeReader', (object,), {'metrics': None})()
+        return writer
+
+    def test_bytes_in_flight(self):
+        writer = self.writer()
+        requested = []
+
+        def fetch_segment(sequence, retries=None):
+            requested.append(writer.bytes_requested)
+            if sequence.num == 1:
+                # the next segment is requested while the first is downloaded
+                writer.fetch(Sequence(2, segment('2.ts')))
+            return FakeContent(b'x' * 1200)
+
+        writer.fetch_segment = fetch_segment
+        writer.fetch(Sequence(1, segment('1.ts')))
+        # a request counts before its download is complete
+        self.assertEqual(requested, [1000, 2000])
+        self.assertEqual(writer.bytes_requested, 0)
+        self.assertEqual(writer.bytes_buffered, 2400)
+        self.assertEqual(writer.bytes_in_flight_peak, 2400)
+
+    def test_failed_request(self):
+        writer = self.writer()
+        writer.fetch_segment = lambda sequence, retries=None: None
+        writer.fetch(Sequence(1, segment('1.ts')))
+        self.assertEqual(writer.bytes_requested, 0)
+        self.assertEqual(writer.bytes_buffered, 0)
+        self.assertEqual(writer.bytes_in_flight_peak, 1000)
+
+
+class TestHLSSessionRingBuffer(unittest.TestCase):
+
+    def test_large_write(self):
+        buffer = hlssession.HLSSessionRingBuffer(1000)
+        data = os.urandom(10000)
+        # the write waits until the reader drains the buffer
+        thread = Thread(target=buffer.write, args=(memoryview(data),))
+        thread.start()
+        read = []
+        while sum(len(chunk) for chunk in read) < len(data):
+            chunk = buffer.read(300, timeout=5)
+            self.assertLessEqual(buffer.length, 1000)
+            read.append(chunk)
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(b''.join(read), data)
+        self.assertEqual(buffer.length, 0)
+
+    def test_no_copy(self):
+        buffer = hlssession.HLSSessionRingBuffer(1000)
+        data = b'segment data' * 10
+        buffer.write(memoryview(data))
+        # the chunk is a view of the written bytes
+        self.assertIs(buffer.chunks[0].obj, data)
+        self.assertEqual(buffer.read(5), b'segme')
+        self.assertEqual(buffer.read(), data[5:])
+
+    def test_writable_data(self):
+        buffer = hlssession.HLSSessionRingBuffer(1000)
+        data = bytearray(b'chunk')
+        buffer.write(data)
+        # the writer can reuse its buffer
+        data[:] = b'xxxxx'
+        self.assertEqual(buffer.read(), b'chunk')
+
+
+class FakeSegmentBuffer(list):
+    def write(self, data):
+        self.append(data)
+
+
+class FakeBudgetReader(object):
+    metrics = None
+
+    def __init__(self):
+        self.buffer = FakeSegmentBuffer()
+        self.worker = type('FakeWorker', (object,), {'state': None})()
+
+
+class TestHLSSessionMemoryBudget(unittest.TestCase):
+
+    def setUp(self):
+        self.writers = []
+
+    def tearDown(self):
+        for writer in self.writers:
+            writer.closed = True
+            hlssession.HLSSessionMemoryBudget.unregister(writer)
+            writer.executor.shutdown()
+
+    def writer(self, budget, segment_size):
+        writer = hlssession.HLSSessionHLSStreamWriter.__new__(hlssession.HLSSessionHLSStreamWriter)
+        writer.closed = False
+        writer.retries = 1
+        writer.executor = futures.ThreadPoolExecutor(max_workers=1)
+        writer.futures = queue.Queue(100)
+        writer.reader = FakeBudgetReader()
+        writer.bytes_lock = Condition()
+        writer.bytes_buffered = 0
+        writer.bytes_requested = 0
+        writer.bytes_in_flight_peak = 0
+        writer.queued = 0
+        writer.queued_fetched = 0
+        writer.queued_duration = 0.0
+        writer.segment_size = 0
+        writer.media_time = 0
+        writer.buffer_size = None
+        writer.buffer_duration = None
+        writer.memory_budget = budget
+        writer.buffer_limited = True
+        writer.fetch_segment = lambda sequence, retries=None: FakeContent(b'x' * segment_size)
+        hlssession.HLSSessionMemoryBudget.register(writer)
+        self.writers.append(writer)
+        return writer
+
+    def put(self, writer, count):
+        '''Puts the segments in a worker thread'''
+        thread = Thread(target=lambda: [writer.put(Sequence(n, segment('{0}.ts'.format(n))))
+                                        for n in range(count)])
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def write(self, writer):
+        sequence, future = writer.futures.get(timeout=5)
+        writer.write(sequence, future.result(5))
+
+    def wait_queued(self, writer, queued):
+        for _ in range(100):
+            if writer.queued == queued and writer.queued_fetched == queued:
+                return
+            time.sleep(0.02)
+        self.fail('queued {0} != {1}'.format(writer.queued, queued))
+
+    def test_backpressure(self):
+        writer = self.writer(3000, 1000)
+        # two writers share the budget
+        other = self.writer(3000, 1000)
+        thread = self.put(writer, 4)
+        # the worker waits at the share of 1500 bytes
+        self.wait_queued(writer, 1)
+        time.sleep(0.2)
+        self.assertEqual(writer.queued, 1)
+        self.write(writer)
+        self.wait_queued(writer, 1)
+        # the full budget unblocks the worker, the three segments fit
+        hlssession.HLSSessionMemoryBudget.unregister(other)
+        self.wait_queued(writer, 3)
+        for _ in range(3):
+            self.write(writer)
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(len(writer.reader.buffer), 4)
+        self.assertEqual(writer.bytes_buffered, 0)
+
+    def test_large_segment(self):
+        # a segment larger than the budget is written alone
+        writer = self.writer(500, 1000)
+        thread = self.put(writer, 3)
+        for _ in range(3):
+            self.wait_queued(writer, 1)
+            self.write(writer)
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(len(writer.reader.buffer), 3)
+
+
+class TestHLSSessionPlugin(unittest.TestCase):
+
+    def test_streams(self):
+        session = Streamlink()
+        hlsbench.load_plugin(session, 'hlssession')
+        with HLSOrigin.scenario('live') as origin:
+            streams = session.streams('hlssession://{0}'.format(origin.url))
+            # the master playlist is not requested again
+            self.assertEqual(origin.stats['master'], 1)
+        self.assertEqual(sorted(streams), ['240p', '480p', 'best', 'worst'])
+        for stream in streams.values():
+            self.assertIsInstance(stream, hlssession.HLSSessionHLSStream)
+            self.assertEqual(stream.session_url, origin.url)
+        # the synonyms are the streams of the variants
+        self.assertIs(streams['best'], streams['480p'])
+        self.assertEqual(streams['worst'].session_stream_name, '240p')
+        self.assertTrue(streams['240p'].url.endswith('/240p.m3u8'))
+
+    def test_session_reload(self):
+        session = Streamlink()
+        hlsbench.load_plugin(session, 'hlssession')
+        with HLSOrigin.scenario('live') as origin:
+            stream = session.streams('hlssession://{0}'.format(origin.url))['worst']
+            fd = stream.open()
+            try:
+                fd.read(1)
+                worker = fd.worker
+                first_url = worker.stream.url
+                self.assertTrue(worker.reload_session('test'))
+            finally:
+                fd.close()
+        # the new session has the selected stream, not the best stream
+        self.assertEqual(worker.session_data.stream_name, '240p')
+        self.assertNotEqual(worker.stream.url, first_url)
+        self.assertTrue(worker.stream.url.endswith('/240p.m3u8'))
+
+    def test_session_data(self):
+        session = Streamlink()
+        plugin = hlsbench.load_plugin(session, 'hlssession')
+        fds = []
+        with HLSOrigin.scenario('live') as origin_a, HLSOrigin.scenario('live') as origin_b:
+            try:
+                plugin.options.set('time', 600)
+                stream_a = session.streams('hlssession://{0}'.format(origin_a.url))['worst']
+                plugin.options.set('time', 0)
+                plugin.options.set('ignore_number', 5)
+                stream_b = session.streams('hlssession://{0}'.format(origin_b.url))['best']
+                fds = [stream_a.open(), stream_b.open()]
+                for fd in fds:
+                    fd.read(1)
+                worker_a, worker_b = [fd.worker for fd in fds]
+                worker_a.session_data.timestamp = 0
+                self.assertTrue(worker_b.reload_session('test'))
+            finally:
+                plugin.options.set('time', 0)
+                plugin.options.set('ignore_number', 0)
+                for fd in fds:
+                    fd.close()
+        data_a, data_b = worker_a.session_data, worker_b.session_data
+        self.assertIsNot(data_a, data_b)
+        self.assertEqual((data_a.url, data_a.stream_name), (origin_a.url, '240p'))
+        self.assertEqual((data_b.url, data_b.stream_name), (origin_b.url, '480p'))
+        self.assertEqual(data_a.session_reload_time, 600)
+        self.assertEqual(data_a.sequence_ignore_number, 0)
+        self.assertEqual(data_b.session_reload_time, 0)
+        self.assertEqual(data_b.sequence_ignore_number, 5)
+        # the reload of a stream does not renew the timestamp of the other stream
+        self.assertEqual(data_a.timestamp, 0)
+        self.assertAlmostEqual(data_b.timestamp, time.time(), delta=5)
+        self.assertTrue(worker_a.stream.url.startswith(origin_a.url.rsplit('/', 1)[0]))
+        self.assertTrue(worker_b.stream.url.startswith(origin_b.url.rsplit('/', 1)[0]))
+
+
+class TestHLSSessionRestream(unittest.TestCase):
+
+    def restream(self, origin, name='best'):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        session = Streamlink()
+        plugin = hlsbench.load_plugin(session, 'hlssession')
+        plugin.options.set('restream-port', port)
+        stream = session.streams('hlssession://{0}'.format(origin.url))[name]
+        key = urlparse(stream.url).path.split('/')[1]
+        return stream, hlssession.HLSSessionRestreamChannel.get(key)
+
+    def test_clients(self):
+        with HLSOrigin.scenario('live') as origin:
+            stream, channel = self.restream(origin)
+            checks = [hlsbench.StreamCheck(hlsbench.status(origin.url)) for _ in range(2)]
+            results = [{}, {}]
+            threads = [Thread(target=hlsbench.read_stream, args=(stream, check, 5, result))
+                       for check, result in zip(checks, results)]
+            try:
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join(30)
+            finally:
+                if channel.reader:
+                    channel.reader.close()
+            stats = dict(origin.stats)
+        for check, result in zip(checks, results):
+            self.assertNotIn('error', result)
+            self.assertGreater(check.chunks, 0)
+            self.assertEqual(check.gaps, 0)
+            self.assertEqual(check.duplicates, 0)
+        # one upstream for both clients, every segment is downloaded once
+        self.assertEqual(stats['master'], 1)
+        self.assertEqual(stats['sessions'], 1)
+        self.assertLess(stats['segment'], checks[0].chunks + checks[1].chunks)
+
+    def test_trim(self):
+        channel = hlssession.HLSSessionRestreamChannel(None)
+        # a running upstream
+        channel.reader = object()
+        channel.max_bytes = 20
+        for _ in range(10):
+            channel.add(1.0, b'data')
+        # the window is kept, even above max_bytes
+        self.assertEqual(len(channel.segments), channel.window)
+        self.assertEqual(channel.segments_bytes, 4 * channel.window)
+        self.assertIsNone(channel.segment(3))
+        self.assertEqual(channel.segment(4), b'data')
+        playlist = channel.playlist()
+        self.assertIn('#EXT-X-MEDIA-SEQUENCE:4\n', playlist)
+        self.assertNotIn('#EXT-X-ENDLIST', playlist)
+        self.assertEqual(playlist.count('#EXTINF'), channel.window)
+
+    def test_idle_close(self):
+        with HLSOrigin.scenario('live') as origin:
+            stream, channel = self.restream(origin)
+            channel.idle_timeout = 1.0
+            playlist_url = stream.url
+            try:
+                self.assertIn('#EXTINF', urlopen(playlist_url).read().decode('utf-8'))
+                # the upstream is closed without requests
+                deadline = time.time() + 10
+                while channel.reader is not None and time.time() < deadline:
+                    time.sleep(0.1)
+                self.assertIsNone(channel.reader)
+                self.assertFalse(channel.ended)
+                # a new request starts a new upstream
+                playlist = ''
+                while '#EXT-X-DISCONTINUITY\n' not in playlist and time.time() < deadline + 10:
+                    playlist = urlopen(playlist_url).read().decode('utf-8')
+                    time.sleep(0.2)
+            finally:
+                if channel.reader:
+                    channel.reader.close()
+        self.assertIn('#EXT-X-DISCONTINUITY\n', playlist)
+        self.assertIn('#EXT-X-DISCONTINUITY-SEQUENCE:0\n', playlist)
+
+
+class TestHLSSessionHedge(unittest.TestCase):
+
+    def hedge(self, threads=1):
+        hedge = hlssession.HLSSessionHedge(90, threads=threads, hosts=['backup'])
+        hedge.budget = 1
+        hedge.latencies.extend([0.01] * hedge.min_samples)
+        hedge.requests = hedge.min_samples
+        return hedge
+
+    def test_inline(self):
+        hedge = hlssession.HLSSessionHedge(90)
+        threads = []
+
+        def get(url):
+            threads.append(current_thread())
+            return url
+
+        try:
+            # without enough download times the request runs in the fetch thread
+            self.assertEqual(hedge.get(get, 'http://primary/0.ts'), 'http://primary/0.ts')
+        finally:
+            hedge.close()
+        self.assertEqual(threads, [current_thread()])
+
+    def test_stuck_primaries(self):
+        hedge = self.hedge(threads=2)
+        stuck = Event()
+        threads = []
+
+        def get(url):
+            threads.append(current_thread())
+            if 'primary' in url:
+                stuck.wait(30)
+            return url
+
+        try:
+            start_time = time.time()
+            # a primary and a hedged request, the stuck primaries keep their threads
+            for n in range(5):
+                self.assertEqual(hedge.get(get, 'http://primary/{0}.ts'.format(n)),
+                                 'http://backup/{0}.ts'.format(n))
+            self.assertLess(time.time() - start_time, 5)
+            self.assertEqual(hedge.hedge_wins, 5)
+            # the pool is full, the next request runs in the fetch thread
+            self.assertEqual(hedge.get(get, 'http://other/5.ts'), 'http://other/5.ts')
+            self.assertIs(threads[-1], current_thread())
+            self.assertEqual(len(set(threads)), 7)
+        finally:
+            stuck.set()
+            hedge.close()
+
+
+@unittest.skipIf(h2bench is None or hlssession.httpx is None,
+                 'HTTP/2 requires the h2 and httpx packages')
+class TestHLSSessionHTTP2(unittest.TestCase):
+
+    def test_connections(self):
+        directory = tempfile.mkdtemp()
+        try:
+            try:
+                certfile, keyfile = h2bench.create_certificate(directory)
+            except (OSError, subprocess.CalledProcessError):
+                self.skipTest('openssl is not available')
+            with HLSOrigin.scenario('live') as origin:
+                proxy = h2bench.H2BenchProxy(origin.url, certfile, keyfile).start()
+                try:
+                    result = h2bench.run(proxy, origin.url, True, streams=2, duration=3)
+                finally:
+                    proxy.stop()
+        finally:
+            shutil.rmtree(directory)
+        # the streams share one connection
+        self.assertEqual(result['connections']['h2'], 1)
+        self.assertGreater(result['requests']['h2'], 2)
+        self.assertEqual(result['total']['gaps'], 0)
+
+
+class TestHLSSessionMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = [hlssession.HLSSessionMetrics('http://127.0.0.1/{0}.m3u8'.format(i), 'best')
+                        for i in range(2)]
+        for metrics in self.metrics:
+            metrics.segment(1000, 0.2)
+            metrics.session_reload('time')
+            hlssession.HLSSessionMetrics.register(metrics)
+
+    def tearDown(self):
+        for metrics in self.metrics:
+            hlssession.HLSSessionMetrics.unregister(metrics)
+
+    def test_prometheus(self):
+        families = []
+        types = {}
+        for line in hlssession.HLSSessionMetrics.prometheus().splitlines():
+            if line.startswith('# TYPE'):
+                name, metric_type = line.split()[2:]
+                self.assertNotIn(name, types)
+                types[name] = metric_type
+                continue
+            if line.startswith('#'):
+                self.assertTrue(line.startswith('# HELP '), line)
+                continue
+            name = re.match(r'^(\w+)\{', line).group(1)
+            if types.get(name) is None:
+                # the sample of a histogram
+                name = re.sub(r'_(bucket|sum|count)$', '', name)
+            self.assertIn(name, types, line)
+            if not families or families[-1] != name:
+                families.append(name)
+        # the samples of a family are not interleaved with other families
+        self.assertEqual(len(families), len(set(families)))
+        self.assertEqual(types['hlssession_segments_total'], 'counter')
+        self.assertEqual(types['hlssession_segment_latency'], 'histogram')
+
+    def test_file(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, 'metrics.json')
+            metrics_file = hlssession.HLSSessionMetricsFile(filename)
+            metrics_file.write()
+            metrics_file.write()
+            self.assertEqual(os.listdir(directory), ['metrics.json'])
+            with open(filename) as fd:
+                data = json.load(fd)
+            self.assertEqual(len(data['streams']), 2)
+        finally:
+            shutil.rmtree(directory)
+
+
+class TestHLSSessionVariants(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_file_buffer(self):
+        filename = os.path.join(self.directory, 'variant.ts')
+        buffer = hlssession.HLSSessionFileBuffer(filename)
+        buffer.write(b'data')
+        buffer.close()
+        # an existing recording is not appended
+        self.assertRaises(OSError, hlssession.HLSSessionFileBuffer, filename)
+        with open(filename, 'rb') as fd:
+            self.assertEqual(fd.read(), b'data')
+
+    def test_variants(self):
+        output = os.path.join(self.directory, '{name}.ts')
+        with HLSOrigin.scenario('live') as origin:
+            result = hlsbench.run(origin.url, duration=3, options={
+                'variants': 'all', 'variants-output': output})
+        self.assertEqual(result['streams'][0]['variants'], ['480p'])
+        self.assertEqual(os.listdir(self.directory), ['240p.ts'])
+        check = hlsbench.StreamCheck({'start_time': origin.start_time,
+                                      'segment_duration': origin.segment_duration,
+                                      'parts': origin.parts})
+        with open(output.format(name='240p'), 'rb') as fd:
+            check.feed(fd.read())
+        self.assertGreater(check.chunks, 0)
+        self.assertEqual(check.gaps, 0)
+        self.assertEqual(check.variants, set(['240p']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,241 @@
+import json
+import time
+import unittest
+
+from websocket import WebSocketTimeoutException
+
+from tests import load_plugin
+
+myfreecams = load_plugin('myfreecams')
+
+
+def frame(FCTYPE, nArg1, data=''):
+    message = '{0} 0 0 {1} 0 {2}'.format(FCTYPE, nArg1, data)
+    return '{0:04d}{1}'.format(len(message), message)
+
+
+class FakeWebSocket(object):
+    '''Replies to the lookups of known models, without data it times out'''
+
+    def __init__(self, models, dropped=()):
+        self.models = models
+        self.dropped = dropped
+        self.frames = [frame(1, 0, 'guest')]
+        self.timeout = None
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def send(self, data):
+        fields = data.split()
+        if fields[0] == '10' and fields[5] not in self.dropped:
+            model = self.models.get(fields[5])
+            self.frames.append(frame(10, fields[3], json.dumps(model) if model else ''))
+
+    def recv(self):
+        if not self.frames:
+            raise WebSocketTimeoutException('Connection timed out')
+        return self.frames.pop(0)
+
+
+class TestMyFreeCamsParser(unittest.TestCase):
+
+    def parse(self, frames):
+        parser = myfreecams.MyFreeCamsParser()
+        messages = []
+        for data in frames:
+            parser.feed(data)
+            messages.extend(parser.messages())
+        return parser, messages
+
+    def test_split_frames(self):
+        data = frame(20, 1, 'm%C3%A4') + frame(10, 20) + frame(50, 2, 'chat %E2%82%AC')
+        expected = [(20, 1, '20 0 0 1 0 m\u00e4'), (10, 20, '10 0 0 20 0 '),
+                    (50, 2, '50 0 0 2 0 chat \u20ac')]
+        # every split point, also within the length and the escaped characters
+        for i in range(len(data) + 1):
+            parser, messages = self.parse([data[:i], data[i:]])
+            self.assertEqual(messages, expected, i)
+            self.assertEqual(len(parser.buffer), 0)
+
+    def test_split_utf8(self):
+        data = '{0:04d}{1}'.format(len('50 0 0 2 0 \u20ac'.encode('utf-8')),
+                                   '50 0 0 2 0 \u20ac').encode('utf-8')
+        for i in range(len(data) + 1):
+            self.assertEqual(self.parse([data[:i], data[i:]])[1],
+                             [(50, 2, '50 0 0 2 0 \u20ac')], i)
+
+    def test_bytes(self):
+        data = ''.join(frame(20, n) for n in range(100))
+        parser, messages = self.parse([data[i:i + 1] for i in range(len(data))])
+        self.assertEqual([nArg1 for FCTYPE, nArg1, message in messages], list(range(100)))
+
+    def test_invalid(self):
+        # an invalid message is skipped, an invalid length drops the buffer
+        parser, messages = self.parse([frame(20, 1) + '0003abc' + frame(20, 2),
+                                       'xxxx' + frame(20, 3), frame(20, 4)])
+        self.assertEqual([nArg1 for FCTYPE, nArg1, message in messages], [1, 2, 4])
+
+    def test_compact(self):
+        parser = myfreecams.MyFreeCamsParser()
+        parser.compact_size = 64
+        data = ''.join(frame(20, n) for n in range(10))
+        parser.feed(data + data[:10])
+        self.assertEqual(len(list(parser.messages())), 10)
+        # the read messages are removed, the incomplete message is kept
+        self.assertEqual(parser.offset, 0)
+        self.assertEqual(bytes(parser.buffer), data[:10].encode('ascii'))
+
+
+class TestMyFreeCamsChat(unittest.TestCase):
+
+    models = {
+        'm1': {'nm': 'm1', 'sid': 1, 'uid': 1001, 'vs': 0},
+        'm2': {'nm': 'm2', 'sid': 2, 'uid': 1002, 'vs': 0},
+    }
+
+    def chat(self, ws):
+        chat = myfreecams.MyFreeCamsChat(['x'])
+        chat.ws = ws
+        return chat
+
+    def test_lookup(self):
+        ws = FakeWebSocket(self.models)
+        results = self.chat(ws).lookup(['m1', 'm2', 'm3'])
+        self.assertEqual(sorted(results), ['m1', 'm2', 'm3'])
+        self.assertIn('"uid": 1002', results['m2'])
+        self.assertIsNone(ws.timeout)
+
+    def test_lookup_dropped(self):
+        # the lookup returns without the reply of m2
+        ws = FakeWebSocket(self.models, dropped=('m2',))
+        results = self.chat(ws).lookup(['m1', 'm2', 'm3'])
+        self.assertEqual(sorted(results), ['m1', 'm3'])
+
+    def test_lookup_expired(self):
+        ws = FakeWebSocket(self.models, dropped=('m2',))
+        chat = self.chat(ws)
+        chat.timeout = -1
+        # other messages do not keep a lookup without a reply
+        ws.frames.extend(frame(50, 0, 'chat') for _ in range(3))
+        results = chat.lookup(['m2'])
+        self.assertEqual(results, {})
+        self.assertEqual(len(ws.frames), 2)
+
+
+SERVERCONFIG = {
+    'chat_servers': ['xchat1'],
+    'h5video_servers': {'1001': 'video1001', '1002': ''},
+    'wzobs_servers': {'1001': 'wzobs1001', '1002': 'wzobs1002'},
+    'ngvideo_servers': {'1003': 'ngvideo1003'},
+}
+
+
+class FakeServerResponse(object):
+    def __init__(self, status_code=200, data=None, headers=None):
+        self.status_code = status_code
+        self.text = json.dumps(data) if data is not None else ''
+        self.headers = headers or {}
+
+
+class FakeServerHTTP(object):
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def get(self, url, headers=None):
+        self.requests.append(headers)
+        res = self.responses.pop(0)
+        if isinstance(res, Exception):
+            raise res
+        return res
+
+
+class FakeCache(dict):
+    def set(self, key, value, expires=None):
+        self[key] = value
+
+
+class FakeServerPlugin(object):
+    JS_SERVER_URL = 'https://www.myfreecams.com/_js/serverconfig.js'
+
+    def __init__(self, responses, cache=None):
+        self.cache = FakeCache(cache or {})
+        self.session = type('FakeSession', (object,), {})()
+        self.session.http = FakeServerHTTP(responses)
+
+
+class TestMyFreeCamsServers(unittest.TestCase):
+
+    def setUp(self):
+        myfreecams.MyFreeCamsServers._config = None
+
+    def tearDown(self):
+        myfreecams.MyFreeCamsServers._config = None
+
+    def cached(self, age):
+        return {'serverconfig': {'servers': SERVERCONFIG, 'etag': '"v1"',
+                                 'last_modified': 'Mon, 19 Oct 2026 10:00:00 GMT',
+                                 'timestamp': time.time() - age}}
+
+    def test_request(self):
+        plugin = FakeServerPlugin([FakeServerResponse(200, SERVERCONFIG, {'ETag': '"v1"'})])
+        config = myfreecams.MyFreeCamsServers.get(plugin)
+        self.assertEqual(config.chat_servers, ['xchat1'])
+        self.assertEqual(plugin.session.http.requests, [{}])
+        self.assertEqual(plugin.cache['serverconfig']['etag'], '"v1"')
+        # the config is used until the ttl without a request
+        self.assertIs(myfreecams.MyFreeCamsServers.get(plugin), config)
+        self.assertEqual(len(plugin.session.http.requests), 1)
+
+    def test_fresh_cache(self):
+        plugin = FakeServerPlugin([], cache=self.cached(60))
+        config = myfreecams.MyFreeCamsServers.get(plugin)
+        self.assertEqual(config.etag, '"v1"')
+        self.assertEqual(plugin.session.http.requests, [])
+
+    def test_revalidate(self):
+        plugin = FakeServerPlugin([FakeServerResponse(304)],
+                                  cache=self.cached(2 * 60 * 60))
+        config = myfreecams.MyFreeCamsServers.get(plugin)
+        self.assertEqual(plugin.session.http.requests, [{
+            'If-None-Match': '"v1"',
+            'If-Modified-Since': 'Mon, 19 Oct 2026 10:00:00 GMT',
+        }])
+        # not modified, only the timestamp is renewed
+        self.assertEqual(config.servers, SERVERCONFIG)
+        self.assertEqual(config.etag, '"v1"')
+        self.assertAlmostEqual(config.timestamp, time.time(), delta=5)
+        self.assertEqual(plugin.cache['serverconfig']['timestamp'], config.timestamp)
+
+    def test_modified(self):
+        servers = dict(SERVERCONFIG, chat_servers=['xchat2'])
+        plugin = FakeServerPlugin([FakeServerResponse(200, servers, {'ETag': '"v2"'})],
+                                  cache=self.cached(2 * 60 * 60))
+        config = myfreecams.MyFreeCamsServers.get(plugin)
+        self.assertEqual(config.chat_servers, ['xchat2'])
+        self.assertEqual(config.etag, '"v2"')
+        self.assertIsNone(config.last_modified)
+
+    def test_failed_request(self):
+        plugin = FakeServerPlugin([myfreecams.PluginError('Unable to open URL')],
+                                  cache=self.cached(2 * 60 * 60))
+        # the expired config is used
+        config = myfreecams.MyFreeCamsServers.get(plugin)
+        self.assertEqual(config.chat_servers, ['xchat1'])
+        # without a cached config the error is raised
+        myfreecams.MyFreeCamsServers._config = None
+        plugin = FakeServerPlugin([myfreecams.PluginError('Unable to open URL')])
+        self.assertRaises(myfreecams.PluginError, myfreecams.MyFreeCamsServers.get, plugin)
+
+    def test_camserver(self):
+        config = myfreecams.MyFreeCamsServers(SERVERCONFIG)
+        # h5video before wzobs before ngvideo, empty hosts are skipped
+        self.assertEqual(config.camserver(1001), ('video1001', 'h5video_servers'))
+        self.assertEqual(config.camserver(1002), ('wzobs1002', 'wzobs_servers'))
+        self.assertEqual(config.camserver('1003'), ('ngvideo1003', 'ngvideo_servers'))
+        self.assertEqual(config.camserver(1004), (None, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
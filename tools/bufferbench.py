@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''Throughput of the output buffer for unencrypted segments
+
+    python tools/bufferbench.py --segment-size 2000000 --segments 200
+
+The segments are written by one thread and read by another thread with
+--read-size bytes, like the output of Streamlink:
+
+    chunks       RingBuffer, the stock HLSStreamWriter writes chunks of 8192
+                 bytes, every chunk is a copy of the response content
+    memoryview   RingBuffer, one write of a memoryview of the content,
+                 RingBuffer copies the slices with bytes()
+    hlssession   HLSSessionRingBuffer, the memoryview slices are stored
+                 and only copied by the read
+'''
+from __future__ import print_function
+
+import argparse
+import imp
+import os
+import threading
+import time
+
+from streamlink.buffers import RingBuffer
+
+PLUGINS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'plugins')
+
+timer = getattr(time, 'perf_counter', time.time)
+
+
+def load_plugin(name):
+    file, pathname, desc = imp.find_module(name, [PLUGINS])
+    try:
+        return imp.load_module('streamlink.plugin.{0}'.format(name), file, pathname, desc)
+    finally:
+        file.close()
+
+
+def write_chunks(buffer, content, chunk_size=8192):
+    for i in range(0, len(content), chunk_size):
+        buffer.write(content[i:i + chunk_size])
+
+
+def write_memoryview(buffer, content):
+    buffer.write(memoryview(content))
+
+
+def run(buffer, write, content, segments, read_size):
+    '''Returns MB/s of the written and read segments'''
+    total = len(content) * segments
+    result = {}
+
+    def read():
+        size = 0
+        while size < total:
+            size += len(buffer.read(read_size, timeout=10))
+        result['size'] = size
+
+    thread = threading.Thread(target=read)
+    start = timer()
+    thread.start()
+    for _ in range(segments):
+        write(buffer, content)
+    thread.join()
+    elapsed = timer() - start
+    if result.get('size') != total:
+        raise SystemExit('read {0} of {1} bytes'.format(result.get('size'), total))
+    return total / elapsed / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='hlssession output buffer throughput')
+    parser.add_argument('--segment-size', type=int, default=2 * 1000 * 1000)
+    parser.add_argument('--segments', type=int, default=200)
+    parser.add_argument('--read-size', type=int, default=8192)
+    parser.add_argument('--ringbuffer-size', type=int, default=16 * 1024 * 1024)
+    args = parser.parse_args()
+
+    hlssession = load_plugin('hlssession')
+    content = os.urandom(args.segment_size)
+    paths = [
+        ('chunks', RingBuffer, write_chunks),
+        ('memoryview', RingBuffer, write_memoryview),
+        ('hlssession', hlssession.HLSSessionRingBuffer, write_memoryview),
+    ]
+    print('{0} segments of {1:.1f} MB, reads of {2} bytes'.format(
+        args.segments, args.segment_size / 1e6, args.read_size))
+    for name, buffer_class, write in paths:
+        rate = run(buffer_class(args.ringbuffer_size), write, content,
+                   args.segments, args.read_size)
+        print('{0:<12} {1:>8.1f} MB/s'.format(name, rate))
+
+
+if __name__ == '__main__':
+    main()
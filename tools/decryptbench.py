@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''Decryption throughput of hlskeyuri streams with --hlskeyuri-decrypt-threads
+
+    python tools/decryptbench.py --streams 4 --threads 0 --threads 2
+
+Every stream has a fetch thread, which passes the encrypted chunks of
+its segments to write_decrypted(), and a writer thread. The streams are
+run without a pool (threads 0, the fetch threads decrypt) and with a
+shared pool of THREADS threads:
+
+    MB/s      decrypted bytes of all streams per second
+    fetch     seconds of a fetch thread per segment, without the pool
+              it includes the decryption
+
+The AES functions release the GIL, more threads than CPU cores do not
+increase the throughput.
+'''
+from __future__ import print_function
+
+import argparse
+import imp
+import multiprocessing
+import os
+import threading
+import time
+
+from concurrent import futures
+
+from Crypto.Cipher import AES
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+PLUGINS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'plugins')
+
+KEY = b'0123456789abcdef'
+IV = b'\x00' * 16
+
+timer = getattr(time, 'perf_counter', time.time)
+
+
+def load_plugin(name):
+    file, pathname, desc = imp.find_module(name, [PLUGINS])
+    try:
+        return imp.load_module('streamlink.plugin.{0}'.format(name), file, pathname, desc)
+    finally:
+        file.close()
+
+
+class NullBuffer(object):
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+
+
+class NullReader(object):
+    def __init__(self):
+        self.buffer = NullBuffer()
+
+
+class Sequence(object):
+    def __init__(self, num):
+        self.num = num
+
+
+def create_writer(hlskeyuri, pool):
+    '''A writer without a stream, only write_decrypted() and write() are used'''
+    writer = hlskeyuri.KeyUriHLSStreamWriter.__new__(hlskeyuri.KeyUriHLSStreamWriter)
+    writer.closed = False
+    writer.decrypt_pool = pool
+    writer.reader = NullReader()
+    return writer
+
+
+def stream(hlskeyuri, writer, segment, segments, fetch_times):
+    '''Fetch thread of a stream, the writer thread writes the segments'''
+    segment_queue = queue.Queue(2)
+
+    def write():
+        while True:
+            item = segment_queue.get()
+            if item is None:
+                return
+            writer.write(*item)
+
+    thread = threading.Thread(target=write)
+    thread.start()
+    chunk_size = writer.chunk_size
+    for num in range(segments):
+        start = timer()
+        key_segment = hlskeyuri.KeyUriSegment(writer, writer.segment_queue_size)
+        segment_queue.put((Sequence(num), key_segment))
+        if writer.decrypt_pool:
+            decryptor = hlskeyuri.KeyUriPoolDecryptor(writer.decrypt_pool, KEY, IV)
+        else:
+            decryptor = AES.new(KEY, AES.MODE_CBC, IV)
+        chunks = (segment[i:i + chunk_size] for i in range(0, len(segment), chunk_size))
+        writer.write_decrypted(decryptor, chunks, key_segment.write)
+        key_segment.close(True)
+        fetch_times.append(timer() - start)
+    segment_queue.put(None)
+    thread.join()
+
+
+def run(hlskeyuri, threads, streams, segment, segments):
+    '''Returns MB/s of all streams and the mean fetch time of a segment'''
+    pool = futures.ThreadPoolExecutor(max_workers=threads) if threads else None
+    writers = [create_writer(hlskeyuri, pool) for _ in range(streams)]
+    fetch_times = []
+    threads = [threading.Thread(target=stream,
+                                args=(hlskeyuri, writer, segment, segments, fetch_times))
+               for writer in writers]
+    start = timer()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = timer() - start
+    if pool:
+        pool.shutdown()
+    size = sum(writer.reader.buffer.size for writer in writers)
+    return size / elapsed / 1e6, sum(fetch_times) / len(fetch_times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='hlskeyuri decryption throughput')
+    parser.add_argument('--streams', type=int, default=4)
+    parser.add_argument('--segment-size', type=int, default=2 * 1000 * 1000)
+    parser.add_argument('--segments', type=int, default=20,
+                        help='segments of every stream')
+    parser.add_argument('--threads', type=int, action='append',
+                        help='threads of the decrypt pool, 0 without a pool')
+    args = parser.parse_args()
+
+    hlskeyuri = load_plugin('hlskeyuri')
+    data = os.urandom(args.segment_size)
+    padding = 16 - len(data) % 16
+    segment = AES.new(KEY, AES.MODE_CBC, IV).encrypt(data + bytes(bytearray([padding] * padding)))
+
+    print('{0} streams, {1} segments of {2:.1f} MB, {3} CPU cores'.format(
+        args.streams, args.segments, args.segment_size / 1e6, multiprocessing.cpu_count()))
+    print('{0:<8} {1:>8} {2:>9}'.format('threads', 'MB/s', 'fetch'))
+    for threads in args.threads or (0, 1, 2, 4):
+        rate, fetch_time = run(hlskeyuri, threads, args.streams, segment, args.segments)
+        print('{0:<8} {1:>8.1f} {2:>8.3f}s'.format(threads or '-', rate, fetch_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''Connections of hlssession with and without HTTP/2
+
+    python tools/h2bench.py --streams 4 --duration 10 --option prefetch=3
+
+A TLS proxy in front of tools/hlsorigin.py answers HTTP/2 and HTTP/1.1
+and counts the connections and requests of every protocol. The streams
+are read once without and once with the http2 option.
+
+Requires the h2 package, the hlssession streams also need httpx[http2].
+Without --certfile a self-signed certificate is created with openssl.
+'''
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+
+import h2.config
+import h2.connection
+import h2.events
+import h2.exceptions
+
+try:
+    from http.server import BaseHTTPRequestHandler
+    from urllib.error import HTTPError
+    from urllib.request import urlopen
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler
+    from urllib2 import HTTPError, urlopen
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools import hlsbench  # noqa: E402
+from tools.hlsorigin import HLSOrigin, SCENARIOS  # noqa: E402
+
+
+def create_certificate(directory):
+    '''self-signed certificate for 127.0.0.1'''
+    certfile = os.path.join(directory, 'cert.pem')
+    keyfile = os.path.join(directory, 'key.pem')
+    with open(os.devnull, 'wb') as devnull:
+        subprocess.check_call(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes',
+                               '-subj', '/CN=127.0.0.1', '-days', '1',
+                               '-keyout', keyfile, '-out', certfile],
+                              stdout=devnull, stderr=devnull)
+    return certfile, keyfile
+
+
+class H2BenchHandler(BaseHTTPRequestHandler):
+    '''HTTP/1.1 requests of a connection'''
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.server.count('http/1.1')
+        status, content_type, body = self.server.fetch(self.path)
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class H2BenchProxy(object):
+    '''TLS proxy for an origin with HTTP/2 and HTTP/1.1 (ALPN)'''
+
+    def __init__(self, origin_url, certfile, keyfile, port=0):
+        self.base = origin_url.split('/master.m3u8')[0]
+        self.context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+        self.context.load_cert_chain(certfile, keyfile)
+        self.context.set_alpn_protocols(['h2', 'http/1.1'])
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(('127.0.0.1', port))
+        self.port = self.socket.getsockname()[1]
+        self.lock = threading.Lock()
+        self.connections = {}
+        self.requests = {}
+
+    @property
+    def url(self):
+        return 'https://127.0.0.1:{0}/master.m3u8'.format(self.port)
+
+    def start(self):
+        self.socket.listen(128)
+        thread = threading.Thread(target=self.serve, name='Thread-H2BenchProxy')
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.socket.close()
+
+    def reset(self):
+        with self.lock:
+            self.connections = {}
+            self.requests = {}
+
+    def count(self, protocol, connection=False):
+        counter = self.connections if connection else self.requests
+        with self.lock:
+            counter[protocol] = counter.get(protocol, 0) + 1
+
+    def fetch(self, path):
+        try:
+            res = urlopen(self.base + path)
+        except HTTPError as err:
+            return err.code, 'text/plain', b''
+        return res.getcode(), res.info().get('Content-Type'), res.read()
+
+    def serve(self):
+        while True:
+            try:
+                sock, address = self.socket.accept()
+            except (OSError, socket.error):
+                # closed by stop()
+                return
+            thread = threading.Thread(target=self.handle, args=(sock, address))
+            thread.daemon = True
+            thread.start()
+
+    def handle(self, sock, address):
+        try:
+            sock = self.context.wrap_socket(sock, server_side=True)
+        except (ssl.SSLError, socket.error):
+            sock.close()
+            return
+        protocol = sock.selected_alpn_protocol() or 'http/1.1'
+        self.count(protocol, connection=True)
+        try:
+            if protocol == 'h2':
+                self.handle_h2(sock)
+            else:
+                H2BenchHandler(sock, address, self)
+        except (socket.error, ssl.SSLError):
+            pass
+        finally:
+            sock.close()
+
+    def handle_h2(self, sock):
+        conn = h2.connection.H2Connection(
+            config=h2.config.H2Configuration(client_side=False))
+        # guards conn, the responses are sent by their own threads
+        window = threading.Condition()
+        closed = []
+
+        def send():
+            data = conn.data_to_send()
+            if data:
+                sock.sendall(data)
+
+        def respond(stream_id, path):
+            status, content_type, body = self.fetch(path)
+            try:
+                with window:
+                    conn.send_headers(stream_id, [(':status', str(status)),
+                                                  ('content-type', content_type),
+                                                  ('content-length', str(len(body)))],
+                                      end_stream=not body)
+                    send()
+                    while body and not closed:
+                        size = min(conn.local_flow_control_window(stream_id),
+                                   conn.max_outbound_frame_size, len(body))
+                        if size <= 0:
+                            window.wait(1)
+                            continue
+                        conn.send_data(stream_id, body[:size], end_stream=size == len(body))
+                        body = body[size:]
+                        send()
+            except (h2.exceptions.ProtocolError, socket.error, ssl.SSLError):
+                # the stream was reset or the connection was closed
+                pass
+
+        with window:
+            conn.initiate_connection()
+            send()
+        try:
+            while True:
+                data = sock.recv(65535)
+                if not data:
+                    break
+                with window:
+                    events = conn.receive_data(data)
+                    for event in events:
+                        if isinstance(event, h2.events.RequestReceived):
+                            self.count('h2')
+                            path = dict((k.decode('utf-8') if isinstance(k, bytes) else k, v)
+                                        for k, v in event.headers)[':path']
+                            if isinstance(path, bytes):
+                                path = path.decode('utf-8')
+                            thread = threading.Thread(target=respond,
+                                                      args=(event.stream_id, path))
+                            thread.daemon = True
+                            thread.start()
+                        elif isinstance(event, h2.events.ConnectionTerminated):
+                            closed.append(True)
+                    window.notify_all()
+                    send()
+        finally:
+            with window:
+                closed.append(True)
+                window.notify_all()
+
+
+def run(proxy, origin_url, http2, streams=1, duration=5.0, options=None):
+    '''Returns the connections and requests of every protocol
+    and the totals of tools/hlsbench.py'''
+    options = dict(options or {}, http2=http2)
+    proxy.reset()
+    # requests uses the CA bundle of the environment even with http-ssl-verify=False
+    environ = dict((name, os.environ.pop(name)) for name in
+                   ('REQUESTS_CA_BUNDLE', 'CURL_CA_BUNDLE') if name in os.environ)
+    try:
+        result = hlsbench.run(proxy.url, streams=streams, duration=duration,
+                              options=options, status_url=origin_url,
+                              session_options={'http-ssl-verify': False})
+    finally:
+        os.environ.update(environ)
+    return {
+        'connections': dict(proxy.connections),
+        'requests': dict(proxy.requests),
+        'total': result['total'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='hlssession HTTP/2 connections')
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), default='live')
+    parser.add_argument('--streams', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--option', action='append', default=[], metavar='KEY=VALUE',
+                        help='plugin option without the plugin prefix')
+    parser.add_argument('--certfile')
+    parser.add_argument('--keyfile')
+    args = parser.parse_args()
+
+    directory = None
+    certfile, keyfile = args.certfile, args.keyfile
+    if not certfile:
+        directory = tempfile.mkdtemp()
+        certfile, keyfile = create_certificate(directory)
+    options = dict((k, hlsbench.parse_value(v)) for k, v in
+                   (o.split('=', 1) for o in args.option))
+    try:
+        with HLSOrigin.scenario(args.scenario) as origin:
+            proxy = H2BenchProxy(origin.url, certfile, keyfile or certfile).start()
+            try:
+                results = [(http2, run(proxy, origin.url, http2, streams=args.streams,
+                                       duration=args.duration, options=options))
+                           for http2 in (False, True)]
+            finally:
+                proxy.stop()
+    finally:
+        if directory:
+            shutil.rmtree(directory)
+
+    print('{0:<8} {1:<24} {2:>9} {3:>6} {4:>7}'.format(
+        'http2', 'connections', 'requests', 'gaps', 'errors'))
+    for http2, result in results:
+        print('{0:<8} {1:<24} {2:>9} {3:>6} {4:>7}'.format(
+            str(http2).lower(),
+            ' '.join('{0}={1}'.format(k, v) for k, v in sorted(result['connections'].items())),
+            sum(result['requests'].values()),
+            result['total']['gaps'], result['total']['errors']))
+
+
+if __name__ == '__main__':
+    main()
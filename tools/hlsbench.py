@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''Load benchmark for hlssession and hlskeyuri with tools/hlsorigin.py
+
+    python tools/hlsbench.py --scenario expire --streams 20 --duration 30 \\
+        --option time=3 --option adaptive-reload=true
+
+The origin runs in its own process unless --url is used, so the CPU time
+of this process only contains the streams. For every stream the output
+is checked with the chunk markers of the origin:
+
+    gaps        missing chunks
+    duplicates  chunks that were written again
+    latency     seconds between the end of a chunk at the origin
+                and the time it was read from the stream
+
+Every part of a Low-Latency HLS segment has its own chunk, so a missing
+or reordered part is a gap or a duplicate:
+
+    python tools/hlsbench.py --scenario lowlatency --option low-latency=true
+'''
+from __future__ import print_function
+
+import argparse
+import imp
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from streamlink import Streamlink
+from streamlink.options import Options
+
+try:
+    from urllib.request import urlopen
+except ImportError:
+    from urllib2 import urlopen
+
+TOOLS = os.path.dirname(os.path.abspath(__file__))
+PLUGINS = os.path.join(os.path.dirname(TOOLS), 'plugins')
+
+_chunk_re = re.compile(br'<(\w+) (\d+)\.(\d+)>')
+
+
+def load_plugin(session, name):
+    '''Loads a fresh module of a plugin from plugins/ with default options'''
+    file, pathname, desc = imp.find_module(name, [PLUGINS])
+    session.load_plugin('streamlink.plugin.{0}'.format(name), file, pathname, desc)
+    plugin = session.plugins[name]
+    plugin.options = Options(dict((arg.dest, arg.default) for arg in plugin.arguments))
+    return plugin
+
+
+def parse_value(value):
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+class StreamCheck(object):
+    '''Gaps, duplicates and latency of the chunk markers of one stream'''
+
+    def __init__(self, status):
+        self.start_time = status['start_time']
+        self.segment_duration = status['segment_duration']
+        self.parts = status['parts']
+        self.buffer = b''
+        self.bytes = 0
+        self.chunks = 0
+        self.gaps = 0
+        self.duplicates = 0
+        self.variants = set()
+        self.last = None
+        self.keys = []
+        self.latencies = []
+
+    def feed(self, data, now=None):
+        now = now or time.time()
+        self.bytes += len(data)
+        self.buffer += data
+        end = 0
+        for match in _chunk_re.finditer(self.buffer):
+            end = match.end()
+            index, part = int(match.group(2)), int(match.group(3))
+            self.variants.add(match.group(1).decode('ascii'))
+            self.chunk(index, part, now)
+        # a marker can be split across reads
+        self.buffer = self.buffer[max(end, len(self.buffer) - 32):]
+
+    def chunk(self, index, part, now):
+        key = index * self.parts + part
+        self.chunks += 1
+        self.keys.append(key)
+        done = (self.start_time + index * self.segment_duration
+                + (part + 1) * self.segment_duration / self.parts)
+        self.latencies.append(now - done)
+        if self.last is not None:
+            if key <= self.last:
+                self.duplicates += 1
+                return
+            self.gaps += key - self.last - 1
+        self.last = key
+
+    def result(self):
+        latencies = sorted(self.latencies)
+        return {
+            'bytes': self.bytes,
+            'chunks': self.chunks,
+            'gaps': self.gaps,
+            'duplicates': self.duplicates,
+            'variants': sorted(self.variants),
+            'latency': latencies[len(latencies) // 2] if latencies else None,
+            'latency_p95': latencies[int(len(latencies) * 0.95)] if latencies else None,
+        }
+
+
+def status(url):
+    base = url.split('/master.m3u8')[0]
+    return json.loads(urlopen(base + '/status.json').read().decode('utf-8'))
+
+
+def read_stream(stream, check, duration, result):
+    start = time.time()
+    fd = stream.open()
+    result['open'] = time.time() - start
+    # a read without new data blocks until the stream is closed
+    timer = threading.Timer(max(duration - result['open'], 0), fd.close)
+    timer.daemon = True
+    timer.start()
+    try:
+        while time.time() - start < duration:
+            data = fd.read(8192)
+            if not data:
+                break
+            check.feed(data)
+    except Exception as err:
+        result['error'] = repr(err)
+    finally:
+        metrics = getattr(fd, 'metrics', None)
+        if metrics is not None:
+            result['metrics'] = metrics.to_json()
+        scheduler = getattr(getattr(fd, 'worker', None), 'reload_scheduler', None)
+        if scheduler is not None:
+            result['reload_scheduler'] = scheduler.stats()
+        timer.cancel()
+        fd.close()
+    result.update(check.result())
+
+
+def run(url, plugin='hlssession', streams=1, duration=5.0, stream_name='best',
+        options=None, session_options=None, status_url=None):
+    '''Reads streams of an origin at the same time
+
+    status_url is the URL of the origin for a proxy in front of it.
+    Returns a dict with the results of every stream and the totals.
+    '''
+    session = Streamlink()
+    for key, value in (session_options or {}).items():
+        session.set_option(key, value)
+    plugin_class = load_plugin(session, plugin)
+    options = dict(options or {})
+    if plugin == 'hlssession':
+        # per stream counters for the results
+        options.setdefault('metrics-file', os.path.join(
+            tempfile.gettempdir(), 'hlsbench-{0}.json'.format(os.getpid())))
+    for key, value in options.items():
+        plugin_class.options.set(key, value)
+
+    status_url = status_url or url
+    origin_status = status(status_url)
+    results = [{} for _ in range(streams)]
+    threads = []
+    cpu = time.process_time() if hasattr(time, 'process_time') else time.clock()
+    start = time.time()
+    for result in results:
+        resolved = session.streams('{0}://{1}'.format(plugin, url))
+        check = StreamCheck(origin_status)
+        thread = threading.Thread(target=read_stream,
+                                  args=(resolved[stream_name], check, duration, result))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join(duration + 30)
+    elapsed = time.time() - start
+    cpu = (time.process_time() if hasattr(time, 'process_time') else time.clock()) - cpu
+
+    stats = status(status_url)['stats']
+    total = {
+        'streams': streams,
+        'seconds': elapsed,
+        'throughput': sum(r.get('bytes', 0) for r in results) / elapsed,
+        'cpu_per_stream': cpu / streams,
+        'gaps': sum(r.get('gaps', 0) for r in results),
+        'duplicates': sum(r.get('duplicates', 0) for r in results),
+        'errors': sum(1 for r in results if 'error' in r),
+        'playlist_requests': stats.get('playlist', 0),
+        'origin': stats,
+    }
+    reload_latency = [r['metrics']['playlist_latency'] for r in results if 'metrics' in r]
+    if reload_latency and sum(h['count'] for h in reload_latency):
+        total['reload_latency'] = (sum(h['sum'] for h in reload_latency)
+                                   / sum(h['count'] for h in reload_latency))
+    latencies = sorted(r['latency'] for r in results if r.get('latency') is not None)
+    if latencies:
+        total['latency'] = latencies[len(latencies) // 2]
+    return {'total': total, 'streams': results}
+
+
+def start_origin(scenario, port, options):
+    '''Starts tools/hlsorigin.py in its own process'''
+    args = [sys.executable, os.path.join(TOOLS, 'hlsorigin.py'),
+            '--port', str(port), '--scenario', scenario]
+    for option in options:
+        key, value = option.split('=', 1)
+        args += ['--{0}'.format(key.replace('_', '-')), value]
+    process = subprocess.Popen(args, stdout=subprocess.PIPE)
+    # wait for the first line
+    if not process.stdout.readline():
+        raise SystemExit('The origin did not start: {0}'.format(' '.join(args[1:])))
+    return process, 'http://127.0.0.1:{0}/master.m3u8'.format(port)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='hlssession load benchmark')
+    parser.add_argument('--url', help='origin URL, instead of tools/hlsorigin.py')
+    parser.add_argument('--scenario', default='live')
+    parser.add_argument('--origin-option', action='append', default=[],
+                        metavar='KEY=VALUE', help='option of tools/hlsorigin.py')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--plugin', default='hlssession',
+                        choices=('hlssession', 'hlskeyuri'))
+    parser.add_argument('--streams', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--stream', default='best')
+    parser.add_argument('--option', action='append', default=[], metavar='KEY=VALUE',
+                        help='plugin option without the plugin prefix')
+    parser.add_argument('--session-option', action='append', default=[],
+                        metavar='KEY=VALUE', help='Streamlink session option')
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    process = None
+    url = args.url
+    if not url:
+        process, url = start_origin(args.scenario, args.port, args.origin_option)
+    try:
+        result = run(
+            url, plugin=args.plugin, streams=args.streams, duration=args.duration,
+            stream_name=args.stream,
+            options=dict((k, parse_value(v)) for k, v in
+                         (o.split('=', 1) for o in args.option)),
+            session_options=dict((k, parse_value(v)) for k, v in
+                                 (o.split('=', 1) for o in args.session_option)))
+    finally:
+        if process is not None:
+            process.terminate()
+
+    if args.json:
+        print(json.dumps(result, indent=2, sort_keys=True))
+        return
+
+    total = result['total']
+    print('streams             {0}'.format(total['streams']))
+    print('throughput          {0:.1f} KB/s'.format(total['throughput'] / 1000))
+    print('cpu per stream      {0:.3f} s'.format(total['cpu_per_stream']))
+    print('gaps                {0}'.format(total['gaps']))
+    print('duplicates          {0}'.format(total['duplicates']))
+    print('errors              {0}'.format(total['errors']))
+    print('playlist requests   {0}'.format(total['playlist_requests']))
+    if 'reload_latency' in total:
+        print('reload latency      {0:.3f} s'.format(total['reload_latency']))
+    if 'latency' in total:
+        print('latency behind live {0:.3f} s'.format(total['latency']))
+
+
+if __name__ == '__main__':
+    main()
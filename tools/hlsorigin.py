@@ -0,0 +1,543 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''Local HLS origin for hlssession and hlskeyuri tests and benchmarks
+
+    python tools/hlsorigin.py --port 8080 --scenario expire
+    streamlink --plugin-dirs plugins \\
+        "hlssession://http://127.0.0.1:8080/master.m3u8" best
+
+URLs
+    /master.m3u8                      master playlist, every request starts a new session
+    /<session>/<variant>.m3u8         media playlist
+    /<session>/<variant>_<n>.ts       segment
+    /<session>/<variant>_<n>.<p>.ts   part of a Low-Latency HLS segment
+    /<session>/key/<k>                AES-128 key
+    /status.json                      timing and request counters
+
+Every segment is made of one chunk per part, a chunk starts with
+``<variant n.p>`` and is padded with dots. ``n`` is the position in the
+live stream and does not depend on the media sequence numbers of a
+session, tools/hlsbench.py uses it to find gaps and duplicates.
+'''
+from __future__ import print_function
+
+import argparse
+import hashlib
+import hmac
+import json
+import math
+import random
+import re
+import struct
+import sys
+import threading
+import time
+
+from datetime import datetime
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlparse
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs, urlparse
+
+try:
+    from Crypto.Cipher import AES
+except ImportError:
+    AES = None
+
+# named configurations for --scenario, tests and tools/hlsbench.py
+SCENARIOS = {
+    # a plain live stream
+    'live': {},
+    # signed URLs that expire, a new session has new URLs
+    'expire': {'token_ttl': 4, 'session_names': True},
+    # the playlist of a session is removed
+    'dead': {'dead_after': 4},
+    # the media sequence of a new session starts again at 0
+    'restart': {'sequence_mode': 'restart', 'token_ttl': 4},
+    # the media sequence of a new session jumps by 1000
+    'jump': {'sequence_mode': 'jump', 'token_ttl': 4, 'dates': False,
+             'session_names': True},
+    # the media sequence restarts within a session
+    'reset': {'reset_after': 4, 'first_sequence': 1000},
+    # random 403 responses for segments and playlists
+    'errors': {'error_rate': 0.1, 'playlist_error_rate': 0.1},
+    # slow segment responses
+    'stall': {'stall_rate': 0.2, 'stall': 1.5},
+    # the playlist does not change for some time
+    'freeze': {'freeze_after': 3, 'freeze_for': 3},
+    # the live playlist has no segments for some time
+    'empty': {'empty_after': 3, 'empty_for': 4},
+    # Low-Latency HLS with parts and blocking playlist reloads
+    'lowlatency': {'parts': 4, 'window': 4},
+    # AES-128 with a new key every 3 segments
+    'encrypted': {'key_rotation': 3},
+}
+
+
+class HLSOrigin(object):
+    '''Simulated live HLS origin
+
+    Args:
+        segment_duration: seconds per segment, the segment rate
+        window: segments in a media playlist
+        variants: names of the variants in the master playlist
+        segment_size: bytes per segment
+        dates: add EXT-X-PROGRAM-DATE-TIME
+        session_names: add the session to the segment filenames
+        token_ttl: seconds until the URLs of a session expire with 403
+        dead_after: seconds until the playlist of a session returns 404
+        sequence_mode: media sequence of a new session,
+                       continuous, restart or jump
+        first_sequence: media sequence of the first segment
+        reset_after: seconds until the media sequence of a session restarts
+        error_rate: probability of a 403 for a segment
+        playlist_error_rate: probability of a 403 for a playlist
+        stall_rate: probability of a slow segment response
+        stall: seconds of a slow segment response
+        freeze_after: seconds until the playlist stops to change
+        freeze_for: seconds the playlist does not change
+        empty_after: seconds until the playlist has no segments
+        empty_for: seconds the playlist has no segments
+        parts: parts per segment, more than 1 for Low-Latency HLS
+        key_rotation: segments per AES-128 key, 0 without encryption
+        rate: bytes per second of a segment response, 0 without a limit
+    '''
+
+    def __init__(self, port=0, segment_duration=1.0, window=5,
+                 variants=('240p', '480p'), segment_size=2000, dates=True,
+                 session_names=False, token_ttl=0, dead_after=0,
+                 sequence_mode='continuous', first_sequence=0, reset_after=0,
+                 error_rate=0.0, playlist_error_rate=0.0, stall_rate=0.0,
+                 stall=0.0, freeze_after=0, freeze_for=0, empty_after=0,
+                 empty_for=0, parts=1, key_rotation=0, rate=0, seed=None):
+        self.port = port
+        self.segment_duration = float(segment_duration)
+        self.window = window
+        self.variants = list(variants)
+        self.segment_size = segment_size
+        self.dates = dates
+        self.session_names = session_names
+        self.token_ttl = token_ttl
+        self.dead_after = dead_after
+        self.sequence_mode = sequence_mode
+        self.first_sequence = first_sequence
+        self.reset_after = reset_after
+        self.error_rate = error_rate
+        self.playlist_error_rate = playlist_error_rate
+        self.stall_rate = stall_rate
+        self.stall = stall
+        self.freeze_after = freeze_after
+        self.freeze_for = freeze_for
+        self.empty_after = empty_after
+        self.empty_for = empty_for
+        self.parts = max(int(parts), 1)
+        self.key_rotation = key_rotation
+        self.rate = rate
+        if key_rotation and AES is None:
+            raise ImportError('pycryptodome is required for key_rotation')
+
+        self.secret = b'hlsorigin'
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.sessions = {}
+        self.stats = {}
+        self.server = None
+        self.started = None
+        self.start_time = None
+
+    @classmethod
+    def scenario(cls, name, **options):
+        config = dict(SCENARIOS[name])
+        config.update(options)
+        return cls(**config)
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{0}/master.m3u8'.format(self.port)
+
+    @property
+    def part_duration(self):
+        return self.segment_duration / self.parts
+
+    def start(self):
+        self.server = HLSOriginServer(('127.0.0.1', self.port), HLSOriginHandler)
+        self.server.origin = self
+        self.port = self.server.server_address[1]
+        self.started = time.time()
+        # the first segments are available at the start
+        self.start_time = self.started - self.window * self.segment_duration
+        thread = threading.Thread(target=self.server.serve_forever,
+                                  name='Thread-HLSOrigin')
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.stats[name] = self.stats.get(name, 0) + value
+
+    # stream position
+
+    def elapsed(self, now=None):
+        return (now or time.time()) - self.start_time
+
+    def live_position(self, now=None):
+        '''index of the segment in progress and its completed parts'''
+        now = now or time.time()
+        if self.freeze_for:
+            # the playlist stops at freeze_after and catches up later
+            freeze_start = self.started + self.freeze_after
+            if freeze_start < now < freeze_start + self.freeze_for:
+                now = freeze_start
+        elapsed = self.elapsed(now)
+        index = int(elapsed // self.segment_duration)
+        part = int((elapsed - index * self.segment_duration) // self.part_duration)
+        return index, min(part, self.parts - 1)
+
+    def chunk_time(self, index, part):
+        '''time when a part is complete'''
+        return (self.start_time + index * self.segment_duration
+                + (part + 1) * self.part_duration)
+
+    # sessions
+
+    def new_session(self):
+        with self.lock:
+            session_id = len(self.sessions) + 1
+            now = time.time()
+            index = self.live_position(now)[0]
+            if self.sequence_mode == 'restart':
+                offset = self.window - index
+            elif self.sequence_mode == 'jump':
+                offset = 1000 * (session_id - 1)
+            else:
+                offset = 0
+            self.sessions[session_id] = {
+                'created': now,
+                'offset': offset + self.first_sequence,
+                # whole seconds in the token, not less than token_ttl
+                'expires': int(math.ceil(now + self.token_ttl)) if self.token_ttl else 0,
+            }
+        self.count('sessions')
+        return session_id
+
+    def session_sequence(self, session, index, now=None):
+        '''media sequence number of a segment'''
+        sequence = index + session['offset']
+        if self.reset_after:
+            reset = int((session['created'] + self.reset_after - self.start_time)
+                        // self.segment_duration)
+            if (now or time.time()) - session['created'] >= self.reset_after:
+                # the first segment of the playlist at the reset is 0
+                sequence = index - reset + self.window
+        return sequence
+
+    def token(self, session_id):
+        expires = self.sessions[session_id]['expires']
+        message = '{0}:{1}'.format(session_id, expires).encode('ascii')
+        signature = hmac.new(self.secret, message, hashlib.sha1).hexdigest()[:16]
+        return '{0}.{1}'.format(expires, signature)
+
+    def check_token(self, session_id, token):
+        session = self.sessions.get(session_id)
+        if session is None:
+            return False
+        if not session['expires']:
+            return True
+        if token != self.token(session_id):
+            return False
+        return time.time() < session['expires']
+
+    def query(self, session_id):
+        if not self.token_ttl:
+            return ''
+        return '?token={0}'.format(self.token(session_id))
+
+    # content
+
+    def chunk(self, variant, index, part):
+        size = max(self.segment_size // self.parts, 32)
+        data = '<{0} {1}.{2}>'.format(variant, index, part).encode('ascii')
+        return data + b'.' * (size - len(data))
+
+    def key(self, key_index):
+        return hashlib.sha1(self.secret + str(key_index).encode('ascii')).digest()[:16]
+
+    def iv(self, index):
+        return struct.pack('>QQ', 0, index)
+
+    def encrypt(self, index, data):
+        padding = 16 - len(data) % 16
+        data += bytes(bytearray([padding] * padding))
+        cipher = AES.new(self.key(index // self.key_rotation), AES.MODE_CBC, self.iv(index))
+        return cipher.encrypt(data)
+
+    def segment(self, variant, index, part=None):
+        if part is None:
+            data = b''.join(self.chunk(variant, index, p) for p in range(self.parts))
+        else:
+            data = self.chunk(variant, index, part)
+        if self.key_rotation:
+            data = self.encrypt(index, data)
+        return data
+
+    def filename(self, session_id, variant, index, part=None):
+        name = '{0}_{1}'.format(variant, index)
+        if self.session_names:
+            name = 's{0}_{1}'.format(session_id, name)
+        if part is not None:
+            name = '{0}.{1}'.format(name, part)
+        return '{0}.ts{1}'.format(name, self.query(session_id))
+
+    def master_playlist(self, session_id):
+        lines = ['#EXTM3U']
+        for i, variant in enumerate(self.variants):
+            height = int(re.sub(r'\D', '', variant) or 360)
+            lines.append('#EXT-X-STREAM-INF:BANDWIDTH={0},RESOLUTION={1}x{2}'.format(
+                (i + 1) * 500000, height * 16 // 9, height))
+            lines.append('/{0}/{1}.m3u8{2}'.format(session_id, variant, self.query(session_id)))
+        return '\n'.join(lines) + '\n'
+
+    def media_playlist(self, session_id, variant, now=None):
+        now = now or time.time()
+        session = self.sessions[session_id]
+        index, part = self.live_position(now)
+        first = max(index - self.window, 0)
+        low_latency = self.parts > 1
+        target = int(self.segment_duration + 0.999)
+
+        lines = ['#EXTM3U', '#EXT-X-VERSION:6',
+                 '#EXT-X-TARGETDURATION:{0}'.format(target)]
+        if low_latency:
+            lines.append('#EXT-X-SERVER-CONTROL:CAN-BLOCK-RELOAD=YES,PART-HOLD-BACK={0:.3f}'.format(
+                self.part_duration * 3))
+            lines.append('#EXT-X-PART-INF:PART-TARGET={0:.3f}'.format(self.part_duration))
+        empty_start = self.started + self.empty_after
+        if self.empty_for and empty_start < now < empty_start + self.empty_for:
+            lines.append('#EXT-X-MEDIA-SEQUENCE:{0}'.format(
+                self.session_sequence(session, index, now)))
+            return '\n'.join(lines) + '\n'
+
+        lines.append('#EXT-X-MEDIA-SEQUENCE:{0}'.format(
+            self.session_sequence(session, first, now)))
+        for n in range(first, index):
+            if self.key_rotation and (n == first or n % self.key_rotation == 0):
+                lines.append('#EXT-X-KEY:METHOD=AES-128,URI="key/{0}{1}",IV=0x{2}'.format(
+                    n // self.key_rotation, self.query(session_id),
+                    ''.join('{0:02x}'.format(b) for b in bytearray(self.iv(n)))))
+            if self.dates:
+                date = datetime.utcfromtimestamp(self.start_time + n * self.segment_duration)
+                lines.append('#EXT-X-PROGRAM-DATE-TIME:{0}Z'.format(
+                    date.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3]))
+            if low_latency and n >= index - 2:
+                for p in range(self.parts):
+                    lines.append('#EXT-X-PART:DURATION={0:.3f},URI="{1}"{2}'.format(
+                        self.part_duration, self.filename(session_id, variant, n, p),
+                        ',INDEPENDENT=YES' if p == 0 else ''))
+            lines.append('#EXTINF:{0:.3f},'.format(self.segment_duration))
+            lines.append(self.filename(session_id, variant, n))
+        if low_latency:
+            # completed parts of the segment in progress
+            for p in range(part):
+                lines.append('#EXT-X-PART:DURATION={0:.3f},URI="{1}"{2}'.format(
+                    self.part_duration, self.filename(session_id, variant, index, p),
+                    ',INDEPENDENT=YES' if p == 0 else ''))
+            lines.append('#EXT-X-PRELOAD-HINT:TYPE=PART,URI="{0}"'.format(
+                self.filename(session_id, variant, index, part)))
+        return '\n'.join(lines) + '\n'
+
+    def wait_part(self, index, part, timeout):
+        '''blocks until a part is complete'''
+        deadline = time.time() + timeout
+        while True:
+            remaining = self.chunk_time(index, part) - time.time()
+            if remaining <= 0:
+                return True
+            if time.time() + remaining > deadline:
+                return False
+            time.sleep(min(remaining, 0.05))
+
+
+class HLSOriginHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    _playlist_re = re.compile(r'^/(?P<session>\d+)/(?P<variant>\w+)\.m3u8$')
+    _segment_re = re.compile(
+        r'^/(?P<session>\d+)/(?:s\d+_)?(?P<variant>\w+?)_(?P<index>\d+)(?:\.(?P<part>\d+))?\.ts$')
+    _key_re = re.compile(r'^/(?P<session>\d+)/key/(?P<key>\d+)$')
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, body, content_type, rate=0):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if not rate:
+            self.wfile.write(body)
+            return
+        start = time.time()
+        view = memoryview(body)
+        for offset in range(0, len(body), 64 * 1024):
+            delay = start + offset / float(rate) - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            self.wfile.write(view[offset:offset + 64 * 1024])
+
+    def send_status(self, status):
+        self.server.origin.count('status_{0}'.format(status))
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        origin = self.server.origin
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        token = query.get('token', [''])[0]
+
+        if url.path == '/status.json':
+            with origin.lock:
+                status = json.dumps({
+                    'start_time': origin.start_time,
+                    'segment_duration': origin.segment_duration,
+                    'parts': origin.parts,
+                    'stats': origin.stats,
+                })
+            self.send_body(status.encode('ascii'), 'application/json')
+            return
+
+        if url.path == '/master.m3u8':
+            origin.count('master')
+            session_id = origin.new_session()
+            self.send_body(origin.master_playlist(session_id).encode('ascii'),
+                           'application/vnd.apple.mpegurl')
+            return
+
+        match = (self._playlist_re.match(url.path)
+                 or self._segment_re.match(url.path)
+                 or self._key_re.match(url.path))
+        if not match:
+            self.send_status(404)
+            return
+
+        session_id = int(match.group('session'))
+        session = origin.sessions.get(session_id)
+        if session is None:
+            self.send_status(404)
+            return
+        if not origin.check_token(session_id, token):
+            self.send_status(403)
+            return
+
+        if match.re is self._playlist_re:
+            origin.count('playlist')
+            if origin.dead_after and time.time() - session['created'] > origin.dead_after:
+                self.send_status(404)
+                return
+            if origin.random.random() < origin.playlist_error_rate:
+                self.send_status(403)
+                return
+            msn = query.get('_HLS_msn')
+            if msn and origin.parts > 1:
+                # blocking playlist reload
+                origin.count('playlist_blocked')
+                index = int(msn[0]) - session['offset']
+                part = int(query.get('_HLS_part', ['0'])[0])
+                if part >= origin.parts:
+                    index, part = index + 1, 0
+                if not origin.wait_part(index, part, origin.segment_duration * 3):
+                    self.send_status(503)
+                    return
+            body = origin.media_playlist(session_id, match.group('variant'))
+            self.send_body(body.encode('ascii'), 'application/vnd.apple.mpegurl')
+        elif match.re is self._segment_re:
+            index = int(match.group('index'))
+            part = match.group('part')
+            part = None if part is None else int(part)
+            origin.count('part' if part is not None else 'segment')
+            if part is not None:
+                # a preload hint is answered when the part is complete
+                if not origin.wait_part(index, part, origin.segment_duration * 3):
+                    self.send_status(404)
+                    return
+            elif origin.chunk_time(index, origin.parts - 1) > time.time():
+                self.send_status(404)
+                return
+            if origin.random.random() < origin.error_rate:
+                self.send_status(403)
+                return
+            if origin.random.random() < origin.stall_rate:
+                origin.count('stalls')
+                time.sleep(origin.stall)
+            self.send_body(origin.segment(match.group('variant'), index, part), 'video/mp2t',
+                           rate=origin.rate)
+        else:
+            origin.count('key')
+            self.send_body(origin.key(int(match.group('key'))), 'application/octet-stream')
+
+
+class HLSOriginServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    origin = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local HLS origin')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), default='live')
+    parser.add_argument('--segment-duration', type=float)
+    parser.add_argument('--window', type=int)
+    parser.add_argument('--segment-size', type=int)
+    parser.add_argument('--token-ttl', type=float)
+    parser.add_argument('--dead-after', type=float)
+    parser.add_argument('--first-sequence', type=int)
+    parser.add_argument('--reset-after', type=float)
+    parser.add_argument('--error-rate', type=float)
+    parser.add_argument('--playlist-error-rate', type=float)
+    parser.add_argument('--stall-rate', type=float)
+    parser.add_argument('--stall', type=float)
+    parser.add_argument('--freeze-after', type=float)
+    parser.add_argument('--freeze-for', type=float)
+    parser.add_argument('--empty-after', type=float)
+    parser.add_argument('--empty-for', type=float)
+    parser.add_argument('--parts', type=int)
+    parser.add_argument('--key-rotation', type=int)
+    parser.add_argument('--rate', type=float)
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    options = dict((k, v) for k, v in vars(args).items()
+                   if v is not None and k != 'scenario')
+    origin = HLSOrigin.scenario(args.scenario, **options).start()
+    print('HLS origin: {0} ({1})'.format(origin.url, args.scenario))
+    sys.stdout.flush()
+    try:
+        while True:
+            time.sleep(10)
+            print(sorted(origin.stats.items()))
+    except KeyboardInterrupt:
+        origin.stop()
+
+
+if __name__ == '__main__':
+    main()
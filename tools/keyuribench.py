@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''Time to first byte and memory of encrypted segments with hlskeyuri
+
+    python tools/keyuribench.py --segment-size 20000000 --rate 50000000
+
+tools/hlsorigin.py serves AES-128 segments of --segment-size bytes with
+--rate bytes per second. Every stream is read in its own process, once
+with the hls plugin of Streamlink, which decrypts a segment after its
+download, and once with hlskeyuri:
+
+    ttfb      seconds from the open of the stream to the first byte
+    rss       peak RSS of the process while the stream is read,
+              without the RSS before the open
+'''
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools import hlsbench  # noqa: E402
+
+
+def current_rss():
+    '''RSS of this process in bytes, the peak RSS without /proc'''
+    try:
+        with open('/proc/self/statm') as fd:
+            return int(fd.read().split()[1]) * resource.getpagesize()
+    except (IOError, OSError):
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS
+        return rss if sys.platform == 'darwin' else rss * 1024
+
+
+class PeakRSS(threading.Thread):
+    def __init__(self, interval=0.01):
+        threading.Thread.__init__(self, name='Thread-PeakRSS')
+        self.daemon = True
+        self.interval = interval
+        self.peak = current_rss()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        return max(self.peak, current_rss())
+
+
+def read(url, plugin, duration, options=None):
+    '''Reads a stream, returns the time to first byte and the memory'''
+    from streamlink import Streamlink
+
+    session = Streamlink()
+    if plugin != 'hls':
+        plugin_class = hlsbench.load_plugin(session, plugin)
+        for key, value in (options or {}).items():
+            plugin_class.options.set(key, value)
+    stream = session.streams('{0}://{1}'.format(plugin, url))['best']
+
+    rss_open = current_rss()
+    peak = PeakRSS()
+    peak.start()
+    start = time.time()
+    fd = stream.open()
+    timer = threading.Timer(duration, fd.close)
+    timer.daemon = True
+    timer.start()
+    ttfb = None
+    size = 0
+    try:
+        while time.time() - start < duration:
+            data = fd.read(64 * 1024)
+            if not data:
+                break
+            if ttfb is None:
+                ttfb = time.time() - start
+            size += len(data)
+    finally:
+        timer.cancel()
+        fd.close()
+    return {
+        'ttfb': ttfb,
+        'bytes': size,
+        'rss': peak.stop() - rss_open,
+    }
+
+
+def run(url, plugin, duration, options=None):
+    '''read() in a new process'''
+    args = [sys.executable, os.path.abspath(__file__), '--read', url,
+            '--plugin', plugin, '--duration', str(duration)]
+    for key, value in (options or {}).items():
+        args += ['--option', '{0}={1}'.format(key, json.dumps(value))]
+    return json.loads(subprocess.check_output(args).decode('utf-8'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='hlskeyuri time to first byte and memory')
+    parser.add_argument('--segment-size', type=int, default=20 * 1000 * 1000)
+    parser.add_argument('--rate', type=float, default=50 * 1000 * 1000,
+                        help='bytes per second of a segment response')
+    parser.add_argument('--segment-duration', type=float, default=4.0)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--port', type=int, default=8091)
+    parser.add_argument('--plugin', action='append',
+                        choices=('hls', 'hlskeyuri'))
+    parser.add_argument('--option', action='append', default=[], metavar='KEY=VALUE',
+                        help='hlskeyuri option without the plugin prefix')
+    parser.add_argument('--read', metavar='URL', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    options = dict((k, hlsbench.parse_value(v)) for k, v in
+                   (o.split('=', 1) for o in args.option))
+    if args.read:
+        print(json.dumps(read(args.read, args.plugin[0], args.duration, options)))
+        return
+
+    process, url = hlsbench.start_origin('encrypted', args.port, [
+        'segment_size={0}'.format(args.segment_size),
+        'segment_duration={0}'.format(args.segment_duration),
+        'rate={0}'.format(args.rate),
+    ])
+    try:
+        results = [(plugin, run(url, plugin, args.duration,
+                                options if plugin != 'hls' else None))
+                   for plugin in args.plugin or ('hls', 'hlskeyuri')]
+    finally:
+        process.terminate()
+
+    print('segments of {0:.1f} MB at {1:.1f} MB/s'.format(args.segment_size / 1e6,
+                                                          args.rate / 1e6))
+    print('{0:<10} {1:>9} {2:>10} {3:>9}'.format('plugin', 'ttfb', 'rss', 'read'))
+    for plugin, result in results:
+        print('{0:<10} {1:>8.3f}s {2:>7.1f} MB {3:>6.1f} MB'.format(
+            plugin, result['ttfb'] or float('nan'), result['rss'] / 1e6,
+            result['bytes'] / 1e6))
+
+
+if __name__ == '__main__':
+    main()
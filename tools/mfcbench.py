@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''Throughput of the MyFreeCams chat message parser
+
+    python tools/mfcbench.py --messages 10000
+
+The messages of a model list are read from WebSocket frames of
+different sizes. The parser should have about the same throughput for
+small frames and for one frame with all messages.
+'''
+from __future__ import print_function
+
+import argparse
+import imp
+import json
+import os
+import time
+
+try:
+    from urllib.parse import quote
+except ImportError:
+    from urllib import quote
+
+PLUGINS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'plugins')
+
+timer = getattr(time, 'perf_counter', time.time)
+
+
+def load_plugin(name):
+    file, pathname, desc = imp.find_module(name, [PLUGINS])
+    try:
+        return imp.load_module('streamlink.plugin.{0}'.format(name), file, pathname, desc)
+    finally:
+        file.close()
+
+
+def message(FCTYPE, nArg1, data):
+    message = '{0} 0 0 {1} 0 {2}'.format(FCTYPE, nArg1, quote(json.dumps(data)))
+    return '{0:04d}{1}'.format(len(message), message)
+
+
+def model_list(count):
+    '''FCTYPE 20 messages of a model list'''
+    return ''.join(message(20, n, {
+        'nm': 'model{0}'.format(n), 'sid': n, 'uid': 100000 + n, 'vs': 0,
+        'u': {'camserv': 1001, 'camscore': 1.5, 'chat_opt': 1},
+        'm': {'topic': 'topic of the model ' * 4},
+    }) for n in range(count))
+
+
+def run(parser_class, data, frame_size):
+    '''Returns the messages per second for frames of frame_size'''
+    frames = [data[i:i + frame_size] for i in range(0, len(data), frame_size)]
+    parser = parser_class()
+    count = 0
+    start = timer()
+    for frame in frames:
+        parser.feed(frame)
+        for _ in parser.messages():
+            count += 1
+    return count, count / (timer() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='MyFreeCams parser throughput')
+    parser.add_argument('--messages', type=int, default=10000)
+    parser.add_argument('--frame-size', type=int, action='append',
+                        help='bytes per frame, all messages in one frame by default')
+    args = parser.parse_args()
+
+    myfreecams = load_plugin('myfreecams')
+    data = model_list(args.messages)
+    frame_sizes = args.frame_size or [1024, 16 * 1024, 256 * 1024, len(data)]
+    print('{0} messages, {1:.1f} MB'.format(args.messages, len(data) / 1e6))
+    for frame_size in frame_sizes:
+        count, rate = run(myfreecams.MyFreeCamsParser, data, frame_size)
+        if count != args.messages:
+            raise SystemExit('{0} of {1} messages'.format(count, args.messages))
+        print('frame {0:>10} bytes  {1:>10.0f} messages/s'.format(frame_size, rate))
+
+
+if __name__ == '__main__':
+    main()